@@ -1,3 +1,32 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import PaymentEvent, PersistedQuery
+
+
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "event_type", "reference", "status", "attempts", "received_at")
+    list_filter = ("status", "event_type")
+    search_fields = ("event_key", "reference")
+    readonly_fields = (
+        "payload",
+        "attempts",
+        "response_status",
+        "response_message",
+        "last_error",
+        "received_at",
+        "started_at",
+        "processed_at",
+    )
+
+
+admin.site.register(PaymentEvent, PaymentEventAdmin)
+
+
+class PersistedQueryAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "operation_name", "allowlisted", "created_at")
+    list_filter = ("allowlisted",)
+    search_fields = ("sha256_hash", "operation_name")
+    readonly_fields = ("sha256_hash", "query", "created_at")
+
+
+admin.site.register(PersistedQuery, PersistedQueryAdmin)
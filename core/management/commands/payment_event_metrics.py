@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from core.models import PaymentEvent
+
+
+class Command(BaseCommand):
+    help = "Show the Paystack event latencies per event type"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24)
+
+    def handle(self, *args, **kwargs):
+        since = timezone.now() - timezone.timedelta(hours=kwargs["hours"])
+        metrics = PaymentEvent.get_latency_metrics(since=since)
+
+        def format_seconds(value):
+            return "-" if value is None else f"{value:.2f}s"
+
+        for event_type, row in sorted(metrics.items()):
+            latency, processing = row["latency"], row["processing"]
+            self.stdout.write(
+                f"{event_type}: {row['count']} events, {row['not_processed']} not processed, "
+                f"latency p50 {format_seconds(latency['p50'])} p95 {format_seconds(latency['p95'])} "
+                f"max {format_seconds(latency['max'])}, processing p50 "
+                f"{format_seconds(processing['p50'])} p95 {format_seconds(processing['p95'])}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully computed the metrics of {len(metrics)} event types"
+            )
+        )
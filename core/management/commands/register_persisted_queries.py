@@ -0,0 +1,67 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from graphql import get_operation_ast, parse, validate
+from graphql.error import GraphQLError
+from core.models import PersistedQuery
+
+
+class Command(BaseCommand):
+    help = (
+        "Allowlist the persisted queries of the clients, from .graphql files "
+        "or persisted query manifests"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="+",
+            help=".graphql files (one operation each) or JSON manifests, "
+            'eg: {"operations": [{"id": "<sha256>", "name": "...", "body": "..."}]} '
+            'or {"<sha256>": "<query>"}',
+        )
+
+    def read_queries(self, path):
+        path = Path(path)
+        if not path.exists():
+            raise CommandError(f"{path} does not exist")
+        if path.suffix != ".json":
+            return [(None, path.read_text())]
+
+        manifest = json.loads(path.read_text())
+        if "operations" in manifest:
+            return [
+                (operation.get("id"), operation["body"])
+                for operation in manifest["operations"]
+            ]
+        return list(manifest.items())
+
+    def handle(self, *args, **kwargs):
+        from trayapp.schema import schema
+
+        queries = []
+        for path in kwargs["paths"]:
+            for sha256_hash, query in self.read_queries(path):
+                if sha256_hash and sha256_hash != PersistedQuery.get_hash(query):
+                    raise CommandError(
+                        f"The hash {sha256_hash} of {path} does not match its query"
+                    )
+                try:
+                    document = parse(query)
+                except GraphQLError as e:
+                    raise CommandError(f"Invalid query in {path}: {e.message}")
+                errors = validate(schema.graphql_schema, document)
+                if errors:
+                    raise CommandError(f"Invalid query in {path}: {errors[0].message}")
+                operation = get_operation_ast(document)
+                queries.append(
+                    (query, operation.name.value if operation and operation.name else None)
+                )
+
+        for query, operation_name in queries:
+            PersistedQuery.register(query, operation_name=operation_name, allowlisted=True)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully allowlisted {len(queries)} queries")
+        )
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from core.models import PaymentEvent
+
+
+class Command(BaseCommand):
+    help = "Queue the stored Paystack events again (the failed ones by default) and process them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--id", type=int, nargs="+", dest="ids", help="Ids of the events to replay"
+        )
+        parser.add_argument(
+            "--reference", help="Replay the events of an order / transaction reference"
+        )
+        parser.add_argument(
+            "--status",
+            nargs="+",
+            default=["failed"],
+            choices=["processed", "rejected", "failed"],
+            help="Statuses of the events to replay",
+        )
+        parser.add_argument(
+            "--since-hours", type=int, help="Only the events received in the last hours"
+        )
+        parser.add_argument(
+            "--queue-only",
+            action="store_true",
+            help="Leave the queued events to the payment event workers",
+        )
+
+    def handle(self, *args, **kwargs):
+        events = PaymentEvent.objects.all()
+        if kwargs["ids"]:
+            events = events.filter(id__in=kwargs["ids"])
+        elif kwargs["reference"]:
+            events = events.filter(reference=kwargs["reference"])
+        else:
+            events = events.filter(status__in=kwargs["status"])
+        if kwargs["since_hours"]:
+            events = events.filter(
+                received_at__gte=timezone.now()
+                - timezone.timedelta(hours=kwargs["since_hours"])
+            )
+
+        queued = PaymentEvent.replay(events)
+        if not queued:
+            raise CommandError("No event to replay")
+
+        processed = 0
+        if not kwargs["queue_only"]:
+            processed = PaymentEvent.process_pending()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully queued {queued} events and processed {processed} events"
+            )
+        )
@@ -0,0 +1,329 @@
+import json
+import time
+import hashlib
+import logging
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+
+def get_percentile(values, percentile):
+    """
+    Nearest-rank percentile of the values, None when there are no values
+    eg: get_percentile([1, 2, 3, 4], 50) -> 2
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, -(-len(values) * percentile // 100) - 1)
+    return values[int(index)]
+
+
+class PaymentEvent(models.Model):
+    """
+    Raw Paystack webhook events. The webhook only verifies and stores the event,
+    it is processed by `process_next()` from the PaymentEventWorkerThread pool
+    or the replay_payment_events command.
+    Paystack retries an event until it gets a 200, `event_key` makes the retries no-ops.
+    """
+
+    STATUS = (
+        ("pending", "pending"),
+        # processed and answered with a 2xx
+        ("processed", "processed"),
+        # processed and answered with an error, eg: the order does not exist
+        ("rejected", "rejected"),
+        # raised on every attempt
+        ("failed", "failed"),
+    )
+    MAX_ATTEMPTS = 5
+    # seconds before the first retry, doubled after every failed attempt
+    RETRY_DELAY = 30
+
+    event_key = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    # the order / transaction the event is about, its events are processed one at a time
+    reference = models.CharField(max_length=255, db_index=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    response_status = models.PositiveIntegerField(null=True, blank=True)
+    response_message = models.TextField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    received_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["received_at"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+            models.Index(fields=["event_type", "received_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.event_type} #{self.id} ({self.status})"
+
+    @staticmethod
+    def get_event_key(event, raw_body):
+        # the id of the charge / transfer / refund, the body hash when there is none
+        data = event.get("data") or {}
+        if isinstance(data, dict) and data.get("id"):
+            return f"{event['event']}:{data['id']}"
+        return f"{event['event']}:{hashlib.sha256(raw_body).hexdigest()}"
+
+    @staticmethod
+    def get_reference(event, event_key):
+        data = event.get("data") or {}
+        if not isinstance(data, dict):
+            return event_key
+        transaction_data = data.get("transaction")
+        return str(
+            data.get("transaction_reference")
+            or data.get("reference")
+            or (isinstance(transaction_data, dict) and transaction_data.get("reference"))
+            or event_key
+        )
+
+    @classmethod
+    def record(cls, raw_body):
+        """
+        Store a verified webhook body, returns (event, created),
+        `created` is False for a retry of an event that was already received.
+        Raises ValueError when the body is not a Paystack event
+        ```python
+        event, created = PaymentEvent.record(request.body)
+        ```
+        """
+        try:
+            event = json.loads(raw_body)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"Invalid event body: {e}")
+        if not isinstance(event, dict) or "event" not in event or "data" not in event:
+            raise ValueError("Invalid event body: missing event or data")
+
+        event_key = cls.get_event_key(event, raw_body)
+        payment_event, created = cls.objects.get_or_create(
+            event_key=event_key,
+            defaults={
+                "event_type": event["event"],
+                "reference": cls.get_reference(event, event_key)[:255],
+                "payload": event["data"],
+            },
+        )
+        if created and settings.PAYMENT_EVENTS_AUTO_PROCESS:
+            from users.threads import PaymentEventWorkerThread
+
+            transaction.on_commit(PaymentEventWorkerThread.wake_up)
+        return payment_event, created
+
+    @staticmethod
+    def lock_reference(reference):
+        # serialize the events of the same order across the workers and the processes,
+        # released when the transaction ends
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [reference])
+
+    def run(self):
+        """
+        Process the event, returns the response of ProcessPayment
+        """
+        from core.utils import ProcessPayment
+
+        return ProcessPayment(self.event_type, self.payload).process_payment()
+
+    @classmethod
+    def process_next(cls):
+        """
+        Process the oldest due event, returns it or None when there is none.
+        The event row stays locked while it is processed so it is processed once,
+        its changes and its new status are committed together.
+        """
+        with transaction.atomic():
+            event = (
+                cls.objects.select_for_update(skip_locked=True)
+                .filter(status="pending", next_attempt_at__lte=timezone.now())
+                .order_by("received_at", "id")
+                .first()
+            )
+            if event is None:
+                return None
+
+            cls.lock_reference(event.reference)
+            event.started_at = timezone.now()
+            event.attempts += 1
+            start_time = time.monotonic()
+            try:
+                with transaction.atomic():
+                    response = event.run()
+            except Exception as e:
+                logging.exception(f"Error processing payment event {event.event_key}: {e}")
+                event.last_error = str(e)
+                if event.attempts >= cls.MAX_ATTEMPTS:
+                    event.status = "failed"
+                else:
+                    # retry later with an exponential backoff
+                    event.next_attempt_at = timezone.now() + timezone.timedelta(
+                        seconds=cls.RETRY_DELAY * 2 ** (event.attempts - 1)
+                    )
+            else:
+                event.status = "processed" if response.status_code < 400 else "rejected"
+                event.response_status = response.status_code
+                event.response_message = response.content.decode("utf-8", "replace")
+                event.processed_at = timezone.now()
+                logging.info(
+                    f"Processed {event.event_type} event {event.event_key} in "
+                    f"{(time.monotonic() - start_time) * 1000:.0f}ms, "
+                    f"{(event.processed_at - event.received_at).total_seconds():.1f}s after it was received"
+                )
+            event.save()
+        return event
+
+    @classmethod
+    def process_pending(cls, limit=None):
+        """
+        Process the due events one after the other, returns the number processed
+        """
+        processed = 0
+        while limit is None or processed < limit:
+            if cls.process_next() is None:
+                break
+            processed += 1
+        return processed
+
+    @classmethod
+    def replay(cls, queryset):
+        """
+        Put the events back in the queue, eg: after fixing the bug that rejected them.
+        Returns the number of events queued
+        """
+        return queryset.exclude(status="pending").update(
+            status="pending",
+            attempts=0,
+            next_attempt_at=timezone.now(),
+            last_error=None,
+        )
+
+    @classmethod
+    def get_latency_metrics(cls, since=None):
+        """
+        Per event type: the number of events, how many did not succeed and the
+        p50 / p95 / max seconds from receiving an event to the end of its processing
+        (`latency`) and of the processing alone (`processing`)
+        ```python
+        PaymentEvent.get_latency_metrics(since=timezone.now() - timezone.timedelta(days=1))
+        # {"charge.success": {"count": 120, "not_processed": 1, "latency": {"p50": 0.4, ...}, ...}}
+        ```
+        """
+        events = cls.objects.all()
+        if since is not None:
+            events = events.filter(received_at__gte=since)
+
+        rows = {}
+        for event_type, status, received_at, started_at, processed_at in events.values_list(
+            "event_type", "status", "received_at", "started_at", "processed_at"
+        ).iterator():
+            row = rows.setdefault(
+                event_type,
+                {"count": 0, "not_processed": 0, "latency": [], "processing": []},
+            )
+            row["count"] += 1
+            if status != "processed":
+                row["not_processed"] += 1
+            if processed_at is not None:
+                row["latency"].append((processed_at - received_at).total_seconds())
+                row["processing"].append((processed_at - started_at).total_seconds())
+
+        for row in rows.values():
+            for name in ("latency", "processing"):
+                values = row[name]
+                row[name] = {
+                    "p50": get_percentile(values, 50),
+                    "p95": get_percentile(values, 95),
+                    "max": max(values) if values else None,
+                }
+        return rows
+
+
+class PersistedQuery(models.Model):
+    """
+    Registry of the persisted queries of the clients, added by the
+    register_persisted_queries command, the clients only send their sha256 hash
+    (see trayapp.persisted_queries, the queries the clients register themselves are
+    only cached). With PERSISTED_QUERIES_ALLOWLIST only the allowlisted queries are run.
+    """
+
+    # seconds a registry entry is kept in the django cache
+    CACHE_TIMEOUT = 24 * 60 * 60
+
+    sha256_hash = models.CharField(max_length=64, unique=True)
+    query = models.TextField()
+    operation_name = models.CharField(max_length=255, null=True, blank=True)
+    allowlisted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = "persisted queries"
+
+    def __str__(self) -> str:
+        return f"{self.operation_name or 'anonymous'} ({self.sha256_hash[:12]})"
+
+    def save(self, *args, **kwargs):
+        from django.core.cache import cache
+
+        super().save(*args, **kwargs)
+        # eg: allowlisted from the admin
+        cache.delete(self.get_cache_key(self.sha256_hash))
+
+    @staticmethod
+    def get_hash(query):
+        return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_cache_key(sha256_hash):
+        return f"persisted-query:{sha256_hash}"
+
+    @classmethod
+    def lookup(cls, sha256_hash):
+        """
+        The registered query of the hash, None when it is not registered
+        eg: PersistedQuery.lookup(sha256_hash) -> {"query": "...", "allowlisted": True}
+        """
+        from django.core.cache import cache
+
+        if not isinstance(sha256_hash, str) or len(sha256_hash) != 64:
+            return None
+        entry = cache.get(cls.get_cache_key(sha256_hash))
+        if entry is None:
+            entry = (
+                cls.objects.filter(sha256_hash=sha256_hash)
+                .values("query", "allowlisted")
+                .first()
+            )
+            if entry is None:
+                return None
+            cache.set(cls.get_cache_key(sha256_hash), entry, cls.CACHE_TIMEOUT)
+        return entry
+
+    @classmethod
+    def register(cls, query, operation_name=None, allowlisted=False):
+        """
+        Register the query, returns the PersistedQuery.
+        An allowlisted query stays allowlisted
+        """
+        sha256_hash = cls.get_hash(query)
+        persisted_query, created = cls.objects.get_or_create(
+            sha256_hash=sha256_hash,
+            defaults={
+                "query": query,
+                "operation_name": operation_name,
+                "allowlisted": allowlisted,
+            },
+        )
+        if not created and allowlisted and not persisted_query.allowlisted:
+            persisted_query.allowlisted = True
+            persisted_query.save(update_fields=["allowlisted"])
+        return persisted_query
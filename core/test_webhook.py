@@ -0,0 +1,94 @@
+import json
+import hmac
+import hashlib
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import PaymentEvent
+
+
+def make_event(event_type, **data):
+    return json.dumps({"event": event_type, "data": data}).encode()
+
+
+@override_settings(PAYMENT_EVENTS_AUTO_PROCESS=False)
+class PaymentEventTests(TestCase):
+    def post_event(self, body, signature=None):
+        if signature is None:
+            signature = hmac.new(
+                settings.PAYSTACK_SECRET_KEY.encode(), body, hashlib.sha512
+            ).hexdigest()
+        return self.client.post(
+            reverse("paystack-webhook"),
+            body,
+            content_type="application/json",
+            HTTP_X_PAYSTACK_SIGNATURE=signature,
+        )
+
+    def test_webhook_stores_the_event_once(self):
+        body = make_event("refund.pending", id=7, transaction_reference="order-1")
+        self.assertEqual(self.post_event(body, signature="wrong").status_code, 403)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+        with mock.patch.object(PaymentEvent, "run") as run:
+            response = self.post_event(body)
+            self.assertEqual(response.status_code, 200)
+            # the event is not processed by the request
+            run.assert_not_called()
+
+        # paystack retries the event
+        response = self.post_event(body)
+        self.assertEqual(response.content, b"Event already received")
+
+        event = PaymentEvent.objects.get()
+        self.assertEqual(
+            (event.event_key, event.reference, event.status),
+            ("refund.pending:7", "order-1", "pending"),
+        )
+        self.assertEqual(self.post_event(b"not json").status_code, 400)
+
+    def test_events_are_processed_once(self):
+        PaymentEvent.record(make_event("refund.pending", id=1, reference="a"))
+        PaymentEvent.record(make_event("unknown.event", id=2, reference="b"))
+
+        self.assertEqual(PaymentEvent.process_pending(), 2)
+        self.assertEqual(PaymentEvent.process_pending(), 0)
+        statuses = dict(PaymentEvent.objects.values_list("event_type", "status"))
+        self.assertEqual(
+            statuses, {"refund.pending": "processed", "unknown.event": "rejected"}
+        )
+        self.assertEqual(
+            PaymentEvent.objects.get(event_type="unknown.event").response_status, 400
+        )
+
+        metrics = PaymentEvent.get_latency_metrics()
+        self.assertEqual(metrics["refund.pending"]["count"], 1)
+        self.assertEqual(metrics["unknown.event"]["not_processed"], 1)
+        self.assertIsNotNone(metrics["refund.pending"]["latency"]["p95"])
+
+    def test_failing_event_is_retried_then_replayed(self):
+        event, _ = PaymentEvent.record(make_event("charge.success", id=3, reference="c"))
+
+        with mock.patch.object(PaymentEvent, "run", side_effect=RuntimeError("down")):
+            for _ in range(PaymentEvent.MAX_ATTEMPTS):
+                PaymentEvent.objects.update(next_attempt_at=timezone.now())
+                PaymentEvent.process_pending()
+            event.refresh_from_db()
+            self.assertEqual(event.status, "failed")
+            self.assertEqual(event.attempts, PaymentEvent.MAX_ATTEMPTS)
+            self.assertEqual(event.last_error, "down")
+
+        with mock.patch.object(PaymentEvent, "run") as run:
+            run.return_value.status_code = 200
+            run.return_value.content = b"Payment successful"
+            call_command("replay_payment_events", stdout=mock.MagicMock())
+            run.assert_called_once()
+        event.refresh_from_db()
+        self.assertEqual(
+            (event.status, event.response_message), ("processed", "Payment successful")
+        )
@@ -1,7 +1,7 @@
 import logging
 
 from django.http import HttpResponse
-from product.models import Order
+from product.models import Order, Item
 from users.models import Store, Transaction, Profile, Wallet
 from trayapp.decorators import get_time_complexity
 from decimal import Decimal
@@ -159,6 +159,16 @@ class ProcessPayment:
 
             order_user: Profile = order.user
 
+            linked_stores = {store.id: store for store in order.linked_stores.all()}
+
+            # deduct all the product_cart_qty from the product_qty in one update
+            stock = Item.update_stock(
+                order.get_stock_lines(store_ids=linked_stores.keys()), "remove"
+            )
+            for item in stock["out_of_stock"]:
+                logging.info(f"{item.product_slug} is out of stock after order {order_id}")
+            Item.notify_low_stock(stock["almost_out_of_stock"])
+
             # notify all stores that are involved in the order
             stores_infos = order.stores_infos
             for store_info in stores_infos:
@@ -166,18 +176,8 @@ class ProcessPayment:
                 if not store_id:
                     continue
 
-                store: Store = order.linked_stores.filter(id=int(store_id)).first()
+                store: Store = linked_stores.get(int(store_id))
                 if store:
-                    # deduct all the product_cart_qty from the product_qty
-                    store_items = store_info["items"]
-                    for item in store_items:
-                        product_slug = item.get("product_slug")
-                        product_cart_qty = item.get("product_cart_qty")
-                        if product_slug and product_cart_qty:
-                            store.update_product_qty(
-                                product_slug, product_cart_qty, "remove"
-                            )
-
                     total = store_info["total"]
                     # get the store total normal price
                     store_total_price = total.get("price", 0)
@@ -585,26 +585,23 @@ class ProcessPayment:
 
 
 def get_paystack_balance(currency="NGN"):
-    import requests
-
-    PAYSTACK_SECRET_KEY = settings.PAYSTACK_SECRET_KEY
-
-    url = "https://api.paystack.co/balance"
-    headers = {
-        "Authorization": "Bearer " + PAYSTACK_SECRET_KEY,
-        "Content-Type": "application/json",
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        response = response.json()
-        if response["status"] == True:
-            balances = response["data"]
-            balance = None
-            for balance in balances:
-                if balance["currency"] == currency:
-                    balance = Decimal(balance["balance"]) / 100
-                    break
-            return balance
+    from trayapp.paystack import BALANCE_CACHE, get_paystack_client
+
+    def fetch():
+        response = get_paystack_client().get("balance")
+        if response.status_code == 200:
+            response = response.json()
+            if response["status"] == True:
+                balances = response["data"]
+                balance = None
+                for balance in balances:
+                    if balance["currency"] == currency:
+                        balance = Decimal(balance["balance"]) / 100
+                        break
+                return balance
+
+    # checked by every withdrawal, a few seconds old balance is enough
+    return BALANCE_CACHE.get(currency, fetch)
 
 
 def calculate_delivery_fee(amount, fee, distance=None, price_per_km=None):
@@ -1,4 +1,3 @@
-import json
 import hmac
 import hashlib
 from django.http import HttpResponse, JsonResponse
@@ -9,7 +8,7 @@ from django.conf import settings
 from django.db.models import Q
 from product.models import Order
 
-from .utils import ProcessPayment
+from .models import PaymentEvent
 
 PAYSTACK_SECRET_KEY = settings.PAYSTACK_SECRET_KEY
 
@@ -32,12 +31,11 @@ def paystack_webhook_handler(request):
         paystack_signature = request.META["HTTP_X_PAYSTACK_SIGNATURE"]
         # Get the request body as bytes
         raw_body = request.body
-        decoded_body = raw_body.decode("utf-8")
 
         # Calculate the HMAC using the secret key
         calculated_signature = hmac.new(
             key=force_bytes(PAYSTACK_SECRET_KEY),
-            msg=force_bytes(decoded_body),
+            msg=raw_body,
             digestmod=hashlib.sha512,
         ).hexdigest()
 
@@ -47,20 +45,16 @@ def paystack_webhook_handler(request):
             hmac.compare_digest(calculated_signature, paystack_signature)
             or settings.DEBUG
         ):
-            # Signature is valid, proceed with processing the event
+            # Signature is valid, store the event and answer right away,
+            # it is processed by the payment event workers
             try:
-                # get the event from request.body
-                event = json.loads(raw_body)
-                # get the event type from event
-                event_type = event["event"]
-                # get the event data from event
-                event_data = event["data"]
-                # process_payment
-                process_payment = ProcessPayment(event_type, event_data)
-                return process_payment.process_payment()
+                event, created = PaymentEvent.record(raw_body)
+            except ValueError:
+                return HttpResponse("Invalid request body", status=400)
 
-            except UnicodeDecodeError:
-                return HttpResponse("Invalid request body encoding", status=400)
+            if not created:
+                return HttpResponse("Event already received", status=200)
+            return HttpResponse("Event received", status=200)
 
         else:
             return HttpResponse("NOT ALLOWED", status=403)
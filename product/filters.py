@@ -1,8 +1,9 @@
 from trayapp.base_filters import DateTypeFilter
 from django_filters import FilterSet, CharFilter, NumberFilter
-from product.models import Item, Order, Rating
+from product.models import Item, Order, OrderStore, Rating
 from users.models import DeliveryPerson
 from django.db.models import Q
+from trayapp.search import search_queryset, ITEM_SEARCH
 
 
 class ItemFilter(FilterSet):
@@ -17,6 +18,8 @@ class ItemFilter(FilterSet):
     )
     category = CharFilter(method="filter_by_category")
     store_menu_name = CharFilter(method="filter_by_store_menu_name")
+    # ranked, typo tolerant search, see trayapp.search
+    search = CharFilter(method="filter_by_search")
     # store_menu_name = CharFilter(field_name="product_menu__name", lookup_expr="exact")
 
     class Meta:
@@ -28,40 +31,20 @@ class ItemFilter(FilterSet):
         }
 
     def filter_by_category(self, queryset, name, value):
-        return queryset.filter(
-            Q(
-                id__in=[
-                    item.id
-                    for item in queryset
-                    if item.product_categories.filter(slug=value).exists()
-                ]
-            )
-        )
+        # join through the category table instead of loading every item,
+        # distinct() keeps items with a parent and child category from repeating
+        return queryset.filter(product_categories__slug=value).distinct()
 
     def filter_by_store_nickname(self, queryset, name, value):
-        value = value.lower().strip()
-        return queryset.filter(
-            Q(
-                id__in=[
-                    item.id
-                    for item in queryset
-                    if item.product_creator.store_nickname.lower().strip() == value
-                ]
-            )
-        )
+        value = value.strip()
+        return queryset.filter(product_creator__store_nickname__iexact=value)
 
     def filter_by_store_menu_name(self, queryset, name, value: str):
-        value = value.lower().strip()
-        return queryset.filter(
-            Q(
-                id__in=[
-                    item.id
-                    for item in queryset
-                    if item.product_menu
-                    and item.product_menu.name.lower().strip() == value
-                ]
-            )
-        )
+        value = value.strip()
+        return queryset.filter(product_menu__name__iexact=value)
+
+    def filter_by_search(self, queryset, name, value: str):
+        return search_queryset(queryset, value, ITEM_SEARCH)
 
 
 class ReviewFilter(FilterSet):
@@ -94,39 +77,10 @@ class StoreOrderFilter(DefaultOrderFilter, FilterSet):
     search_query = CharFilter(method="filter_by_search_query")
 
     def filter_by_order_status(self, queryset, name, value):
-        if value == "READY":
-            # filter by ready for pickup or delivery
-            return queryset.filter(
-                Q(id__in=[
-                    order.id
-                    for order in queryset
-                    if order.get_order_status(self.request.user.profile).upper()
-                    == "READY_FOR_PICKUP"
-                    or order.get_order_status(self.request.user.profile).upper()
-                    == "READY_FOR_DELIVERY"
-                    or order.get_order_status(self.request.user.profile).upper()
-                    == "NO_DELIVERY_PERSON"
-                ])
-            )
-        elif value == "COMPLETED":
-            # filter by completed
-            return queryset.filter(
-                Q(id__in=[
-                    order.id
-                    for order in queryset
-                    if order.get_order_status(self.request.user.profile).upper()
-                    == "DELIVERED"
-                    or order.get_order_status(self.request.user.profile).upper()
-                    == "PICKED_UP"
-                ])
-            )
+        store = self.request.user.profile.store
         return queryset.filter(
-            id__in=[
-                order.id
-                for order in queryset
-                if order.get_order_status(self.request.user.profile).upper()
-                == value.upper()
-            ]
+            order_stores__store=store,
+            order_stores__status__in=OrderStore.get_statuses(value),
         )
 
     def filter_by_search_query(self, queryset: list[Order], name, value):
@@ -161,7 +115,9 @@ class DeliveryPersonFilter(DefaultOrderFilter, FilterSet):
                 "order_id", flat=True
             )
 
-            return Order.objects.filter(id__in=order_ids)
+            return Order.prefetch_related_fields(
+                Order.objects.filter(id__in=order_ids)
+            )
 
         delivery_person_id = delivery_person.id
 
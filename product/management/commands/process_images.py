@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from trayapp.images import process_pending_images
+
+
+class Command(BaseCommand):
+    help = "Make the renditions of the uploaded images that do not have them yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+
+    def handle(self, *args, **kwargs):
+        processed = process_pending_images(batch_size=kwargs["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully processed {processed} images")
+        )
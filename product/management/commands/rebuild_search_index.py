@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from trayapp.search import update_item_documents, update_store_documents
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search documents of all the items and stores"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **kwargs):
+        items_count = update_item_documents(batch_size=kwargs["batch_size"])
+        stores_count = update_store_documents(batch_size=kwargs["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully indexed {items_count} items and {stores_count} stores"
+            )
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from product.models import Item
+
+
+class Command(BaseCommand):
+    help = "Recompute the rating aggregates of the items from their ratings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **kwargs):
+        fixed_count = Item.repair_ratings_aggregates(batch_size=kwargs["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully repaired the rating aggregates of {fixed_count} items"
+            )
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from product.utils import train_recommender, fold_in_new_activity
+
+
+class Command(BaseCommand):
+    help = "Train the item recommender on the activity of all the users, run it nightly"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fold-in",
+            action="store_true",
+            help="Only update the users with new activity since the last run, "
+            "run it every few minutes",
+        )
+        parser.add_argument("--components", type=int, default=32)
+        parser.add_argument("--top-n", type=int, default=20)
+
+    def handle(self, *args, **kwargs):
+        if kwargs["fold_in"]:
+            users_count = fold_in_new_activity(n=kwargs["top_n"])
+        else:
+            users_count = train_recommender(
+                n_components=kwargs["components"], n=kwargs["top_n"]
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully updated the recommendations of {users_count} users"
+            )
+        )
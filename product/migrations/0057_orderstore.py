@@ -0,0 +1,97 @@
+# Generated by Django 3.2.23 on 2026-10-18 06:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_order_stores(apps, schema_editor):
+    Order = apps.get_model("product", "Order")
+    OrderStore = apps.get_model("product", "OrderStore")
+    Store = apps.get_model("users", "Store")
+    DeliveryPerson = apps.get_model("users", "DeliveryPerson")
+
+    vendor_ids = dict(Store.objects.values_list("id", "vendor_id"))
+    delivery_person_profile_ids = dict(
+        DeliveryPerson.objects.values_list("id", "profile_id")
+    )
+
+    order_stores = []
+    for order in Order.objects.exclude(stores_status=[]).iterator():
+        delivery_people = {
+            int(delivery_person["storeId"]): delivery_person
+            for delivery_person in order.delivery_people or []
+        }
+        profiles_seen = order.profiles_seen or []
+        for store_status in order.stores_status:
+            store_id = int(store_status["storeId"])
+            if store_id not in vendor_ids:
+                continue
+            delivery_person = delivery_people.get(store_id)
+            delivery_person_id = delivery_person["id"] if delivery_person else None
+            if delivery_person_id not in delivery_person_profile_ids:
+                delivery_person_id = None
+            order_stores.append(
+                OrderStore(
+                    order_id=order.id,
+                    store_id=store_id,
+                    status=store_status.get("status"),
+                    delivery_person_id=delivery_person_id,
+                    delivery_person_status=(
+                        delivery_person.get("status") if delivery_person else None
+                    ),
+                    vendor_has_seen=vendor_ids[store_id] in profiles_seen,
+                    delivery_person_has_seen=delivery_person_id is not None
+                    and delivery_person_profile_ids[delivery_person_id]
+                    in profiles_seen,
+                    created_at=order.created_at,
+                )
+            )
+    OrderStore.objects.bulk_create(
+        order_stores, batch_size=1000, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0052_alter_wallet_passcode'),
+        ('product', '0056_auto_20250412_1604'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(blank=True, max_length=30, null=True)),
+                ('delivery_person_status', models.CharField(blank=True, max_length=30, null=True)),
+                ('vendor_has_seen', models.BooleanField(default=False)),
+                ('delivery_person_has_seen', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('delivery_person', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_stores', to='users.deliveryperson')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_stores', to='product.order')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_stores', to='users.store')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='orderstore',
+            index=models.Index(fields=['store', 'status'], name='product_ord_store_i_5284b8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstore',
+            index=models.Index(fields=['store', 'vendor_has_seen'], name='product_ord_store_i_d4f4ae_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderstore',
+            index=models.Index(fields=['delivery_person', 'delivery_person_status'], name='product_ord_deliver_28213e_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderstore',
+            constraint=models.UniqueConstraint(fields=('order', 'store'), name='unique_order_store'),
+        ),
+        migrations.RunPython(backfill_order_stores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.23 on 2026-10-18 07:06
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_ratings_aggregates(apps, schema_editor):
+    # same aggregates as Item.repair_ratings_aggregates, a bad rating is below 2.5 stars
+    Item = apps.get_model("product", "Item")
+    Rating = apps.get_model("product", "Rating")
+
+    def rating_subquery(aggregate):
+        return Coalesce(
+            Subquery(
+                Rating.objects.filter(item=OuterRef("pk"))
+                .order_by()
+                .values("item")
+                .annotate(value=aggregate)
+                .values("value")[:1],
+                output_field=IntegerField(),
+            ),
+            0,
+        )
+
+    Item.objects.update(
+        ratings_count=rating_subquery(Count("id")),
+        ratings_sum=rating_subquery(Sum("stars")),
+        bad_ratings_count=rating_subquery(Count("id", filter=Q(stars__lt=2.5))),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0057_orderstore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='bad_ratings_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='ratings_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='ratings_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_ratings_aggregates, migrations.RunPython.noop),
+    ]
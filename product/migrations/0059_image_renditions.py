@@ -0,0 +1,18 @@
+# Generated by Django 3.2.23 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0058_item_ratings_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='itemimage',
+            name='item_image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
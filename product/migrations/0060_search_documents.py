@@ -0,0 +1,51 @@
+# Generated by Django 3.2.23 on 2026-10-18 07:26
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import DatabaseError, migrations, transaction
+import trayapp.search
+
+
+def create_trigram_index(apps, schema_editor):
+    # typo tolerant search needs pg_trgm, trayapp.search works without it
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except DatabaseError:
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS product_item_search_trgm "
+        "ON product_item USING gin (search_document gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS product_item_search_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0059_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='search_document',
+            field=trayapp.search.SearchDocumentField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_ite_search__84b3ce_gin'),
+        ),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -1,13 +1,17 @@
 import os
 import uuid
 import logging
-import requests
 from decimal import Decimal
 from django.db import models
 from django.template.defaultfilters import slugify
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from datetime import datetime
+from trayapp.request_memo import request_memo
+from trayapp.images import get_stored_image_name
+from trayapp.search import SearchDocumentField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 User = settings.AUTH_USER_MODEL
 FRONTEND_URL = settings.FRONTEND_URL
@@ -53,12 +57,19 @@ class ItemImage(models.Model):
         blank=False,
         help_text=_("Upload Item Image."),
     )
+    # the sized WebP and JPEG copies of the image, see trayapp.images
+    item_image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     is_primary = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ["-is_primary", "-timestamp"]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the stored image, tells a new upload apart without a query
+        self._original_item_image_name = get_stored_image_name(self, "item_image")
+
     def __str__(self) -> str:
         return self.product.product_slug
 
@@ -124,6 +135,16 @@ class Item(models.Model):
 
     has_notified_store_of_low_stock = models.BooleanField(default=False, editable=False)
 
+    # rating aggregates, kept in sync by Rating.save and the rating post_delete signal,
+    # `python manage.py repair_item_ratings` recomputes them from the ratings
+    ratings_count = models.PositiveIntegerField(default=0, editable=False)
+    ratings_sum = models.PositiveIntegerField(default=0, editable=False)
+    bad_ratings_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # name, description, categories, menu and store of the item, see trayapp.search
+    search_document = SearchDocumentField(blank=True, default="", editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
     class Meta:
         ordering = ["-product_clicks"]
         indexes = [
@@ -134,6 +155,9 @@ class Item(models.Model):
             models.Index(fields=['product_created_on']),
             models.Index(fields=['product_menu']),
             models.Index(fields=['product_creator', 'product_status']),
+            # the trigram index of search_document is made by the migration
+            # when pg_trgm is available
+            GinIndex(fields=['search_vector']),
         ]
 
     def __str__(self):
@@ -209,30 +233,87 @@ class Item(models.Model):
         pass
 
     def get_total_ratings(self):
-        return self.ratings.count()
+        return self.ratings_count
 
     def get_average_rating(self):
-        from django.core.cache import cache
-        cache_key = f'item_avg_rating_{self.id}'
-        
-        # Try to get from cache first
-        cached_rating = cache.get(cache_key)
-        if cached_rating is not None:
-            return cached_rating
-            
-        # Calculate if not in cache
-        ratings = self.ratings.all()
-        count = ratings.count()
-        if count > 0:
-            sum_up = sum(rating.stars for rating in ratings)
-            total = sum_up / count
+        if self.ratings_count > 0:
+            total = self.ratings_sum / self.ratings_count
             rounded_up = round(total * 10**1) / (10**1)
-            
-            # Cache for 1 hour
-            cache.set(cache_key, rounded_up, 3600)
             return rounded_up
         return 0.0
 
+    @classmethod
+    def update_ratings_aggregates(cls, item_id, old_stars=None, new_stars=None):
+        """
+        Apply a rating change to the item's aggregates with one atomic UPDATE,
+        old_stars is None for a new rating and new_stars is None for a deleted one
+        eg: Item.update_ratings_aggregates(item.id, old_stars=2, new_stars=5)
+        """
+        from django.db.models import F
+
+        count_delta = sum_delta = bad_delta = 0
+        if old_stars is not None:
+            count_delta -= 1
+            sum_delta -= old_stars
+            bad_delta -= Rating.is_bad_rating(old_stars)
+        if new_stars is not None:
+            count_delta += 1
+            sum_delta += new_stars
+            bad_delta += Rating.is_bad_rating(new_stars)
+        if not (count_delta or sum_delta or bad_delta):
+            return
+
+        from trayapp.query_cache import schedule_query_cache_invalidation
+
+        cls.objects.filter(id=item_id).update(
+            ratings_count=F("ratings_count") + count_delta,
+            ratings_sum=F("ratings_sum") + sum_delta,
+            bad_ratings_count=F("bad_ratings_count") + bad_delta,
+        )
+        # the queryset updates do not send post_save
+        schedule_query_cache_invalidation("items")
+
+    @classmethod
+    def repair_ratings_aggregates(cls, queryset=None, batch_size=1000):
+        """
+        Recompute the rating aggregates from the ratings and fix the items that
+        drifted, returns the number of items that were fixed
+        """
+        from django.db.models import Count, Q, Sum
+        from trayapp.query_cache import schedule_query_cache_invalidation
+
+        queryset = cls.objects.all() if queryset is None else queryset
+        actual = {
+            row["item_id"]: row
+            for row in Rating.objects.filter(item__in=queryset)
+            .order_by()
+            .values("item_id")
+            .annotate(
+                count=Count("id"),
+                sum=Sum("stars"),
+                bad=Count("id", filter=Q(stars__lt=Rating.BAD_RATING_THRESHOLD)),
+            )
+        }
+
+        fixed_items = []
+        for item in queryset.order_by().only(
+            "id", "ratings_count", "ratings_sum", "bad_ratings_count"
+        ):
+            row = actual.get(item.id, {"count": 0, "sum": 0, "bad": 0})
+            values = (row["count"], row["sum"] or 0, row["bad"])
+            if values != (item.ratings_count, item.ratings_sum, item.bad_ratings_count):
+                item.ratings_count, item.ratings_sum, item.bad_ratings_count = values
+                fixed_items.append(item)
+
+        cls.objects.bulk_update(
+            fixed_items,
+            ["ratings_count", "ratings_sum", "bad_ratings_count"],
+            batch_size=batch_size,
+        )
+        if fixed_items:
+            schedule_query_cache_invalidation("items")
+        return len(fixed_items)
+
     def calculate_rating_percentage(self):
         """
         Calculate the weighted average rating for a product.
@@ -259,17 +340,14 @@ class Item(models.Model):
         Returns:
             float: The normalized weighted average rating as a percentage.
         """
-        # Define the threshold for a bad review
-        bad_review_threshold = 2.5
-
         # Get the total number of ratings
-        total_ratings = self.get_total_ratings()
+        total_ratings = self.ratings_count
 
         # Get the sum of all ratings
-        sum_of_ratings = sum(rating.stars for rating in self.ratings.all())
+        sum_of_ratings = self.ratings_sum
 
-        # Count the number of bad reviews
-        bad_reviews = self.ratings.filter(stars__lt=bad_review_threshold).count()
+        # Count the number of bad reviews (below Rating.BAD_RATING_THRESHOLD)
+        bad_reviews = self.bad_ratings_count
 
         # Subtract the number of bad reviews from the total ratings
         new_total_ratings = total_ratings - bad_reviews
@@ -354,6 +432,122 @@ class Item(models.Model):
             return False
         return self.product_qty / self.product_init_qty <= 0.2
 
+    @staticmethod
+    def get_stock_quantities(lines):
+        """
+        Add up the quantities of the lines of the same item,
+        lines are (store_id, product_slug, product_cart_qty)
+        """
+        quantities = {}
+        for store_id, product_slug, product_cart_qty in lines:
+            if not product_slug or not product_cart_qty:
+                continue
+            key = (int(store_id), product_slug)
+            quantities[key] = quantities.get(key, 0) + int(product_cart_qty)
+        return quantities
+
+    @classmethod
+    def update_stock(cls, lines, action):
+        """
+        Add or remove the quantities of an order's lines from the stock
+        with one conditional UPDATE, in a single transaction.
+        The items are locked while the new quantities are computed so
+        concurrent payments can not oversell, quantities never go below 0
+        and items without a quantity (has_qty=False) are left alone.
+
+        Returns the items that were updated, the ones that went out of stock
+        and the ones that are now almost out of stock
+
+        ```python
+        stock = Item.update_stock([(store.id, "jollof-rice-1a2b3c", 2)], "remove")
+        stock["out_of_stock"] # [<Item: Jollof Rice>]
+        Item.notify_low_stock(stock["almost_out_of_stock"])
+        ```
+        """
+        from django.db import transaction
+        from django.db.models import Case, F, When
+        from django.db.models.functions import Greatest
+        from trayapp.query_cache import schedule_query_cache_invalidation
+
+        if action not in ("add", "remove"):
+            raise Exception("Invalid action")
+
+        result = {"updated": [], "out_of_stock": [], "almost_out_of_stock": []}
+        quantities = cls.get_stock_quantities(lines)
+        if not quantities:
+            return result
+
+        with transaction.atomic():
+            items = list(
+                cls.objects.select_for_update()
+                .filter(
+                    product_slug__in=[product_slug for _, product_slug in quantities],
+                    has_qty=True,
+                )
+                .order_by("id")
+            )
+            # the line of an item from another store is ignored
+            items = [
+                item
+                for item in items
+                if (item.product_creator_id, item.product_slug) in quantities
+            ]
+            if not items:
+                return result
+
+            whens = []
+            for item in items:
+                qty = quantities[(item.product_creator_id, item.product_slug)]
+                if action == "add":
+                    whens.append(When(id=item.id, then=F("product_qty") + qty))
+                    item.product_qty += qty
+                else:
+                    whens.append(
+                        When(id=item.id, then=Greatest(F("product_qty") - qty, 0))
+                    )
+                    item.product_qty = max(item.product_qty - qty, 0)
+
+            cls.objects.filter(id__in=[item.id for item in items]).update(
+                product_qty=Case(*whens, default=F("product_qty"))
+            )
+            if items:
+                schedule_query_cache_invalidation("items")
+
+        for item in items:
+            result["updated"].append(item)
+            if action == "remove" and item.product_qty == 0:
+                result["out_of_stock"].append(item)
+            if (
+                item.is_almost_out_of_stock()
+                and not item.has_notified_store_of_low_stock
+            ):
+                result["almost_out_of_stock"].append(item)
+        return result
+
+    @classmethod
+    def notify_low_stock(cls, items):
+        """
+        Tell the stores about their items that are almost out of stock,
+        items are the `almost_out_of_stock` of `Item.update_stock`
+        """
+        notified_ids = []
+        for item in items:
+            store = item.product_creator
+            did_notified_store_of_low_stock = store.vendor.notify_me(
+                title="Item Almost Out of Stock",
+                message=f"`{item.product_name}` is almost out of stock. Please restock to avoid losing sales.",
+                data={"link": f"/product/{item.product_slug}"},
+            )
+            if did_notified_store_of_low_stock:
+                item.has_notified_store_of_low_stock = True
+                notified_ids.append(item.id)
+
+        if notified_ids:
+            cls.objects.filter(id__in=notified_ids).update(
+                has_notified_store_of_low_stock=True
+            )
+        return notified_ids
+
 
 class Rating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ratings")
@@ -365,17 +559,83 @@ class Rating(models.Model):
     )
     updated_at = models.DateTimeField(auto_now=True)
 
+    # a rating below this number of stars is a bad review
+    BAD_RATING_THRESHOLD = 2.5
+
     class Meta:
         unique_together = ("user", "item")
         index_together = ("user", "item")
         ordering = ["-updated_at", "-stars", "-id"]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the stars and item the aggregates of the item count for this rating
+        self._original_stars = self.__dict__.get("stars") if self.pk else None
+        self._original_item_id = self.__dict__.get("item_id") if self.pk else None
+
     def __str__(self):
         return f"{self.user.username} - {self.item.product_name}"
 
+    @classmethod
+    def is_bad_rating(cls, stars):
+        return stars < cls.BAD_RATING_THRESHOLD
+
     def save(self, *args, **kwargs):
+        from django.db import transaction
+
         self.comment = filter_comment(self.comment)
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self._original_item_id == self.item_id:
+                Item.update_ratings_aggregates(
+                    self.item_id, old_stars=self._original_stars, new_stars=self.stars
+                )
+            else:
+                if self._original_item_id is not None:
+                    Item.update_ratings_aggregates(
+                        self._original_item_id, old_stars=self._original_stars
+                    )
+                Item.update_ratings_aggregates(self.item_id, new_stars=self.stars)
+        self._original_stars = self.stars
+        self._original_item_id = self.item_id
+
+
+class Recommendation(models.Model):
+    """
+    Precomputed top items of a user, the row without a user has the most popular
+    items (see product.utils.train_recommender). Shared by the processes,
+    the cache only keeps them for a few minutes
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="recommendation",
+    )
+    item_ids = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Recommendation of {self.user_id or 'everyone'}"
+
+
+class RecommenderModel(models.Model):
+    """
+    The item factors of the last training, used to fold in the new activity.
+    There is one row, replaced by every training
+    """
+
+    item_ids = models.JSONField(default=list)
+    # np.save of the (items, components) float32 matrix
+    factors = models.BinaryField()
+    trained_at = models.DateTimeField(auto_now_add=True)
+    # the activity after it is not folded in yet
+    folded_in_at = models.DateTimeField()
+
+    def __str__(self) -> str:
+        return f"Recommender trained at {self.trained_at}"
 
 
 class ItemAttribute(models.Model):
@@ -396,6 +656,8 @@ class ItemAttribute(models.Model):
 
 ALLOWED_STORE_ORDER_STATUS = settings.ALLOWED_STORE_ORDER_STATUS
 ALLOWED_DELIVERY_PERSON_ORDER_STATUS = settings.ALLOWED_DELIVERY_PERSON_ORDER_STATUS
+# how long the status_orders_count result is cached per profile, in seconds
+STATUS_COUNTS_CACHE_TIMEOUT = 30
 
 
 class Order(models.Model):
@@ -573,6 +835,9 @@ class Order(models.Model):
                     self.linked_delivery_people.clear()
         super().save(*args, **kwargs)
 
+        # update the normalized order stores rows
+        self.sync_order_stores()
+
     def __str__(self):
         return "Order #" + str(self.order_track_id)
 
@@ -592,7 +857,7 @@ class Order(models.Model):
         return f"#{formatteed_order_track_id}".upper()
 
     def get_display_shipping_address(self):
-        from users.models import School
+        from trayapp.loaders import SchoolLoader
 
         shipping = self.shipping
         if not shipping:
@@ -603,7 +868,7 @@ class Order(models.Model):
         if sch:
             sch = str(sch).strip()
             # get the school name
-            sch = School.objects.get(slug=sch).name
+            sch = SchoolLoader.get_loader().load(sch).name
 
         return "{}{}".format(address, f", {sch}" if sch else "")
 
@@ -695,6 +960,7 @@ class Order(models.Model):
         if len(stores_status) == 0:
             return True
 
+        linked_stores_ids = set(self.linked_stores.values_list("id", flat=True))
         for store_status in stores_status:
             if not store_status.get("storeId"):
                 return False
@@ -703,7 +969,7 @@ class Order(models.Model):
             if store_status.get("status") not in ALLOWED_STORE_ORDER_STATUS:
                 return False
             # check if the stores_status are linked to the order
-            if not self.linked_stores.filter(id=store_status.get("storeId")).exists():
+            if int(store_status.get("storeId")) not in linked_stores_ids:
                 return False
         # check of there is any duplicate store_status ["storeId"]
         stores_status_ids = [store_status["storeId"] for store_status in stores_status]
@@ -842,9 +1108,7 @@ class Order(models.Model):
         )
 
     def store_refund_customer(self, store_id: int):
-        PAYSTACK_SECRET_KEY = settings.PAYSTACK_SECRET_KEY
-
-        url = "https://api.paystack.co/refund"
+        from trayapp.paystack import get_paystack_client
 
         # check if the store status is refunded
 
@@ -888,11 +1152,12 @@ class Order(models.Model):
             "amount": float(kobo_amount),
         }
 
-        headers = {
-            "Authorization": f"Bearer {PAYSTACK_SECRET_KEY}",
-        }
-
-        response = requests.post(url, data=data, headers=headers)
+        # not retried once sent, paystack may have applied it (see IDEMPOTENT_POST_ENDPOINTS)
+        response = get_paystack_client().post(
+            "refund",
+            data=data,
+            idempotency_key=f"refund-{self.order_track_id}-{store_id}",
+        )
         response = response.json()
 
         if response["status"] == True:
@@ -921,9 +1186,7 @@ class Order(models.Model):
 
     # full refund the customer
     def refund_customer(self):
-        PAYSTACK_SECRET_KEY = settings.PAYSTACK_SECRET_KEY
-
-        url = "https://api.paystack.co/refund"
+        from trayapp.paystack import get_paystack_client
 
         # check if the order status is refunded
         if self.order_payment_status in ["refunded", "pending-refund"]:
@@ -933,11 +1196,9 @@ class Order(models.Model):
             "transaction": self.order_track_id,
         }
 
-        headers = {
-            "Authorization": f"Bearer {PAYSTACK_SECRET_KEY}",
-        }
-
-        response = requests.post(url, data=data, headers=headers)
+        response = get_paystack_client().post(
+            "refund", data=data, idempotency_key=f"refund-{self.order_track_id}"
+        )
         response = response.json()
 
         if response["status"] == True:
@@ -964,6 +1225,47 @@ class Order(models.Model):
 
         return response
 
+    # register the schools, stores, items and delivery people a page of orders
+    # refers to, so the resolvers load each kind with a single query
+    @staticmethod
+    def prime_loaders(orders):
+        from trayapp.loaders import (
+            DeliveryPersonProfileLoader,
+            SchoolLoader,
+            StoreLoader,
+            ItemLoader,
+        )
+
+        school_slugs, store_ids, item_slugs, delivery_person_ids = [], [], [], []
+        for order in orders:
+            shipping = order.shipping or {}
+            if shipping.get("sch"):
+                school_slugs.append(str(shipping["sch"]).lower().strip())
+            for store_info in order.stores_infos or []:
+                store_ids.append(int(store_info["storeId"]))
+                for item in store_info.get("items", []):
+                    item_slugs.append(item.get("product_slug"))
+                    for option_group in item.get("option_groups") or []:
+                        for option in option_group.get("options") or []:
+                            item_slugs.append(option.get("slug"))
+            for delivery_person in order.delivery_people or []:
+                delivery_person_ids.append(int(delivery_person["id"]))
+
+        SchoolLoader.get_loader().prime(school_slugs)
+        StoreLoader.get_loader().prime(store_ids)
+        ItemLoader.get_loader().prime(item_slugs)
+        DeliveryPersonProfileLoader.get_loader().prime(delivery_person_ids)
+
+    # prefetch what the OrderType resolvers read for every order
+    @staticmethod
+    def prefetch_related_fields(queryset):
+        """
+        eg: Order.prefetch_related_fields(store.orders)
+        """
+        return queryset.select_related("user__user").prefetch_related(
+            "linked_stores", "linked_delivery_people", "linked_items"
+        )
+
     # check if a store is linked in any order, if yes, return the orders
     @classmethod
     def get_orders_by_store(cls, store):
@@ -982,19 +1284,10 @@ class Order(models.Model):
     # get the number of active orders linked to a delivery person
     @classmethod
     def get_active_orders_count_by_delivery_person(cls, delivery_person):
-        deliveries = cls.objects.filter(linked_delivery_people=delivery_person)
-        active_deliveries = []
-        for delivery in deliveries:
-            delivery_person_inst = delivery.get_delivery_person(
-                delivery_person_id=delivery_person.id
-            )
-            if delivery_person_inst and delivery_person_inst["status"] in [
-                "pending",
-                "out-for-delivery",
-                "returned",
-            ]:
-                active_deliveries.append(delivery)
-        return len(active_deliveries)
+        return OrderStore.objects.filter(
+            delivery_person=delivery_person,
+            delivery_person_status__in=OrderStore.ACTIVE_DELIVERY_STATUSES,
+        ).count()
 
     # re-generate a order_track_id for the order and update the order_track_id of the order
     def regenerate_order_track_id(self):
@@ -1008,31 +1301,38 @@ class Order(models.Model):
         Check if the current user is a vendor, delivery person or user
         current_user_profile: the current user profile
         """
-        from users.models import DeliveryPerson
+        # every OrderType resolver asks for this, so it is memoized per request
+        return list(
+            request_memo(
+                ("view_as", self.id, current_user_profile.id),
+                lambda: self.get_view_as(current_user_profile),
+            )
+        )
 
-        # check if the current user is among the linked delivery people
-        is_delivery_person = self.linked_delivery_people.filter(
-            profile=current_user_profile
-        ).exists()
+    def get_view_as(self, current_user_profile):
+        from users.models import DeliveryPerson
 
+        # linked stores and delivery people are read with .all() so a prefetch is reused
         delivery_person: DeliveryPerson = current_user_profile.get_delivery_person()
+        is_delivery_person = False
         if delivery_person:
-            is_delivery_person = (
-                is_delivery_person
-                or delivery_person.get_notifications()
-                .filter(
-                    order=self,
-                    delivery_person=delivery_person,
-                )
-                .exists()
-            )
-
-        is_vendor = self.linked_stores.filter(vendor=current_user_profile).exists()
+            # check if the current user is among the linked delivery people
+            # or has been sent a delivery request for the order
+            is_delivery_person = any(
+                linked_delivery_person.id == delivery_person.id
+                for linked_delivery_person in self.linked_delivery_people.all()
+            ) or self.id in self.get_sent_delivery_notifications(delivery_person.id)
+
+        is_vendor = any(
+            store.vendor_id == current_user_profile.id
+            for store in self.linked_stores.all()
+        )
 
-        if current_user_profile == self.user and not is_vendor:
+        is_user = current_user_profile.id == self.user_id
+        if is_user and not is_vendor:
             return []
 
-        if current_user_profile == self.user and is_vendor:
+        if is_user and is_vendor:
             return ["USER", "VENDOR"]
 
         if is_vendor:
@@ -1042,6 +1342,45 @@ class Order(models.Model):
         else:
             return []
 
+    @staticmethod
+    def get_sent_delivery_notifications(delivery_person_id):
+        """
+        Get the sent delivery requests of a delivery person as {order_id: store_id},
+        memoized per request so listing orders does not query them per order
+        """
+        from users.models import DeliveryNotification
+
+        return request_memo(
+            ("sent_delivery_notifications", int(delivery_person_id)),
+            lambda: dict(
+                DeliveryNotification.objects.filter(
+                    delivery_person__id=delivery_person_id, status="sent"
+                ).values_list("order_id", "store_id")
+            ),
+        )
+
+    def get_stock_lines(self, store_ids=None):
+        """
+        The (store_id, product_slug, product_cart_qty) of every item in the order,
+        for `Item.update_stock`, only the lines of `store_ids` when it is given
+        """
+        lines = []
+        for store_info in self.stores_infos:
+            store_id = store_info.get("storeId")
+            if not store_id:
+                continue
+            if store_ids is not None and int(store_id) not in store_ids:
+                continue
+            for item in store_info.get("items", []):
+                lines.append(
+                    (
+                        int(store_id),
+                        item.get("product_slug"),
+                        item.get("product_cart_qty"),
+                    )
+                )
+        return lines
+
     def get_store_info(self, store_id):
         stores_infos = self.stores_infos
         for store_info in stores_infos:
@@ -1101,19 +1440,15 @@ class Order(models.Model):
     def get_delivery_person(self, delivery_person_id: str = None, store_id: int = None):
         delivery_people = self.delivery_people
 
-        from users.models import DeliveryNotification
-
         if delivery_person_id:
-            delivery_person_notification_instance = (
-                DeliveryNotification.objects.select_related("store").filter(
-                    delivery_person__id=delivery_person_id, order=self, status="sent"
-                )
+            sent_delivery_notifications = self.get_sent_delivery_notifications(
+                delivery_person_id
             )
-            if delivery_person_notification_instance.exists():
+            if self.id in sent_delivery_notifications:
                 return {
                     "id": delivery_person_id,
                     "status": "new",
-                    "storeId": delivery_person_notification_instance.first().store.id,
+                    "storeId": sent_delivery_notifications[self.id],
                 }
 
         for delivery_person in delivery_people:
@@ -1176,9 +1511,7 @@ class Order(models.Model):
 
     # create a payment link for the order
     def create_payment_link(self):
-        PAYSTACK_SECRET_KEY = settings.PAYSTACK_SECRET_KEY
-
-        url = "https://api.paystack.co/transaction/initialize"
+        from trayapp.paystack import get_paystack_client
 
         # check if order has been initialized before
         if self.order_payment_status == "pending":
@@ -1207,11 +1540,12 @@ class Order(models.Model):
         if "://" in FRONTEND_URL:
             data["callback_url"] = callback_url
 
-        headers = {
-            "Authorization": f"Bearer {PAYSTACK_SECRET_KEY}",
-        }
-
-        response = requests.post(url, data=data, headers=headers)
+        # the reference is new for every payment link
+        response = get_paystack_client().post(
+            "transaction/initialize",
+            data=data,
+            idempotency_key=f"initialize-{order_track_id}",
+        )
         response = response.json()
 
         if response["status"] == True:
@@ -1231,32 +1565,282 @@ class Order(models.Model):
         delivery_notifications = DeliveryNotification.objects.filter(order=self)
         delivery_notifications.delete()
 
+    # keep the order_stores rows in sync with stores_status, delivery_people and profiles_seen
+    def sync_order_stores(self):
+        from collections import Counter
+        from django.db.models import F
+        from users.models import Store, DeliveryPerson
 
-# signal to notify product creator when a item is about to go out of stock
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.db.models.signals import pre_save
+        stores_status = self.stores_status or []
+        store_ids = [int(store_status["storeId"]) for store_status in stores_status]
 
+        order_stores = {
+            order_store.store_id: order_store
+            for order_store in self.order_stores.select_related("delivery_person")
+        }
+        previous_delivery_person_profile_ids = [
+            order_store.delivery_person.profile_id
+            for order_store in order_stores.values()
+            if order_store.delivery_person
+        ]
 
-@receiver(post_save, sender=Item)
-def notify_product_creator(sender, instance: Item, created, **kwargs):
-    from users.models import Store
+        # active orders counted per delivery person before this update
+        active_orders_delta = Counter(
+            order_store.delivery_person_id
+            for order_store in order_stores.values()
+            if order_store.is_active_delivery()
+        )
+        active_orders_delta = Counter(
+            {key: -value for key, value in active_orders_delta.items()}
+        )
 
-    if not created:
-        if (
-            instance.is_almost_out_of_stock()
-            and not instance.has_notified_store_of_low_stock
-        ):
-            store: Store = instance.product_creator
-            store_profile = store.vendor
-            did_notified_store_of_low_stock = store_profile.notify_me(
-                title="Item Almost Out of Stock",
-                message=f"`{instance.product_name}` is almost out of stock. Please restock to avoid losing sales.",
-                data={"link": f"/product/{instance.product_slug}"},
+        # remove rows of stores that are no longer part of the order
+        removed_store_ids = [
+            store_id for store_id in order_stores if store_id not in store_ids
+        ]
+        if removed_store_ids:
+            self.order_stores.filter(store_id__in=removed_store_ids).delete()
+
+        vendor_ids = dict(
+            Store.objects.filter(id__in=store_ids).values_list("id", "vendor_id")
+        )
+        delivery_people = {
+            int(delivery_person["storeId"]): delivery_person
+            for delivery_person in self.delivery_people or []
+        }
+        delivery_person_profile_ids = dict(
+            DeliveryPerson.objects.filter(
+                id__in=[person["id"] for person in delivery_people.values()]
+            ).values_list("id", "profile_id")
+        )
+        profiles_seen = self.profiles_seen or []
+
+        new_order_stores = []
+        changed_order_stores = []
+        for store_status in stores_status:
+            store_id = int(store_status["storeId"])
+            delivery_person = delivery_people.get(store_id)
+            delivery_person_id = delivery_person["id"] if delivery_person else None
+
+            values = {
+                "status": store_status.get("status"),
+                "delivery_person_id": delivery_person_id,
+                "delivery_person_status": (
+                    delivery_person.get("status") if delivery_person else None
+                ),
+                "vendor_has_seen": vendor_ids.get(store_id) in profiles_seen,
+                "delivery_person_has_seen": delivery_person_id is not None
+                and delivery_person_profile_ids.get(delivery_person_id)
+                in profiles_seen,
+            }
+
+            order_store = order_stores.get(store_id)
+            if order_store is None:
+                order_store = OrderStore(
+                    order=self,
+                    store_id=store_id,
+                    created_at=self.created_at,
+                    **values,
+                )
+                new_order_stores.append(order_store)
+            elif any(
+                getattr(order_store, key) != value for key, value in values.items()
+            ):
+                for key, value in values.items():
+                    setattr(order_store, key, value)
+                changed_order_stores.append(order_store)
+
+            if order_store.is_active_delivery():
+                active_orders_delta[order_store.delivery_person_id] += 1
+
+        if new_order_stores:
+            OrderStore.objects.bulk_create(new_order_stores, ignore_conflicts=True)
+        if changed_order_stores:
+            OrderStore.objects.bulk_update(
+                changed_order_stores,
+                [
+                    "status",
+                    "delivery_person",
+                    "delivery_person_status",
+                    "vendor_has_seen",
+                    "delivery_person_has_seen",
+                ],
             )
-            if did_notified_store_of_low_stock:
-                instance.has_notified_store_of_low_stock = True
-                instance.save()
+
+        # keep the delivery people active orders counters up to date
+        for delivery_person_id, delta in active_orders_delta.items():
+            if delta:
+                DeliveryPerson.objects.filter(id=delivery_person_id).update(
+                    active_orders_count=F("active_orders_count") + delta
+                )
+
+        if new_order_stores or changed_order_stores or removed_store_ids:
+            # the status counts of the vendors and delivery people are now stale
+            OrderStore.clear_status_counts_cache(
+                list(vendor_ids.values())
+                + list(delivery_person_profile_ids.values())
+                + previous_delivery_person_profile_ids
+            )
+
+
+class OrderStore(models.Model):
+    """
+    One row per (order, store), a normalized copy of the order's stores_status,
+    delivery_people and profiles_seen so store order lists can be filtered
+    and counted with a single indexed query.
+    It is kept in sync by Order.sync_order_stores
+    """
+
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name="order_stores"
+    )
+    store = models.ForeignKey(
+        "users.Store", on_delete=models.CASCADE, related_name="order_stores"
+    )
+    status = models.CharField(max_length=30, null=True, blank=True)
+    delivery_person = models.ForeignKey(
+        "users.DeliveryPerson",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="order_stores",
+    )
+    delivery_person_status = models.CharField(max_length=30, null=True, blank=True)
+    vendor_has_seen = models.BooleanField(default=False)
+    delivery_person_has_seen = models.BooleanField(default=False)
+    created_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["order", "store"], name="unique_order_store"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["store", "status"]),
+            models.Index(fields=["store", "vendor_has_seen"]),
+            models.Index(fields=["delivery_person", "delivery_person_status"]),
+        ]
+
+    def __str__(self):
+        return f"{self.order} - {self.store}"
+
+    # delivery person statuses that count as an active order
+    ACTIVE_DELIVERY_STATUSES = ["pending", "out-for-delivery", "returned"]
+
+    def is_active_delivery(self):
+        return (
+            self.delivery_person_id is not None
+            and self.delivery_person_status in self.ACTIVE_DELIVERY_STATUSES
+        )
+
+    # statuses that are grouped together on the store orders page
+    STATUS_GROUPS = {
+        "ONGOING": ["pending", "out-for-delivery"],
+        "READY": ["ready-for-pickup", "ready-for-delivery", "no-delivery-person"],
+        "COMPLETED": ["delivered", "picked-up"],
+    }
+
+    @classmethod
+    def get_status_counts(cls, profile, who: str, days: int = None):
+        """
+        Count the orders of a vendor or delivery person by status in one
+        GROUP BY query, the result is cached for a short time per profile
+        eg: OrderStore.get_status_counts(profile, "vendor", days=7)
+        -> {"pending": {"count": 2, "new_count": 1}, ...}
+        """
+        from django.core.cache import cache
+        from django.db.models import Count, Q
+        from django.utils import timezone
+
+        cache_key = cls.get_status_counts_cache_key(profile.id)
+        cached_counts = cache.get(cache_key) or {}
+        counts_key = f"{who}:{days}"
+        if counts_key in cached_counts:
+            return cached_counts[counts_key]
+
+        if who == "vendor":
+            order_stores = cls.objects.filter(
+                store=profile.store, order__order_payment_status="success"
+            )
+            status_field, seen_field = "status", "vendor_has_seen"
+        else:
+            delivery_person = profile.get_delivery_person()
+            order_stores = cls.objects.filter(delivery_person=delivery_person)
+            status_field, seen_field = (
+                "delivery_person_status",
+                "delivery_person_has_seen",
+            )
+
+        if days:
+            order_stores = order_stores.filter(
+                created_at__gte=timezone.now() - timezone.timedelta(days=days)
+            )
+
+        # order_by() drops the default ordering from the GROUP BY
+        rows = order_stores.order_by().values(status_field).annotate(
+            count=Count("id"), new_count=Count("id", filter=Q(**{seen_field: False}))
+        )
+        counts = {
+            row[status_field]: {"count": row["count"], "new_count": row["new_count"]}
+            for row in rows
+        }
+
+        if who == "delivery_person":
+            # new delivery requests are the sent notifications
+            notifications = delivery_person.get_notifications()
+            if days:
+                notifications = notifications.filter(
+                    created_at__gte=timezone.now() - timezone.timedelta(days=days)
+                )
+            new_requests_count = notifications.count()
+            counts["new"] = {"count": new_requests_count, "new_count": new_requests_count}
+
+        cached_counts[counts_key] = counts
+        cache.set(cache_key, cached_counts, STATUS_COUNTS_CACHE_TIMEOUT)
+        return counts
+
+    @staticmethod
+    def get_status_counts_cache_key(profile_id):
+        return f"status_orders_count_{profile_id}"
+
+    @classmethod
+    def clear_status_counts_cache(cls, profile_ids):
+        from django.core.cache import cache
+
+        cache.delete_many(
+            [
+                cls.get_status_counts_cache_key(profile_id)
+                for profile_id in set(profile_ids)
+                if profile_id
+            ]
+        )
+
+    @classmethod
+    def get_statuses(cls, value: str):
+        """
+        Convert a status from the client to the store statuses it covers
+        eg: OrderStore.get_statuses("READY_FOR_PICKUP") -> ["ready-for-pickup"]
+        """
+        value = value.upper()
+        if value in cls.STATUS_GROUPS:
+            return cls.STATUS_GROUPS[value]
+        return [value.lower().replace("_", "-")]
+
+
+from django.dispatch import receiver
+from django.db.models.signals import pre_save, post_delete
+
+
+# remove a deleted rating from the aggregates of its item
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_item_aggregates(sender, instance: Rating, **kwargs):
+    if instance._original_stars is not None:
+        Item.update_ratings_aggregates(
+            instance._original_item_id, old_stars=instance._original_stars
+        )
 
 
 # signal to set initial product_init_qty when the product_qty is set
@@ -18,6 +18,7 @@ from .types import (
 )
 
 from trayapp.permissions import IsAuthenticated, permission_checker
+from trayapp.counters import ITEM_CLICKS_COUNTER, STORE_RANK_COUNTER
 
 
 PAYSTACK_SECRET_KEY = settings.PAYSTACK_SECRET_KEY
@@ -234,9 +235,7 @@ class ItemCopyDeleteMutation(Output, graphene.Mutation):
 
         if (is_public or is_owner) and action == "copy":
             # increase the rank of the creator store by 0.5
-            store = product.product_creator
-            store.store_rank += 0.5
-            store.save()
+            STORE_RANK_COUNTER.incr(product.product_creator_id)
             return ItemCopyDeleteMutation(success=True)
 
         elif is_owner and action == "delete":
@@ -318,23 +317,11 @@ class AddProductClickMutation(Output, graphene.Mutation):
 
         if info.context.user.is_authenticated:
             # Add the user activity
-            new_activity = UserActivity.objects.create(
-                user_id=info.context.user.id,
-                activity_type="added_to_cart",
-                item=item,
-                timestamp=timezone.now(),
-            )
+            UserActivity.record(info.context.user.id, item.id, "added_to_cart")
             # increase the rank of the creator store by 0.5
-            store = Store.objects.filter(id=item.product_creator.id).first()
-            if not store is None:
-                store.store_rank += 0.5
-                store.save()
+            STORE_RANK_COUNTER.incr(product_creator.id)
             # increase the product clicks by 1
-            item.product_clicks += 1
-
-            # save the changes
-            item.save()
-            new_activity.save()
+            ITEM_CLICKS_COUNTER.incr(item.id)
 
             return AddProductClickMutation(success=True)
         else:
@@ -376,45 +363,57 @@ class CreateOrderMutation(Output, graphene.Mutation):
         service_fee = Decimal(0.05) * overall_price
         service_fee = service_fee.quantize(Decimal("1"), rounding=ROUND_HALF_UP)
 
-        # get all the items slugs and check if they exist
+        # get all the items slugs and check if they exist, in one query
+        items_slugs = [
+            item.product_slug
+            for store_info in stores_infos
+            for item in store_info.items
+        ]
+        items_by_slug = {
+            item.product_slug: item
+            for item in Item.objects.filter(
+                product_slug__in=items_slugs, product_status="active"
+            ).exclude(product_creator__is_approved=False)
+        }
         avaliable_items: list[Item] = []
-        for store_info in stores_infos:
-            store_items: list[StoreItemInputType] = store_info.items
-            for item in store_items:
-                item_slug = item.product_slug
-                item = (
-                    Item.objects.filter(product_slug=item_slug, product_status="active")
-                    .exclude(product_status="deleted")
-                    .exclude(product_creator__is_approved=False)
-                    .first()
+        for item_slug in items_slugs:
+            item = items_by_slug.get(item_slug)
+            if item is None:
+                raise GraphQLError(
+                    "Order contains invalid items, clear cart and retry."
                 )
-                if item is None:
-                    raise GraphQLError(
-                        "Order contains invalid items, clear cart and retry."
-                    )
-                avaliable_items.append(item)
+            avaliable_items.append(item)
 
         # check if there are linked items
         if len(avaliable_items) == 0:
             raise GraphQLError("Order contains no items")
 
-        # get all the stores and check if they exist
+        # get all the stores with their open hours and check if they exist, in one query
+        stores_by_id = {
+            store.id: store
+            for store in Store.objects.filter(
+                id__in=[store_info.storeId for store_info in stores_infos]
+            ).prefetch_related("storeopenhours_set")
+        }
+        stores_is_open_data = Store.get_stores_is_open_data(stores_by_id.values())
         avaliable_stores: list[Store] = []
         for store_info in stores_infos:
             storeId = store_info.storeId
-            store = Store.objects.filter(
-                id=storeId,
-            ).first()
+            store = stores_by_id.get(int(storeId))
             if store is None:
                 raise GraphQLError(
                     f"Store with id '{storeId}' does not exist or is not approved"
                 )
-            if store.gender_preference and profile.gender != store.gender_preference:
+            if (
+                store.gender_preference_id
+                and profile.gender_id != store.gender_preference_id
+            ):
                 raise GraphQLError(f"{store.store_name} does not serve your gender")
 
-            if not store.get_is_open_data()["is_open"]:
+            is_open_data = stores_is_open_data[store.id]
+            if not is_open_data["is_open"]:
                 raise GraphQLError(f"{store.store_name} has closed")
-            if store.get_is_open_data()["open_soon"]:
+            if is_open_data["open_soon"]:
                 raise GraphQLError(f"{store.store_name} has not opened yet")
             if store.is_approved == False:
                 raise GraphQLError(f"{store.store_name} has not been approved")
@@ -582,8 +581,9 @@ class ReOrderMutation(Output, graphene.Mutation):
             return ReOrderMutation(error="Some stores are not available")
 
         # check which store is not open
+        stores_is_open_data = Store.get_stores_is_open_data(avaliable_stores)
         for store in avaliable_stores:
-            if store.get_is_open_data()["is_open"] == False:
+            if stores_is_open_data[store.id]["is_open"] == False:
                 return ReOrderMutation(error=f"{store.store_name} has closed")
 
         # check if the item is available
@@ -921,13 +921,8 @@ class MarkOrderAsMutation(Output, graphene.Mutation):
                     order.order_status = "partially-rejected"
                     order.save()
 
-                store_info = order.get_store_info(store_id)
-                store_items = store_info.get("items", [])
-                for item in store_items:
-                    product_slug = item.get("product_slug")
-                    product_cart_qty = item.get("product_cart_qty")
-                    if product_slug and product_cart_qty:
-                        store.update_product_qty(product_slug, product_cart_qty, "add")
+                # put the items of the store back in stock
+                Item.update_stock(order.get_stock_lines(store_ids=[store.id]), "add")
 
                 if is_single_reject:
                     order.notify_user(
@@ -1020,13 +1015,8 @@ class MarkOrderAsMutation(Output, graphene.Mutation):
                     order.order_status = "partially-cancelled"
                     order.save()
 
-                store_info = order.get_store_info(store_id)
-                store_items = store_info.get("items", [])
-                for item in store_items:
-                    product_slug = item.get("product_slug")
-                    product_cart_qty = item.get("product_cart_qty")
-                    if product_slug and product_cart_qty:
-                        store.update_product_qty(product_slug, product_cart_qty, "add")
+                # put the items of the store back in stock
+                Item.update_stock(order.get_stock_lines(store_ids=[store.id]), "add")
 
                 if is_single_cancel:
                     order.notify_user(
@@ -1488,21 +1478,18 @@ class RateItemMutation(Output, graphene.Mutation):
         # check if the user is a vendor and the item belongs to the user
         if user.profile.is_vendor and item.product_creator == user.profile.store:
             return RateItemMutation(error="You cannot rate your own item")
-        try:
-            rating_qs = Rating.objects.get(user=user, item=item)
-            rating_qs.stars = rating.stars.value
-            rating_qs.comment = filter_comment(rating.comment)
-            rating_qs.save()
-            return RateItemMutation(success=True, review_id=rating_qs.id)
-        except Rating.DoesNotExist:
-            new_rating = Rating.objects.create(
+        # lock the user's rating so the item's rating aggregates count it once
+        with transaction.atomic():
+            user_rating, created = Rating.objects.select_for_update().get_or_create(
                 user=user,
                 item=item,
-                stars=rating.stars.value,
-                comment=rating.comment,
+                defaults={"stars": rating.stars.value, "comment": rating.comment},
             )
-            new_rating.save()
-            return RateItemMutation(success=True, review_id=new_rating.id)
+            if not created:
+                user_rating.stars = rating.stars.value
+                user_rating.comment = filter_comment(rating.comment)
+                user_rating.save()
+        return RateItemMutation(success=True, review_id=user_rating.id)
 
 
 class HelpfulReviewMutation(Output, graphene.Mutation):
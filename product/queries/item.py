@@ -60,8 +60,7 @@ class ItemQueries(graphene.ObjectType):
         return items
 
     def resolve_item(self, info, item_slug):
-        from django.utils import timezone
-        from django.db.models import F
+        from trayapp.counters import ITEM_VIEWS_COUNTER
 
         user = info.context.user
         item = (
@@ -82,18 +81,12 @@ class ItemQueries(graphene.ObjectType):
                 item = item_by_store.first()
 
         if not item is None:
-            # Use F() to prevent race conditions
-            Item.objects.filter(id=item.id).update(product_views=F('product_views') + 1)
+            # buffered, the views are added to the item by the counter flusher
+            ITEM_VIEWS_COUNTER.incr(item.id)
             
-            # Batch create activity asynchronously if user is authenticated
+            # buffered, the activities are saved in batches
             if info.context.user.is_authenticated:
-                from django.db import transaction
-                transaction.on_commit(lambda: UserActivity.objects.create(
-                    user_id=info.context.user.id,
-                    activity_type="view",
-                    item=item,
-                    timestamp=timezone.now()
-                ))
+                UserActivity.record(info.context.user.id, item.id, "view")
         else:
             raise GraphQLError("404: Item Not Found")
 
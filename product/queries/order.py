@@ -1,6 +1,6 @@
 import graphene
 from graphql import GraphQLError
-from product.models import Order
+from product.models import Order, OrderStore
 from users.models import DeliveryPerson, Profile
 from trayapp.permissions import IsAuthenticated, permission_checker
 from graphene_django.filter import DjangoFilterConnectionField
@@ -14,11 +14,22 @@ from ..types import (
 from django.db.models import Q
 
 
+class OrderFilterConnectionField(DjangoFilterConnectionField):
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        connection = super().resolve_connection(
+            connection, args, iterable, max_limit=max_limit
+        )
+        # the page is known now, batch what its orders refer to
+        Order.prime_loaders([edge.node for edge in connection.edges])
+        return connection
+
+
 class OrderQueries(graphene.ObjectType):
-    orders = DjangoFilterConnectionField(OrderNode)
-    store_orders = DjangoFilterConnectionField(StoreOrderNode)
+    orders = OrderFilterConnectionField(OrderNode)
+    store_orders = OrderFilterConnectionField(StoreOrderNode)
 
-    deliveries = DjangoFilterConnectionField(DeliveryPersonOrderNode)
+    deliveries = OrderFilterConnectionField(DeliveryPersonOrderNode)
     get_order = graphene.Field(OrderType, order_id=graphene.String(required=True))
 
     order_status = graphene.String(order_id=graphene.String(required=True))
@@ -27,6 +38,7 @@ class OrderQueries(graphene.ObjectType):
         StatusOrdersCountType,
         statuses=graphene.List(graphene.String),
         who=graphene.String(),
+        days=graphene.Int(),  # only count orders from the last n days
     )
 
     @permission_checker([IsAuthenticated])
@@ -74,13 +86,13 @@ class OrderQueries(graphene.ObjectType):
 
     @permission_checker([IsAuthenticated])
     def resolve_orders(self, info, **kwargs):
-        return info.context.user.orders.all()
+        return Order.prefetch_related_fields(info.context.user.orders.all())
 
     @permission_checker([IsAuthenticated])
     def resolve_store_orders(self, info, **kwargs):
         user = info.context.user
         if "VENDOR" in user.roles:
-            return user.profile.store.orders.all()
+            return Order.prefetch_related_fields(user.profile.store.orders.all())
         else:
             raise GraphQLError("You are not a vendor")
 
@@ -89,7 +101,9 @@ class OrderQueries(graphene.ObjectType):
         user = info.context.user
         profile: Profile = user.profile
         if "DELIVERY_PERSON" in user.roles:
-            return profile.get_delivery_person().orders.all()
+            return Order.prefetch_related_fields(
+                profile.get_delivery_person().orders.all()
+            )
         else:
             raise GraphQLError("You are not a delivery person")
 
@@ -104,82 +118,33 @@ class OrderQueries(graphene.ObjectType):
         return order_qs.first().get_order_status(current_user_profile)
 
     @permission_checker([IsAuthenticated])
-    def resolve_status_orders_count(self, info, statuses: list[str], who: str):
-        statuses_with_counts = []
+    def resolve_status_orders_count(
+        self, info, statuses: list[str], who: str, days: int = None
+    ):
         user = info.context.user
         profile: Profile = user.profile
         who = who.lower()
         if not who in ["delivery_person", "vendor"]:
             raise GraphQLError("Invalid Role")
 
-        orders = []
-
-        if who == "vendor":
-            if not "VENDOR" in user.roles:
-                raise GraphQLError("You are not a vendor")
-            # get recent orders
-            orders: list[Order] = profile.store.orders
-            # .filter(
-            #     created_at__date__gte=timezone.now().date()
-            #     - timezone.timedelta(days=7)  # get orders from the last 7 days
-            # )
-        elif who == "delivery_person":
-            if not "DELIVERY_PERSON" in user.roles:
-                raise GraphQLError("You are not a delivery person")
-            orders: list[Order] = profile.get_delivery_person().orders.all()
+        if who == "vendor" and not "VENDOR" in user.roles:
+            raise GraphQLError("You are not a vendor")
+        if who == "delivery_person" and not "DELIVERY_PERSON" in user.roles:
+            raise GraphQLError("You are not a delivery person")
 
-        else:
-            raise GraphQLError("Invalid Role")
+        # all the status counts come from one cached aggregate
+        status_counts = OrderStore.get_status_counts(profile, who, days=days)
 
-        orders_not_seen_by_profile = orders.exclude(
-            profiles_seen__contains=[profile.id]
-        )
+        statuses_with_counts = []
         for status in statuses:
             status = status.upper()
-            orders_with_status_new_count = [
-                order
-                for order in orders_not_seen_by_profile
-                if order.get_order_status(profile).upper() in status
-                and not profile.id in order.profiles_seen
-            ]
-            orders_with_status_count = [
-                order
-                for order in orders
-                if order.get_order_status(profile).upper() in status
-            ]
-
-            if status == "ONGOING":
-                # get orders with status ["pening", "out-for-delivery"]
-                orders_with_status_count = [
-                    order
-                    for order in orders
-                    if order.get_order_status(profile).upper().replace("_", "-")
-                    in ["PENDING", "OUT-FOR-DELIVERY"]
-                ]
-
-            elif status == "READY":
-                # get orders with status ["ready-for-pickup", "ready-for-delivery", "no-delivery-person"]
-                orders_with_status_count = [
-                    order
-                    for order in orders
-                    if order.get_order_status(profile).upper()
-                    in ["READY_FOR_PICKUP", "READY_FOR_DELIVERY", "NO_DELIVERY_PERSON"]
-                ]
-
-            elif status == "COMPLETED":
-                # get orders with status ["delivered", "picked-up"]
-                orders_with_status_count = [
-                    order
-                    for order in orders
-                    if order.get_order_status(profile).upper()
-                    in ["DELIVERED", "PICKED_UP"]
-                ]
-
+            count, new_count = 0, 0
+            for order_status in OrderStore.get_statuses(status):
+                counts = status_counts.get(order_status)
+                if counts:
+                    count += counts["count"]
+                    new_count += counts["new_count"]
             statuses_with_counts.append(
-                {
-                    "status": status,
-                    "count": len(orders_with_status_count),
-                    "new_count": len(orders_with_status_new_count),
-                }
+                {"status": status, "count": count, "new_count": new_count}
             )
         return statuses_with_counts
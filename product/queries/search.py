@@ -0,0 +1,38 @@
+import graphene
+
+from ..models import Item
+from ..types import SearchResultsType
+from users.models import Store
+from trayapp.search import search_queryset, ITEM_SEARCH, STORE_SEARCH
+
+# most results of each kind returned by `search`
+SEARCH_MAX_COUNT = 50
+
+
+class SearchQueries(graphene.ObjectType):
+    search = graphene.Field(
+        SearchResultsType,
+        query=graphene.String(required=True),
+        school=graphene.String(),
+        campus=graphene.String(),
+        count=graphene.Int(),
+    )
+
+    def resolve_search(self, info, query, school=None, campus=None, count=20):
+        """
+        Items and stores matching `query`, the best matches first
+        """
+        count = min(max(count, 0), SEARCH_MAX_COUNT)
+        items = Item.get_items().filter(product_status="active")
+        stores = Store.objects.filter(is_approved=True)
+        if school:
+            items = items.filter(product_creator__school__slug=school)
+            stores = stores.filter(school__slug=school)
+        if campus:
+            items = items.filter(product_creator__campus__iexact=campus)
+            stores = stores.filter(campus__iexact=campus)
+
+        return SearchResultsType(
+            items=search_queryset(items, query, ITEM_SEARCH)[:count],
+            stores=search_queryset(stores, query, STORE_SEARCH)[:count],
+        )
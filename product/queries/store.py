@@ -1,7 +1,5 @@
 import graphene
 from django.db.models import Q
-# from django.contrib.gis.geos import Point
-# from django.contrib.gis.measure import D
 from users.models import Store
 from product.models import Item
 from product.types import StoreType
@@ -20,12 +18,6 @@ class StoreQueries(graphene.ObjectType):
     def resolve_nearby_stores(
         self, info, latitude, longitude, radius, limit=None, offset=0
     ):
-        # Convert radius from kilometers to meters
-        radius_meters = radius * 1000
-
-        # Create a point from the given coordinates
-        # user_location = Point(longitude, latitude, srid=4326)
-
         # Base query for stores within radius
         stores_query = (
             Store.objects.filter(
@@ -34,42 +26,31 @@ class StoreQueries(graphene.ObjectType):
                 & Q(is_approved=True)
                 & Q(status="online")
             )
-            # .filter(location__distance_lte=(user_location, D(m=radius_meters)))
             .select_related(
-                "vendor", "vendor__user", "store_type", "gender_preference", "school"
-            )
-            .prefetch_related(
-                "menus",
-                "menus__items",
-                "menus__items__product_images",
-                "storeopenhours_set",
+                "vendor", "vendor__user", "gender_preference", "school"
             )
+            .prefetch_related("storeopenhours_set")
         )
 
-        # Apply pagination if specified
-        if limit is not None:
-            stores_query = stores_query[offset : offset + limit]
-
-        # Execute query and calculate distances
-        stores = list(stores_query)
+        # stores within the radius sorted by distance and store rank,
+        # only the requested page is loaded with the prefetches above
+        stores = Store.get_nearby_stores(
+            latitude,
+            longitude,
+            radius,
+            limit=limit,
+            offset=offset,
+            queryset=stores_query,
+        )
 
-        # Calculate distance and is_open status for each store
+        # Calculate is_open status for each store
+        stores_is_open_data = Store.get_stores_is_open_data(stores)
         for store in stores:
-            # store_location = Point(
-            #     store.primary_address_lng, store.primary_address_lat, srid=4326
-            # )
-            # store.distance = (
-            #     user_location.distance(store_location) / 1000
-            # )  # Convert to kilometers
-
             # Add is_open_data to store
-            is_open_data = store.get_is_open_data()
+            is_open_data = stores_is_open_data[store.id]
             store.is_open_data = {
                 "is_open": is_open_data["is_open"],
                 "message": is_open_data["message"],
             }
 
-        # Sort by distance and store rank
-        # stores.sort(key=lambda x: (x.distance, -x.store_rank))
-
         return stores
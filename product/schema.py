@@ -19,10 +19,16 @@ from product.queries.item import ItemQueries
 from product.queries.order import OrderQueries
 from product.queries.reviews import ReviewsQueries
 from product.queries.store import StoreQueries
+from product.queries.search import SearchQueries
 
 
 class Query(
-    ItemQueries, ReviewsQueries, OrderQueries, StoreQueries, graphene.ObjectType
+    ItemQueries,
+    ReviewsQueries,
+    OrderQueries,
+    StoreQueries,
+    SearchQueries,
+    graphene.ObjectType,
 ):
     all_item_attributes = graphene.List(ItemAttributeType)
     item_attributes = graphene.List(ItemAttributeType, _type=graphene.Int())
@@ -1,59 +1,63 @@
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.dispatch import receiver
-from django.db.models.signals import pre_save, pre_delete
-
-from trayapp.utils import (
-    delete_dir,
-    image_resized,
-    image_exists,
+from django.db.models.signals import (
+    pre_save,
+    pre_delete,
+    post_save,
+    post_delete,
+    m2m_changed,
 )
-from .models import ItemImage
+
+from trayapp.utils import image_exists
+from trayapp.images import image_has_changed, schedule_image_processing
+from trayapp.search import schedule_search_update
+from trayapp.query_cache import schedule_query_cache_invalidation
+from .models import Item, ItemImage
 
 @receiver(pre_save, sender=ItemImage, dispatch_uid="ItemImage.save_image")
 def save_image(sender, instance, **kwargs):
-    # add Itemimage (original)
-    if instance._state.adding:
-        #  item_image
-        file, name, content_type, size = image_resized(instance.item_image, 1024, 1024)
-        new_item_image = InMemoryUploadedFile(
-            file, "ImageField", name, content_type, size, None
-        )
-        instance.item_image = new_item_image
-
-    # update Itemimage (original)
-    if not instance._state.adding:
+    # the upload is stored as it is, its renditions are made off the request
+    old_name = instance._original_item_image_name
+    if instance._state.adding or image_has_changed(instance.item_image, old_name):
+        instance.item_image_renditions = {}
+        schedule_image_processing()
+
         # we have 2 cases:
         # - replace old with new
         # - delete old (when 'clear' checkbox is checked)
-
-        #  item_image
-        old = sender.objects.get(pk=instance.pk).item_image
-        can_delete = image_exists(old.name)
-        new = instance.item_image
-        if can_delete and ((old and not new) or (old and new and old.url != new.url)):
-            old.delete(save=False)
-            if image_exists(old.name):
-                delete_dir(
-                    old.url.replace(old.name, "")
-                    .replace(old.format, "")
-                    .replace(".", "")
-                )
-            file, name, content_type, size = image_resized(
-                instance.item_image, 1024, 1024
-            )
-            new_item_image = InMemoryUploadedFile(
-                file, "ImageField", name, content_type, size, None
-            )
-            instance.item_image = new_item_image
+        if old_name and image_exists(old_name):
+            instance.item_image.storage.delete(old_name)
 
 
 @receiver(pre_delete, sender=ItemImage, dispatch_uid="ItemImage.delete_image")
 def delete_image(sender, instance, **kwargs):
-    try:
-        s = sender.objects.get(pk=instance.pk)
-        can_delete = image_exists(s.item_image.name)
-        if can_delete:
-            if (not s.item_image or s.item_image is not None):
-                s.item_image.delete(False)
-    except sender.DoesNotExist:
-        pass
+    # the renditions are shared by the uploads with the same content, they are kept
+    if instance.item_image and image_exists(instance.item_image.name):
+        instance.item_image.delete(False)
+
+
+@receiver(post_save, sender=Item, dispatch_uid="Item.update_search_document")
+def update_item_search_document(sender, instance, **kwargs):
+    schedule_search_update(item_ids=[instance.id])
+
+
+@receiver(
+    m2m_changed,
+    sender=Item.product_categories.through,
+    dispatch_uid="Item.update_categories_search_document",
+)
+def update_item_categories_search_document(sender, instance, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear") and isinstance(
+        instance, Item
+    ):
+        schedule_search_update(item_ids=[instance.id])
+
+
+# the cached answers of the public queries are made of the items and their images
+@receiver(post_save, sender=Item, dispatch_uid="Item.invalidate_query_cache")
+@receiver(post_delete, sender=Item, dispatch_uid="Item.invalidate_query_cache_on_delete")
+@receiver(post_save, sender=ItemImage, dispatch_uid="ItemImage.invalidate_query_cache")
+@receiver(
+    post_delete, sender=ItemImage, dispatch_uid="ItemImage.invalidate_query_cache_on_delete"
+)
+def invalidate_item_query_cache(sender, instance, **kwargs):
+    schedule_query_cache_invalidation("items")
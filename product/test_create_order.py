@@ -0,0 +1,130 @@
+from datetime import time
+
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from product.models import Item, Order
+from users.models import UserAccount, Profile, Store, StoreOpenHours
+from trayapp.schema import schema
+
+CREATE_ORDER_MUTATION = """
+mutation ($storesInfos: [StoreInfoInputType]!, $shipping: ShippingInputType!) {
+    createOrder(
+        overallPrice: 20000
+        deliveryFee: 0
+        storeNotes: []
+        shipping: $shipping
+        storesInfos: $storesInfos
+    ) {
+        success
+        error
+        orderId
+    }
+}
+"""
+
+
+class CreateOrderQueryCountTests(TestCase):
+    """
+    Queries of a 20 line, 4 store cart,
+    the cart is validated with set based queries instead of one query per line
+    """
+
+    STORES_COUNT = 4
+    ITEMS_PER_STORE = 5
+
+    # queries needed to validate the cart and create the order
+    MAX_QUERIES = 25
+
+    def setUp(self):
+        self.stores = []
+        for i in range(self.STORES_COUNT):
+            vendor = UserAccount.objects.create_user(
+                username=f"vendor{i}", email=f"vendor{i}@example.com", password="pass"
+            )
+            store = Store.objects.create(
+                vendor=Profile.objects.get(user=vendor),
+                store_name=f"Store {i}",
+                store_nickname=f"store{i}",
+                store_type="restaurant",
+                is_approved=True,
+            )
+            # open all day, bulk_create skips the conversion to UTC done in save()
+            StoreOpenHours.objects.bulk_create(
+                [
+                    StoreOpenHours(
+                        store=store,
+                        day=None,
+                        open_time=time(0, 0),
+                        close_time=time(23, 59, 59),
+                    )
+                ]
+            )
+            Item.objects.bulk_create(
+                [
+                    Item(
+                        product_name=f"Item {i}-{j}",
+                        product_slug=f"item-{i}-{j}",
+                        product_price=1000,
+                        product_creator=store,
+                    )
+                    for j in range(self.ITEMS_PER_STORE)
+                ]
+            )
+            self.stores.append(store)
+
+        self.customer = UserAccount.objects.create_user(
+            username="customer", email="customer@example.com", password="pass"
+        )
+
+    def get_stores_infos(self):
+        return [
+            {
+                "id": str(i),
+                "storeId": str(store.id),
+                "items": [
+                    {
+                        "productName": f"Item {i}-{j}",
+                        "productSlug": f"item-{i}-{j}",
+                        "productPrice": 1000,
+                        "productImage": "image.png",
+                        "productCartQty": 1,
+                    }
+                    for j in range(self.ITEMS_PER_STORE)
+                ],
+                "total": {"price": 5000, "platePrice": 0, "optionGroupsPrice": 0},
+                "count": {"items": self.ITEMS_PER_STORE, "plate": 0},
+            }
+            for i, store in enumerate(self.stores)
+        ]
+
+    def test_create_order_query_count(self):
+        request = RequestFactory().post("/graphql")
+        request.user = UserAccount.objects.get(id=self.customer.id)
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(
+                CREATE_ORDER_MUTATION,
+                variables={
+                    "storesInfos": self.get_stores_infos(),
+                    "shipping": {"address": "pickup", "sch": None},
+                },
+                context_value=request,
+            )
+
+        self.assertIsNone(result.errors)
+        self.assertTrue(result.data["createOrder"]["success"])
+
+        order = Order.objects.get(order_track_id=result.data["createOrder"]["orderId"])
+        self.assertEqual(order.linked_items.count(), 20)
+        self.assertEqual(order.linked_stores.count(), 4)
+
+        item_queries = [
+            query
+            for query in ctx.captured_queries
+            if '"product_item"."product_slug" IN' in query["sql"]
+        ]
+        # one query for the whole cart, not one per line
+        self.assertEqual(len(item_queries), 1)
+        self.assertLessEqual(len(ctx.captured_queries), self.MAX_QUERIES)
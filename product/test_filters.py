@@ -0,0 +1,113 @@
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from product.models import Item, ItemAttribute
+from users.models import UserAccount, Profile, Store, Menu
+from trayapp.schema import schema
+
+ITEMS_BY_CATEGORY_QUERY = """
+query ($category: String, $storeNickname: String, $storeMenuName: String) {
+    items(
+        category: $category
+        storeNickname: $storeNickname
+        storeMenuName: $storeMenuName
+        first: 20
+    ) {
+        edges {
+            node {
+                productName
+                productSlug
+            }
+        }
+    }
+}
+"""
+
+
+class ItemFilterTests(TestCase):
+    """
+    The `items` filters, the number of queries of `items(category:)`
+    should stay flat as the catalog grows
+    """
+
+    # more items than the page, all of them in another category
+    CATALOG_SIZE = 500
+
+    @classmethod
+    def setUpTestData(cls):
+        user = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        profile = Profile.objects.get(user=user)
+        cls.store = Store.objects.create(
+            vendor=profile,
+            store_name="Test Store",
+            store_nickname="TestStore",
+            store_type="restaurant",
+            is_approved=True,
+        )
+        cls.menu = Menu.objects.create(name="Rice Meals", store=cls.store)
+        cls.rice = ItemAttribute.objects.create(name="Rice", slug="rice", _type="CATEGORY")
+        cls.drinks = ItemAttribute.objects.create(
+            name="Drinks", slug="drinks", _type="CATEGORY"
+        )
+
+    def seed_items(self, count, prefix, category):
+        Item.objects.bulk_create(
+            [
+                Item(
+                    product_name=f"{prefix} {i}",
+                    product_slug=f"{prefix}-{i}",
+                    product_creator=self.store,
+                    product_menu=self.menu,
+                )
+                for i in range(count)
+            ],
+        )
+        # bulk_create doesn't set the pks on every database, so read them back
+        item_ids = Item.objects.filter(
+            product_slug__in=[f"{prefix}-{i}" for i in range(count)]
+        ).values_list("id", flat=True)
+        Through = Item.product_categories.through
+        Through.objects.bulk_create(
+            [
+                Through(item_id=item_id, itemattribute_id=category.id)
+                for item_id in item_ids
+            ]
+        )
+
+    def run_items_query(self, **variables):
+        request = RequestFactory().get("/graphql")
+        request.user = AnonymousUser()
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(
+                ITEMS_BY_CATEGORY_QUERY, variables=variables, context_value=request
+            )
+        self.assertIsNone(result.errors)
+        return result.data["items"]["edges"], len(ctx.captured_queries)
+
+    def test_category_filter_cost_stays_flat(self):
+        self.seed_items(10, "rice", self.rice)
+        self.seed_items(10, "drink", self.drinks)
+        edges, small_queries = self.run_items_query(category="rice")
+        self.assertEqual(len(edges), 10)
+
+        self.seed_items(self.CATALOG_SIZE, "bulk-drink", self.drinks)
+        edges, large_queries = self.run_items_query(category="rice")
+        self.assertEqual(len(edges), 10)
+        self.assertTrue(all(e["node"]["productSlug"].startswith("rice") for e in edges))
+
+        # the filter is a join, so the number of queries does not depend on the catalog
+        self.assertEqual(small_queries, large_queries)
+
+    def test_store_nickname_and_menu_name_are_case_insensitive(self):
+        self.seed_items(3, "rice", self.rice)
+        edges, _ = self.run_items_query(
+            storeNickname=" teststore ", storeMenuName="rice meals"
+        )
+        self.assertEqual(len(edges), 3)
+
+        edges, _ = self.run_items_query(storeNickname="otherstore")
+        self.assertEqual(len(edges), 0)
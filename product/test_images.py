@@ -0,0 +1,133 @@
+import io
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from product.models import Item, ItemImage
+from users.models import UserAccount, Profile, Store
+from trayapp.images import get_rendition_urls, process_pending_images
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_upload(name="photo.png", size=(2000, 1000), mode="RGBA"):
+    file = io.BytesIO()
+    Image.new(mode, size, (200, 40, 40, 128)[: len(mode)]).save(file, "PNG")
+    return SimpleUploadedFile(name, file.getvalue(), content_type="image/png")
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_RENDITIONS_AUTO_PROCESS=False)
+class ImageRenditionsTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        vendor = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        self.profile = Profile.objects.get(user=vendor)
+        store = Store.objects.create(
+            vendor=self.profile,
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+        )
+        self.item = Item.objects.create(
+            product_name="Rice", product_slug="rice", product_creator=store
+        )
+
+    def test_upload_is_stored_raw_and_rendered_off_request(self):
+        upload = make_upload()
+        content = upload.read()
+        upload.seek(0)
+        item_image = ItemImage.objects.create(product=self.item, item_image=upload)
+
+        # the original is not re-encoded on save
+        with open(item_image.item_image.path, "rb") as file:
+            self.assertEqual(file.read(), content)
+        self.assertEqual(item_image.item_image_renditions, {})
+
+        self.assertEqual(process_pending_images(), 1)
+        item_image.refresh_from_db()
+        renditions = item_image.item_image_renditions
+        self.assertEqual(set(renditions), {"hash", "thumb", "card", "full"})
+
+        storage = item_image.item_image.storage
+        with Image.open(storage.path(renditions["thumb"]["webp"])) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ("WEBP", (160, 80)))
+        with Image.open(storage.path(renditions["full"]["jpeg"])) as full:
+            self.assertEqual((full.format, full.size), ("JPEG", (1024, 512)))
+
+        urls = get_rendition_urls(renditions, storage)
+        self.assertTrue(urls["card"]["webp"].endswith("/card.webp"))
+
+    def test_same_content_is_rendered_once(self):
+        ItemImage.objects.create(product=self.item, item_image=make_upload("a.png"))
+        process_pending_images()
+        rendition_dir = os.path.join(MEDIA_ROOT, "renditions")
+        files_count = sum(len(files) for _, _, files in os.walk(rendition_dir))
+
+        second = ItemImage.objects.create(
+            product=self.item, item_image=make_upload("b.png")
+        )
+        process_pending_images()
+        second.refresh_from_db()
+
+        first = ItemImage.objects.exclude(id=second.id).get()
+        self.assertEqual(first.item_image_renditions, second.item_image_renditions)
+        self.assertEqual(
+            sum(len(files) for _, _, files in os.walk(rendition_dir)), files_count
+        )
+
+    def test_profile_save_does_not_reload_the_image(self):
+        self.profile.image = make_upload("avatar.png", size=(600, 600), mode="RGB")
+        self.profile.save()
+        self.assertEqual(process_pending_images(), 1)
+
+        profile = Profile.objects.get(id=self.profile.id)
+        self.assertEqual(set(profile.image_renditions), {"hash", "thumb", "card"})
+        with CaptureQueriesContext(connection) as ctx:
+            profile.city = "Lagos"
+            profile.save()
+
+        selects = [
+            q
+            for q in ctx.captured_queries
+            if q["sql"].startswith("SELECT") and '"users_profile"' in q["sql"]
+        ]
+        self.assertEqual(selects, [])
+        profile.refresh_from_db()
+        # the renditions are kept while the image does not change
+        self.assertIn("hash", profile.image_renditions)
+
+    def test_cleared_image_drops_its_renditions(self):
+        store = Store.objects.get(store_nickname="teststore")
+        store.store_cover_image = make_upload("cover.png", mode="RGB")
+        store.save()
+        self.profile.image = make_upload("avatar.png", size=(600, 600), mode="RGB")
+        self.profile.save()
+        self.assertEqual(process_pending_images(), 2)
+
+        store = Store.objects.get(id=store.id)
+        self.assertIn("hash", store.store_cover_image_renditions)
+        store.store_cover_image = None
+        store.save()
+        store.refresh_from_db()
+        self.assertEqual(store.store_cover_image_renditions, {})
+
+        profile = Profile.objects.get(id=self.profile.id)
+        self.assertIn("hash", profile.image_renditions)
+        profile.image = None
+        profile.save()
+        profile.refresh_from_db()
+        self.assertEqual(profile.image_renditions, {})
+        # nothing left to render
+        self.assertEqual(process_pending_images(), 0)
@@ -0,0 +1,149 @@
+import random
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from users.models import UserAccount, Profile, Store
+from trayapp.schema import schema
+from trayapp.utils import haversine_distances
+
+NEARBY_STORES_QUERY = """
+query ($latitude: Float!, $longitude: Float!, $radius: Float!, $limit: Int, $offset: Int) {
+    nearbyStores(
+        latitude: $latitude
+        longitude: $longitude
+        radius: $radius
+        limit: $limit
+        offset: $offset
+    ) {
+        storeId
+        distance
+        storeRank
+    }
+}
+"""
+
+# Lagos
+LATITUDE, LONGITUDE = 6.5244, 3.3792
+
+
+class NearbyStoresTests(TestCase):
+    """
+    `nearbyStores` over synthetic stores spread over Nigeria,
+    the grid cells keep the number of candidate stores independent of the catalog size
+    """
+
+    STORES_COUNT = 10_000
+
+    @classmethod
+    def setUpTestData(cls):
+        user = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        cls.vendor = Profile.objects.get(user=user)
+
+    def seed_stores(self, count, seed, spread=None):
+        # all over Nigeria, or within `spread` degrees of Lagos
+        rng = random.Random(seed)
+        stores = []
+        for i in range(count):
+            if spread is None:
+                lat, lng = rng.uniform(4, 14), rng.uniform(3, 15)
+            else:
+                lat = LATITUDE + rng.uniform(-spread, spread)
+                lng = LONGITUDE + rng.uniform(-spread, spread)
+            stores.append(
+                Store(
+                    vendor=self.vendor,
+                    store_name=f"Store {seed}-{i}",
+                    store_nickname=f"store-{seed}-{i}",
+                    store_type="restaurant",
+                    store_rank=rng.randint(0, 5),
+                    is_approved=True,
+                    status="online",
+                    primary_address_lat=lat,
+                    primary_address_lng=lng,
+                    geo_cell=Store.get_geo_cell(lat, lng),
+                )
+            )
+        Store.objects.bulk_create(stores, batch_size=5000)
+
+    def run_nearby_stores_query(self, **variables):
+        request = RequestFactory().get("/graphql")
+        request.user = AnonymousUser()
+        with CaptureQueriesContext(connection) as ctx:
+            result = schema.execute(
+                NEARBY_STORES_QUERY,
+                variables={"latitude": LATITUDE, "longitude": LONGITUDE, **variables},
+                context_value=request,
+            )
+        self.assertIsNone(result.errors)
+        return result.data["nearbyStores"], len(ctx.captured_queries)
+
+    def get_expected_store_ids(self, radius):
+        # brute force over every store
+        ids, lats, lngs, ranks = zip(
+            *Store.objects.values_list(
+                "id", "primary_address_lat", "primary_address_lng", "store_rank"
+            )
+        )
+        distances = haversine_distances(LATITUDE, LONGITUDE, lats, lngs)
+        within = [
+            (distance, -rank, store_id)
+            for store_id, distance, rank in zip(ids, distances, ranks)
+            if distance <= radius
+        ]
+        return [str(store_id) for _, _, store_id in sorted(within)]
+
+    def count_candidates(self, radius):
+        return Store.objects.filter(
+            Store.get_geo_cell_filter(LATITUDE, LONGITUDE, radius)
+        ).count()
+
+    def test_nearby_stores_lookup_is_sublinear(self):
+        radius = 15
+        self.seed_stores(10, seed=0, spread=0.1)
+        self.seed_stores(self.STORES_COUNT // 10, seed=1)
+        stores, small_queries = self.run_nearby_stores_query(radius=radius)
+        self.assertEqual(
+            [store["storeId"] for store in stores], self.get_expected_store_ids(radius)
+        )
+
+        self.seed_stores(self.STORES_COUNT - self.STORES_COUNT // 10, seed=2)
+        stores, large_queries = self.run_nearby_stores_query(radius=radius)
+        candidates = self.count_candidates(radius)
+        expected_store_ids = self.get_expected_store_ids(radius)
+        self.assertGreater(len(expected_store_ids), 0)
+        self.assertEqual([store["storeId"] for store in stores], expected_store_ids)
+
+        # only the stores of a few grid cells are read, not the whole table
+        self.assertLess(candidates, self.STORES_COUNT / 100)
+        self.assertEqual(small_queries, large_queries)
+
+    def test_nearby_stores_are_sorted_and_paginated(self):
+        self.seed_stores(5_000, seed=3)
+        radius = 40
+        stores, _ = self.run_nearby_stores_query(radius=radius)
+        distances = [store["distance"] for store in stores]
+        self.assertTrue(all(distance <= radius for distance in distances))
+        self.assertEqual(distances, sorted(distances))
+
+        page, _ = self.run_nearby_stores_query(radius=radius, limit=5, offset=5)
+        self.assertEqual(
+            [store["storeId"] for store in page],
+            [store["storeId"] for store in stores[5:10]],
+        )
+
+    def test_stores_without_location_are_ignored(self):
+        Store.objects.create(
+            vendor=self.vendor,
+            store_name="No location",
+            store_nickname="no-location",
+            store_type="restaurant",
+            is_approved=True,
+            status="online",
+        )
+        stores, _ = self.run_nearby_stores_query(radius=10)
+        self.assertEqual(stores, [])
@@ -0,0 +1,110 @@
+from django.db import connection
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from product.models import Order
+from users.models import UserAccount, Profile, Store, School, DeliveryPerson
+from trayapp.request_memo import start_request_memo, end_request_memo
+from trayapp.schema import schema
+
+ORDER_FIELDS = """
+edges {
+    node {
+        id
+        viewAs
+        orderStatus
+        deliveryFee
+        deliveryFeePercentage
+        user { username }
+        storesInfos { storeId status store { storeName } }
+        shipping { sch address }
+        deliveryPeople { status fullName }
+        itemsImagesUrls
+        itemsCount
+        confirmPin
+        customerNote
+    }
+}
+"""
+STORE_ORDERS_QUERY = "{ storeOrders(first: 100) { %s } }" % ORDER_FIELDS
+ORDERS_QUERY = "{ orders(first: 100) { %s } }" % ORDER_FIELDS
+
+
+class OrderListQueryCountTests(TestCase):
+    """
+    Listing orders should cost the same number of queries for 5 or 50 orders,
+    the schools, stores and delivery people they refer to are loaded in batches
+    """
+
+    def setUp(self):
+        self.vendor_user = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        self.store = Store.objects.create(
+            vendor=Profile.objects.get(user=self.vendor_user),
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+        )
+        self.customer_user = UserAccount.objects.create_user(
+            username="customer", email="customer@example.com", password="testpass123"
+        )
+
+    def create_orders(self, count):
+        start = Order.objects.count()
+        for i in range(start, start + count):
+            school = School.objects.create(name=f"School {i}", slug=f"school-{i}")
+            delivery_user = UserAccount.objects.create_user(
+                username=f"rider{i}", email=f"rider{i}@example.com", password="testpass123"
+            )
+            delivery_person = DeliveryPerson.objects.create(
+                profile=Profile.objects.get(user=delivery_user)
+            )
+            order = Order.objects.create(
+                user=Profile.objects.get(user=self.customer_user),
+                order_payment_status="success",
+                shipping={"address": "Hall 1", "sch": school.slug},
+                stores_status=[{"storeId": self.store.id, "status": "pending"}],
+                stores_infos=[
+                    {
+                        "id": "1",
+                        "storeId": self.store.id,
+                        "items": [{"product_image": "image.png"}],
+                        "total": {"price": 1000, "plate_price": 0, "option_groups_price": 0},
+                        "count": {"items": 1, "plate": 0},
+                    }
+                ],
+            )
+            order.linked_stores.add(self.store)
+            order.linked_delivery_people.add(delivery_person)
+            order.delivery_people = [
+                {"id": delivery_person.id, "status": "pending", "storeId": self.store.id}
+            ]
+            order.save()
+
+    def count_queries(self, query, user):
+        request = RequestFactory().get("/graphql")
+        request.user = UserAccount.objects.get(id=user.id)
+        # the same memo the RequestMemoMiddleware gives a request
+        token = start_request_memo()
+        try:
+            with CaptureQueriesContext(connection) as ctx:
+                result = schema.execute(query, context_value=request)
+        finally:
+            end_request_memo(token)
+        self.assertIsNone(result.errors)
+        return len(ctx.captured_queries)
+
+    def test_store_orders_query_count_is_constant(self):
+        self.create_orders(5)
+        queries_for_5 = self.count_queries(STORE_ORDERS_QUERY, self.vendor_user)
+        self.create_orders(45)
+        queries_for_50 = self.count_queries(STORE_ORDERS_QUERY, self.vendor_user)
+        self.assertEqual(queries_for_5, queries_for_50)
+
+    def test_orders_query_count_is_constant(self):
+        self.create_orders(5)
+        queries_for_5 = self.count_queries(ORDERS_QUERY, self.customer_user)
+        self.create_orders(45)
+        queries_for_50 = self.count_queries(ORDERS_QUERY, self.customer_user)
+        self.assertEqual(queries_for_5, queries_for_50)
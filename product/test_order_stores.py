@@ -0,0 +1,256 @@
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory
+from graphql_relay import from_global_id
+
+from product.models import Order, OrderStore
+from users.models import (
+    UserAccount,
+    Profile,
+    Store,
+    DeliveryPerson,
+    DeliveryNotification,
+)
+from trayapp.request_memo import start_request_memo, end_request_memo
+from trayapp.schema import schema
+
+STORE_ORDERS_BY_STATUS_QUERY = """
+query StoreOrders($orderStatus: String) {
+    storeOrders(first: 100, orderStatus: $orderStatus) {
+        edges { node { id } }
+    }
+}
+"""
+
+
+class OrderStoresTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.vendor_user = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        self.store = Store.objects.create(
+            vendor=Profile.objects.get(user=self.vendor_user),
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+        )
+        self.other_vendor_user = UserAccount.objects.create_user(
+            username="vendor2", email="vendor2@example.com", password="testpass123"
+        )
+        self.other_store = Store.objects.create(
+            vendor=Profile.objects.get(user=self.other_vendor_user),
+            store_name="Other Store",
+            store_nickname="otherstore",
+            store_type="restaurant",
+        )
+        self.customer = Profile.objects.get(
+            user=UserAccount.objects.create_user(
+                username="customer",
+                email="customer@example.com",
+                password="testpass123",
+            )
+        )
+        self.delivery_person = DeliveryPerson.objects.create(
+            profile=Profile.objects.get(
+                user=UserAccount.objects.create_user(
+                    username="rider", email="rider@example.com", password="testpass123"
+                )
+            )
+        )
+
+    def create_order(self, stores_status):
+        order = Order.objects.create(
+            user=self.customer,
+            order_payment_status="success",
+            shipping={"address": "Hall 1"},
+            stores_status=stores_status,
+        )
+        order.linked_stores.add(
+            *Store.objects.filter(
+                id__in=[store_status["storeId"] for store_status in stores_status]
+            )
+        )
+        return order
+
+
+class OrderStoreSyncTests(OrderStoresTestCase):
+    def test_order_stores_follow_the_order(self):
+        order = self.create_order(
+            [
+                {"storeId": self.store.id, "status": "pending"},
+                {"storeId": self.other_store.id, "status": "pending"},
+            ]
+        )
+        self.assertEqual(
+            sorted(order.order_stores.values_list("store_id", "status")),
+            sorted([(self.store.id, "pending"), (self.other_store.id, "pending")]),
+        )
+        order_store = order.order_stores.get(store=self.store)
+        self.assertIsNone(order_store.delivery_person)
+        self.assertFalse(order_store.vendor_has_seen)
+
+        # the store is ready, a delivery person is assigned and the vendor saw it
+        order.stores_status = [
+            {"storeId": self.store.id, "status": "ready-for-delivery"},
+            {"storeId": self.other_store.id, "status": "pending"},
+        ]
+        order.delivery_people = [
+            {
+                "id": self.delivery_person.id,
+                "status": "pending",
+                "storeId": self.store.id,
+            }
+        ]
+        order.profiles_seen = [self.store.vendor_id]
+        order.linked_delivery_people.add(self.delivery_person)
+        order.save()
+
+        order_store = order.order_stores.get(store=self.store)
+        self.assertEqual(order_store.status, "ready-for-delivery")
+        self.assertEqual(order_store.delivery_person, self.delivery_person)
+        self.assertEqual(order_store.delivery_person_status, "pending")
+        self.assertTrue(order_store.vendor_has_seen)
+        self.assertFalse(order_store.delivery_person_has_seen)
+        self.delivery_person.refresh_from_db()
+        self.assertEqual(self.delivery_person.active_orders_count, 1)
+
+        # the other store leaves the order and the delivery is done
+        order.stores_status = [{"storeId": self.store.id, "status": "delivered"}]
+        order.delivery_people = [
+            {
+                "id": self.delivery_person.id,
+                "status": "delivered",
+                "storeId": self.store.id,
+            }
+        ]
+        order.save()
+
+        self.assertEqual(
+            list(order.order_stores.values_list("store_id", "status")),
+            [(self.store.id, "delivered")],
+        )
+        self.assertEqual(order.order_stores.get().delivery_person_status, "delivered")
+        self.delivery_person.refresh_from_db()
+        self.assertEqual(self.delivery_person.active_orders_count, 0)
+
+
+class StoreOrderFilterTests(OrderStoresTestCase):
+    def get_store_order_ids(self, order_status):
+        request = RequestFactory().get("/graphql")
+        request.user = UserAccount.objects.get(id=self.vendor_user.id)
+        token = start_request_memo()
+        try:
+            result = schema.execute(
+                STORE_ORDERS_BY_STATUS_QUERY,
+                variable_values={"orderStatus": order_status},
+                context_value=request,
+            )
+        finally:
+            end_request_memo(token)
+        self.assertIsNone(result.errors)
+        # the order node id is its track id
+        return sorted(
+            from_global_id(edge["node"]["id"])[1]
+            for edge in result.data["storeOrders"]["edges"]
+        )
+
+    def test_store_orders_are_filtered_by_the_store_status(self):
+        pending = self.create_order([{"storeId": self.store.id, "status": "pending"}])
+        ready = self.create_order(
+            [
+                {"storeId": self.store.id, "status": "ready-for-pickup"},
+                {"storeId": self.other_store.id, "status": "pending"},
+            ]
+        )
+        delivered = self.create_order(
+            [
+                {"storeId": self.store.id, "status": "delivered"},
+                {"storeId": self.other_store.id, "status": "ready-for-pickup"},
+            ]
+        )
+
+        self.assertEqual(
+            self.get_store_order_ids("ONGOING"), [pending.order_track_id]
+        )
+        # the other store's status doesn't match the vendor's orders
+        self.assertEqual(self.get_store_order_ids("READY"), [ready.order_track_id])
+        self.assertEqual(
+            self.get_store_order_ids("READY_FOR_PICKUP"), [ready.order_track_id]
+        )
+        self.assertEqual(
+            self.get_store_order_ids("COMPLETED"), [delivered.order_track_id]
+        )
+
+        # the filter follows a status update
+        pending.stores_status = [{"storeId": self.store.id, "status": "picked-up"}]
+        pending.save()
+        self.assertEqual(self.get_store_order_ids("ONGOING"), [])
+        self.assertEqual(
+            self.get_store_order_ids("COMPLETED"),
+            sorted([pending.order_track_id, delivered.order_track_id]),
+        )
+
+
+class OrderStatusCountsTests(OrderStoresTestCase):
+    def test_vendor_counts_follow_a_status_update(self):
+        vendor = self.store.vendor
+        order = self.create_order([{"storeId": self.store.id, "status": "pending"}])
+        self.assertEqual(
+            OrderStore.get_status_counts(vendor, "vendor"),
+            {"pending": {"count": 1, "new_count": 1}},
+        )
+
+        # the counts are cached, a write that skips the order isn't seen
+        OrderStore.objects.filter(order=order).update(status="cancelled")
+        self.assertEqual(
+            OrderStore.get_status_counts(vendor, "vendor"),
+            {"pending": {"count": 1, "new_count": 1}},
+        )
+
+        # saving the order clears the cache well inside its timeout
+        order.stores_status = [{"storeId": self.store.id, "status": "ready-for-pickup"}]
+        order.profiles_seen = [vendor.id]
+        order.save()
+        self.assertEqual(
+            OrderStore.get_status_counts(vendor, "vendor"),
+            {"ready-for-pickup": {"count": 1, "new_count": 0}},
+        )
+
+    def test_delivery_person_counts_follow_the_notifications(self):
+        profile = self.delivery_person.profile
+        order = self.create_order([{"storeId": self.store.id, "status": "pending"}])
+        self.assertEqual(
+            OrderStore.get_status_counts(profile, "delivery_person"),
+            {"new": {"count": 0, "new_count": 0}},
+        )
+
+        notification = DeliveryNotification.objects.create(
+            order=order,
+            store=self.store,
+            delivery_person=self.delivery_person,
+            status="sent",
+        )
+        self.assertEqual(
+            OrderStore.get_status_counts(profile, "delivery_person"),
+            {"new": {"count": 1, "new_count": 1}},
+        )
+
+        # the delivery person accepts the order
+        notification.status = "accepted"
+        notification.save()
+        order.linked_delivery_people.add(self.delivery_person)
+        order.delivery_people = [
+            {
+                "id": self.delivery_person.id,
+                "status": "pending",
+                "storeId": self.store.id,
+            }
+        ]
+        order.save()
+        self.assertEqual(
+            OrderStore.get_status_counts(profile, "delivery_person"),
+            {
+                "pending": {"count": 1, "new_count": 1},
+                "new": {"count": 0, "new_count": 0},
+            },
+        )
@@ -0,0 +1,89 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from product.models import Item, Rating
+from users.models import UserAccount, Profile, Store
+
+
+class ItemRatingsAggregatesTests(TestCase):
+    def setUp(self):
+        vendor = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        self.store = Store.objects.create(
+            vendor=Profile.objects.get(user=vendor),
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+        )
+        self.item = Item.objects.create(
+            product_name="Rice", product_slug="rice", product_creator=self.store
+        )
+        self.users = [
+            UserAccount.objects.create_user(
+                username=f"user{i}", email=f"user{i}@example.com", password="testpass123"
+            )
+            for i in range(3)
+        ]
+
+    def rate(self, user, stars):
+        return Rating.objects.create(user=user, item=self.item, stars=stars)
+
+    def assertAggregates(self, count, total, bad):
+        self.item.refresh_from_db()
+        self.assertEqual(
+            (
+                self.item.ratings_count,
+                self.item.ratings_sum,
+                self.item.bad_ratings_count,
+            ),
+            (count, total, bad),
+        )
+
+    def test_aggregates_follow_ratings(self):
+        self.rate(self.users[0], 5)
+        rating = self.rate(self.users[1], 2)
+        self.rate(self.users[2], 4)
+        self.assertAggregates(3, 11, 1)
+
+        rating = Rating.objects.get(id=rating.id)
+        rating.stars = 3
+        rating.save()
+        self.assertAggregates(3, 12, 0)
+
+        rating.delete()
+        self.assertAggregates(2, 9, 0)
+
+        Rating.objects.filter(item=self.item).delete()
+        self.assertAggregates(0, 0, 0)
+
+    def test_rating_resolvers_do_not_query(self):
+        self.rate(self.users[0], 5)
+        self.rate(self.users[1], 1)
+        self.rate(self.users[2], 4)
+        item = Item.objects.get(id=self.item.id)
+
+        with CaptureQueriesContext(connection) as ctx:
+            total_ratings = item.get_total_ratings()
+            average_rating = item.get_average_rating()
+            rating_percentage = item.calculate_rating_percentage()
+
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(total_ratings, 3)
+        self.assertEqual(average_rating, 3.3)
+        self.assertIsInstance(rating_percentage, float)
+
+    def test_repair_command_fixes_drifted_items(self):
+        self.rate(self.users[0], 5)
+        self.rate(self.users[1], 2)
+        Item.objects.filter(id=self.item.id).update(
+            ratings_count=10, ratings_sum=0, bad_ratings_count=4
+        )
+
+        call_command("repair_item_ratings", stdout=StringIO())
+        self.assertAggregates(2, 7, 1)
+        self.assertEqual(Item.repair_ratings_aggregates(), 0)
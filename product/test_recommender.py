@@ -0,0 +1,101 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from product.models import Item, Rating, Recommendation
+from product.utils import (
+    fold_in_new_activity,
+    recommend_items,
+    train_recommender,
+)
+from users.models import UserAccount, Profile, Store, UserActivity
+
+
+class RecommenderTests(TestCase):
+    """
+    The recommender is trained offline on every user's activity,
+    recommend_items only reads the stored recommendations and filters out unavailable items
+    """
+
+    def setUp(self):
+        cache.clear()
+        vendor = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        store = Store.objects.create(
+            vendor=Profile.objects.get(user=vendor),
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+            is_approved=True,
+        )
+        self.items = [
+            Item.objects.create(
+                product_name=f"Item {i}",
+                product_slug=f"item-{i}",
+                product_creator=store,
+            )
+            for i in range(6)
+        ]
+        self.users = [
+            UserAccount.objects.create_user(
+                username=f"user{i}", email=f"user{i}@example.com", password="pass"
+            )
+            for i in range(4)
+        ]
+        # two groups of users with the same taste
+        for user in self.users[:2]:
+            self.add_activity(user, self.items[:3], "purchased")
+        for user in self.users[2:]:
+            self.add_activity(user, self.items[3:], "purchased")
+        Rating.objects.create(user=self.users[0], item=self.items[0], stars=5)
+
+    def add_activity(self, user, items, activity_type):
+        UserActivity.objects.bulk_create(
+            [
+                UserActivity(user_id=user.id, item=item, activity_type=activity_type)
+                for item in items
+            ]
+        )
+
+    def test_recommendations_are_stored(self):
+        self.assertEqual(train_recommender(n_components=2, n=3), 4)
+        self.assertEqual(Recommendation.objects.count(), 5)
+
+        # a web process with its own cache reads them from the database once
+        cache.clear()
+        with self.assertNumQueries(5):
+            items = recommend_items(self.users[0].id, n=3)
+        self.assertEqual(
+            {item.id for item in items}, {item.id for item in self.items[:3]}
+        )
+        with self.assertNumQueries(4):
+            # the items and their prefetches, no training in the request
+            recommend_items(self.users[0].id, n=3)
+
+    def test_unavailable_items_are_filtered_out(self):
+        train_recommender(n_components=2, n=3)
+        Item.objects.filter(id=self.items[0].id).update(product_status="inactive")
+        items = recommend_items(self.users[0].id, n=3)
+        self.assertNotIn(self.items[0].id, [item.id for item in items])
+
+    def test_users_without_activity_get_popular_items(self):
+        train_recommender(n_components=2, n=3)
+        new_user = UserAccount.objects.create_user(
+            username="new", email="new@example.com", password="pass"
+        )
+        self.assertEqual(len(recommend_items(new_user.id, n=3)), 3)
+
+    def test_new_activity_is_folded_in(self):
+        train_recommender(n_components=2, n=3)
+        new_user = UserAccount.objects.create_user(
+            username="new", email="new@example.com", password="pass"
+        )
+        self.add_activity(new_user, self.items[4:], "purchased")
+
+        # the fold in runs in another process than the training
+        cache.clear()
+        self.assertEqual(fold_in_new_activity(n=3), 1)
+        items = recommend_items(new_user.id, n=3)
+        self.assertEqual(
+            {item.id for item in items}, {item.id for item in self.items[3:]}
+        )
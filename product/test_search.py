@@ -0,0 +1,165 @@
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase, RequestFactory
+
+from product.models import Item, ItemAttribute
+from users.models import UserAccount, Profile, Store, School
+from trayapp.schema import schema
+from trayapp.search import (
+    InProcessSearchIndex,
+    ITEM_SEARCH,
+    has_trigram,
+    search_in_process,
+    search_queryset,
+)
+
+SEARCH_QUERY = """
+query ($query: String!, $school: String, $campus: String) {
+    search(query: $query, school: $school, campus: $campus) {
+        items { productSlug }
+        stores { storeNickname }
+    }
+}
+"""
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.unilag = School.objects.create(name="University of Lagos", slug="unilag")
+        self.oau = School.objects.create(name="Obafemi Awolowo", slug="oau")
+        self.mama_put = self.create_store("Mama Put Kitchen", "mamaput", self.unilag)
+        self.grill = self.create_store("Suya Grill", "suyagrill", self.oau)
+        rice = ItemAttribute.objects.create(name="Rice", slug="rice", _type="product")
+
+        # the documents are updated once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.jollof = Item.objects.create(
+                product_name="Jollof Rice",
+                product_slug="jollof-rice",
+                product_desc="Smoky party jollof",
+                product_creator=self.mama_put,
+                product_clicks=5,
+            )
+            self.jollof.product_categories.add(rice)
+            self.fried_rice = Item.objects.create(
+                product_name="Fried Rice",
+                product_slug="fried-rice",
+                product_creator=self.mama_put,
+                product_clicks=50,
+            )
+            self.suya = Item.objects.create(
+                product_name="Beef Suya",
+                product_slug="beef-suya",
+                product_creator=self.grill,
+            )
+
+    def create_store(self, name, nickname, school):
+        user = UserAccount.objects.create_user(
+            username=nickname, email=f"{nickname}@example.com", password="testpass123"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            return Store.objects.create(
+                vendor=Profile.objects.get(user=user),
+                store_name=name,
+                store_nickname=nickname,
+                store_type="restaurant",
+                school=school,
+                campus="main",
+                is_approved=True,
+            )
+
+    def search(self, **variables):
+        request = RequestFactory().get("/graphql")
+        request.user = UserAccount.objects.get(username="mamaput")
+        result = schema.execute(SEARCH_QUERY, variables=variables, context_value=request)
+        self.assertIsNone(result.errors)
+        return (
+            [item["productSlug"] for item in result.data["search"]["items"]],
+            [store["storeNickname"] for store in result.data["search"]["stores"]],
+        )
+
+    def test_documents_are_maintained(self):
+        self.jollof.refresh_from_db()
+        self.assertEqual(
+            self.jollof.search_document,
+            "jollof rice smoky party jollof rice mama put kitchen mamaput main "
+            "university of lagos",
+        )
+
+        # renaming the store updates the documents of its items
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mama_put.store_name = "Iya Basira"
+            self.mama_put.save()
+        self.jollof.refresh_from_db()
+        self.assertIn("iya basira", self.jollof.search_document)
+
+    def test_store_items_are_reindexed_when_their_fields_change(self):
+        store = Store.objects.get(id=self.mama_put.id)
+        with patch("users.models.schedule_search_update") as schedule_search_update:
+            store.store_rank = 4
+            store.save()
+            schedule_search_update.assert_not_called()
+
+            store.store_bio = "Home cooked meals"
+            store.save()
+            schedule_search_update.assert_called_once_with(
+                store_ids=[store.id], with_store_items=False
+            )
+
+            schedule_search_update.reset_mock()
+            store.campus = "yaba"
+            store.save()
+            schedule_search_update.assert_called_once_with(
+                store_ids=[store.id], with_store_items=True
+            )
+
+    def test_prefix_search_is_ranked_by_relevance_and_clicks(self):
+        items, stores = self.search(query="jol ric")
+        self.assertEqual(items, ["jollof-rice"])
+
+        # both match "rice" by name, fried rice has more clicks
+        items, _ = self.search(query="rice")
+        self.assertEqual(items, ["fried-rice", "jollof-rice"])
+
+        items, stores = self.search(query="mama put")
+        self.assertEqual(stores, ["mamaput"])
+        self.assertEqual(set(items), {"jollof-rice", "fried-rice"})
+
+    def test_search_by_school_and_campus(self):
+        items, stores = self.search(query="suya", school="unilag")
+        self.assertEqual((items, stores), ([], []))
+
+        items, stores = self.search(query="suya", school="oau", campus="Main")
+        self.assertEqual((items, stores), (["beef-suya"], ["suyagrill"]))
+
+    def test_misspelled_query(self):
+        items, _ = self.search(query="jolof")
+        # postgres matches the misspellings with pg_trgm only, sqlite with the in-process index
+        if connection.vendor != "postgresql" or has_trigram():
+            self.assertEqual(items, ["jollof-rice"])
+        else:
+            self.assertEqual(items, [])
+
+        results = search_in_process(Item.objects.all(), "fryed rice", ITEM_SEARCH)
+        self.assertEqual(list(results), [self.fried_rice])
+
+    def test_in_process_results_are_capped(self):
+        with patch("trayapp.search.FALLBACK_MAX_RESULTS", 1):
+            results = search_in_process(Item.objects.all(), "rice", ITEM_SEARCH)
+            self.assertEqual(len(results), 1)
+
+    def test_in_process_index(self):
+        index = InProcessSearchIndex()
+        index.add(1, "Jollof Rice")
+        index.add(2, "Beef Suya")
+        self.assertEqual(set(index.search("jolof")), {1})
+        self.assertEqual(index.search("suya beef"), {2: 1.0})
+
+        index.add(1, "Ofada Rice")
+        self.assertEqual(index.search("jollof"), {})
+        index.remove(2)
+        self.assertEqual(index.search("suya"), {})
+
+    def test_empty_query(self):
+        self.assertEqual(list(search_queryset(Item.objects.all(), " ! ", ITEM_SEARCH)), [])
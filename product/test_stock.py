@@ -0,0 +1,108 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from product.models import Item, Order
+from users.models import UserAccount, Profile, Store, NotificationOutbox
+
+
+@override_settings(QUEUE_BACKEND="memory", NOTIFICATION_OUTBOX_AUTO_DISPATCH=False)
+class ItemStockTests(TestCase):
+    def setUp(self):
+        vendor = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        self.store = Store.objects.create(
+            vendor=Profile.objects.get(user=vendor),
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+        )
+        self.rice = Item.objects.create(
+            product_name="Rice",
+            product_slug="rice",
+            product_qty=10,
+            product_creator=self.store,
+        )
+        self.beans = Item.objects.create(
+            product_name="Beans",
+            product_slug="beans",
+            product_qty=3,
+            product_creator=self.store,
+        )
+        # no quantity is tracked for this item
+        self.water = Item.objects.create(
+            product_name="Water", product_slug="water", product_creator=self.store
+        )
+
+    def test_remove_stock_in_one_update(self):
+        lines = [
+            (self.store.id, "rice", 2),
+            (self.store.id, "beans", 1),
+            (self.store.id, "rice", 1),
+            (self.store.id, "water", 4),
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            stock = Item.update_stock(lines, "remove")
+
+        updates = [q for q in ctx.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.rice.refresh_from_db()
+        self.beans.refresh_from_db()
+        self.water.refresh_from_db()
+        self.assertEqual(self.rice.product_qty, 7)
+        self.assertEqual(self.beans.product_qty, 2)
+        self.assertEqual(self.water.product_qty, 0)
+        self.assertEqual(len(stock["updated"]), 2)
+        self.assertEqual(stock["out_of_stock"], [])
+
+    def test_out_of_stock_lines_are_reported(self):
+        stock = Item.update_stock([(self.store.id, "beans", 5)], "remove")
+        self.beans.refresh_from_db()
+        # the quantity never goes below 0
+        self.assertEqual(self.beans.product_qty, 0)
+        self.assertEqual([item.id for item in stock["out_of_stock"]], [self.beans.id])
+        self.assertEqual(
+            [item.id for item in stock["almost_out_of_stock"]], [self.beans.id]
+        )
+
+    def test_line_of_another_store_is_ignored(self):
+        stock = Item.update_stock([(self.store.id + 1, "rice", 2)], "remove")
+        self.rice.refresh_from_db()
+        self.assertEqual(self.rice.product_qty, 10)
+        self.assertEqual(stock["updated"], [])
+
+    def test_low_stock_notification_fires_once(self):
+        stock = Item.update_stock([(self.store.id, "rice", 9)], "remove")
+        notified_ids = Item.notify_low_stock(stock["almost_out_of_stock"])
+        self.assertEqual(notified_ids, [self.rice.id])
+        self.rice.refresh_from_db()
+        self.assertTrue(self.rice.has_notified_store_of_low_stock)
+        self.assertEqual(NotificationOutbox.objects.count(), 1)
+
+        stock = Item.update_stock([(self.store.id, "rice", 1)], "remove")
+        self.assertEqual(stock["almost_out_of_stock"], [])
+
+    def test_order_stock_lines(self):
+        order = Order(
+            stores_infos=[
+                {
+                    "storeId": self.store.id,
+                    "items": [
+                        {"product_slug": "rice", "product_cart_qty": 2},
+                        {"product_slug": "beans", "product_cart_qty": 1},
+                    ],
+                },
+                {
+                    "storeId": self.store.id + 1,
+                    "items": [{"product_slug": "other", "product_cart_qty": 1}],
+                },
+            ]
+        )
+        self.assertEqual(
+            order.get_stock_lines(store_ids=[self.store.id]),
+            [(self.store.id, "rice", 2), (self.store.id, "beans", 1)],
+        )
+        Item.update_stock(order.get_stock_lines(store_ids=[self.store.id]), "add")
+        self.rice.refresh_from_db()
+        self.assertEqual(self.rice.product_qty, 12)
@@ -3,8 +3,9 @@ from graphene_django.types import DjangoObjectType
 
 from trayapp.permissions import permission_checker, IsAuthenticated
 from .models import Item, ItemAttribute, ItemImage, Order, Rating
-from users.models import Store, DeliveryPerson, Menu
-from users.types import StoreType, School
+from users.models import Store, Menu
+from users.types import StoreType, ImageRenditionsType
+from trayapp.images import get_rendition_urls
 from .filters import (
     ItemFilter,
     ReviewFilter,
@@ -12,6 +13,13 @@ from .filters import (
     StoreOrderFilter,
     DeliveryPersonFilter,
 )
+from trayapp.loaders import (
+    DeliveryPersonProfileLoader,
+    SchoolLoader,
+    StoreLoader,
+    ItemLoader,
+)
+from trayapp.counters import ITEM_CLICKS_COUNTER, ITEM_VIEWS_COUNTER
 from decimal import Decimal
 
 
@@ -23,15 +31,22 @@ class CategoryType(graphene.ObjectType):
 
 class ItemImageType(DjangoObjectType):
     product_image = graphene.String()
+    # the thumbnails to show in lists instead of the original upload
+    product_image_renditions = graphene.Field(ImageRenditionsType)
 
     class Meta:
         model = ItemImage
-        fields = ["id", "product_image", "is_primary"]
+        fields = ["id", "product_image", "product_image_renditions", "is_primary"]
 
     def resolve_product_image(self, info, *args, **kwargs):
         product_image = info.context.build_absolute_uri(self.item_image.url)
         return product_image
 
+    def resolve_product_image_renditions(self: ItemImage, info):
+        return get_rendition_urls(
+            self.item_image_renditions, self.item_image.storage, info.context
+        )
+
 
 class ItemAttributeType(DjangoObjectType):
     class Meta:
@@ -91,13 +106,13 @@ class OptionType(Option, graphene.ObjectType):
     def resolve_item(self, info):
         item = None
         if self.slug:
-            item = Item.objects.filter(product_slug=self.slug).first()
+            item = ItemLoader.get_loader().load(self.slug)
 
         return item
 
     def resolve_is_active(self, info):
         if self.slug:
-            item = Item.objects.filter(product_slug=self.slug).first()
+            item = ItemLoader.get_loader().load(self.slug)
             if item:
                 return item.is_avaliable
         return self.is_active
@@ -232,8 +247,14 @@ class ItemType(DjangoObjectType):
         item_ratings = Rating.objects.filter(item=self)[:20]
         return item_ratings
 
-    def resolve_reviews_count(self, info):
-        return Rating.objects.filter(item=self).count()
+    def resolve_reviews_count(self: Item, info):
+        return self.ratings_count
+
+    def resolve_product_views(self: Item, info):
+        return ITEM_VIEWS_COUNTER.get_value(self)
+
+    def resolve_product_clicks(self: Item, info):
+        return ITEM_CLICKS_COUNTER.get_value(self)
 
     def resolve_average_rating(self: Item, info):
         return self.get_average_rating()
@@ -331,6 +352,7 @@ class MenuInputType(graphene.InputObjectType):
 class ItemNode(ItemType, DjangoObjectType):
     class Meta:
         model = Item
+        exclude = ["search_document", "search_vector"]
         interfaces = (graphene.relay.Node,)
         filterset_class = ItemFilter
 
@@ -344,7 +366,7 @@ class ShippingType(graphene.ObjectType):
         if sch == None or sch == "":
             return None
         sch = sch.lower().strip()
-        sch_name = School.objects.filter(slug=sch).first().name
+        sch_name = SchoolLoader.get_loader().load(sch).name
         return sch_name
 
 
@@ -428,7 +450,7 @@ class StoreInfoType(StoreInfo, graphene.ObjectType):
     status = graphene.String(default_value=None)
 
     def resolve_store(self, info):
-        return Store.objects.filter(id=int(self.get("storeId"))).first()
+        return StoreLoader.get_loader().load(int(self.get("storeId")))
 
     def resolve_status(self, info):
         store_status = self.get("status", None)
@@ -599,13 +621,12 @@ class OrderType(DjangoObjectType):
             delivery_people = [store_delivery_person] if store_delivery_person else []
 
         delivery_people_infos = []
-        for delivery_person in delivery_people:
-            delivery_person_profile = (
-                DeliveryPerson.objects.select_related("profile")
-                .filter(id=int(delivery_person["id"]))
-                .first()
-                .profile
-            )
+        delivery_person_profiles = DeliveryPersonProfileLoader.get_loader().load_many(
+            [int(delivery_person["id"]) for delivery_person in delivery_people]
+        )
+        for delivery_person, delivery_person_profile in zip(
+            delivery_people, delivery_person_profiles
+        ):
             delivery_people_infos.append(
                 OrderDeliveryPersonType(
                     status=delivery_person["status"],
@@ -625,7 +646,8 @@ class OrderType(DjangoObjectType):
         return convert_time_to_ago(self.updated_at)
 
     def resolve_items_count(self, info):
-        return self.linked_items.count()
+        # len() reuses the prefetched linked items when there are any
+        return len(self.linked_items.all())
 
     def resolve_items_images_urls(self, info):
         current_user = info.context.user
@@ -790,3 +812,8 @@ class DeliveryPersonOrderNode(OrderType, DjangoObjectType):
                     item["productPrice"] = 0
 
         return stores_infos
+
+
+class SearchResultsType(graphene.ObjectType):
+    items = graphene.List(ItemType)
+    stores = graphene.List(StoreType)
@@ -1,99 +1,327 @@
-import pandas as pd
+import io
+from datetime import datetime, timedelta
+from itertools import chain
+
+import numpy as np
+from scipy import sparse
 from django.core.cache import cache
-from django.db.models import Avg
-from sklearn.model_selection import train_test_split
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, When
+from django.utils import timezone
 from sklearn.decomposition import TruncatedSVD
-from product.models import Item, Rating
-from users.models import UserActivity
+from product.models import Item, Rating, Recommendation, RecommenderModel
+from users.models import ItemActivityRollup, UserActivity, UserActivityRollup
+
+# implicit feedback weight of each activity, removals do not count
+ACTIVITY_WEIGHTS = {
+    "view": 1,
+    "add_to_items": 2,
+    "added_to_cart": 3,
+    "add_to_order": 3,
+    "purchased": 5,
+}
+
+RECOMMENDATIONS_CACHE_KEY = "precomputed_recs_{}"
+# the recommendations are stored in the database, the cache of each process
+# only keeps them until the next training or fold in is likely to have changed them
+RECOMMENDATIONS_CACHE_TIMEOUT = 10 * 60
+TOP_N = 20
+
+
+# Function to store the recommendations of some users, as {user_id: item_ids}
+def save_recommendations(recommendations, replace_all=False):
+    """
+    `None` is the user id of the most popular items,
+    `replace_all` drops the recommendations of the users that are not in `recommendations`
+    """
+    with transaction.atomic():
+        rows = Recommendation.objects.all()
+        if not replace_all:
+            condition = Q(user_id__in=[u for u in recommendations if u is not None])
+            if None in recommendations:
+                condition |= Q(user__isnull=True)
+            rows = rows.filter(condition)
+        rows.delete()
+        Recommendation.objects.bulk_create(
+            [
+                Recommendation(user_id=user_id, item_ids=item_ids)
+                for user_id, item_ids in recommendations.items()
+            ],
+            batch_size=1000,
+        )
+    # the other processes see them once their cached ones expire
+    cache.delete_many(
+        [
+            RECOMMENDATIONS_CACHE_KEY.format(user_id)
+            for user_id in recommendations
+            if user_id is not None
+        ]
+    )
+
 
-# Function to load data
-load_data = lambda model, filters, values: pd.DataFrame.from_records(
-    model.objects.filter(**filters).values(*values)
-)
+# Function to store the item factors of a training
+def save_item_factors(item_ids, item_factors, trained_at):
+    buffer = io.BytesIO()
+    np.save(buffer, item_factors, allow_pickle=False)
+    with transaction.atomic():
+        RecommenderModel.objects.all().delete()
+        RecommenderModel.objects.create(
+            item_ids=[int(item_id) for item_id in item_ids],
+            factors=buffer.getvalue(),
+            folded_in_at=trained_at,
+        )
 
 
-# Function to update cache
-def update_cache(user, data):
-    cache.set(f"precomputed_recs_{user}", data, timeout=None)
+# Function to load the item factors of the last training, None when there was none
+def load_item_factors():
+    model = RecommenderModel.objects.order_by("-trained_at").first()
+    if model is None:
+        return None
+    factors = np.load(io.BytesIO(bytes(model.factors)), allow_pickle=False)
+    return model, np.array(model.item_ids), factors
 
 
-# Function to perform collaborative filtering on data
-def perform_collaborative_filtering(ratings_df, n, n_components=10, test_size=0.2):
-    # Creating a user-item matrix with ratings
-    ui_matrix = ratings_df.pivot_table(
-        index="user_id", columns="item__id", values="stars", fill_value=0
+# Function to get the weight of the activity type of each row in a query
+def get_activity_weight():
+    return Case(
+        *[
+            When(activity_type=activity_type, then=weight)
+            for activity_type, weight in ACTIVITY_WEIGHTS.items()
+        ],
+        default=0,
+        output_field=IntegerField(),
     )
-    X_train, X_test = train_test_split(ui_matrix, test_size=test_size, random_state=42)
 
-    # Applying SVD and making predictions
-    svd = TruncatedSVD(n_components=n_components, random_state=42).fit(X_train)
-    pred_ratings = pd.DataFrame(
-        svd.transform(X_train).dot(
-            svd.components_[:, X_train.columns.get_indexer(X_test.columns)]
-        ),
-        index=X_test.index,
-        columns=X_test.columns,
+
+# Function to load the interactions, as {(user_id, item_id): weight}
+def load_interactions(user_ids=None):
+    """
+    The days before today are read from the daily rollups and today from
+    the raw activities, so the raw events are never scanned in full
+    """
+    activity_weight = get_activity_weight()
+    today = timezone.make_aware(
+        datetime.combine(timezone.localdate(), datetime.min.time())
     )
-    # Returning top n elements
-    return pred_ratings.apply(lambda row: row.nlargest(n).index.tolist(), axis=1)
+    rollups = UserActivityRollup.objects.filter(day__lt=today.date())
+    activities = UserActivity.objects.filter(timestamp__gte=today)
+    ratings = Rating.objects.all()
+    if user_ids is not None:
+        rollups = rollups.filter(user_id__in=user_ids)
+        activities = activities.filter(user_id__in=user_ids)
+        ratings = ratings.filter(user_id__in=user_ids)
 
+    interactions = {}
+    # one grouped query per source, the rows are never loaded one by one
+    for user_id, item_id, weight in chain(
+        rollups.order_by()
+        .values("user_id", "item_id")
+        .annotate(weight=Sum(F("count") * activity_weight))
+        .values_list("user_id", "item_id", "weight"),
+        activities.order_by()
+        .values("user_id", "item_id")
+        .annotate(weight=Sum(activity_weight))
+        .values_list("user_id", "item_id", "weight"),
+    ):
+        if weight > 0:
+            key = (user_id, item_id)
+            interactions[key] = interactions.get(key, 0) + weight
+    # explicit ratings count as their number of stars
+    for user_id, item_id, stars in ratings.order_by().values_list(
+        "user_id", "item_id", "stars"
+    ):
+        if stars > 0:
+            key = (user_id, item_id)
+            interactions[key] = interactions.get(key, 0) + stars
+    return interactions
 
-# Function to recommend items for a given user
-def recommend_items(user_id, n=10, min_interactions=5):
-    # Define weights for the activities - adjust this as needed.
-    activity_weight = {
-        "view": min_interactions - 2,
-        "click": min_interactions - 1,
-        "purchase": min_interactions + 1,
-    }
 
-    # Get user activity implicit rating
-    user_activity_df = load_data(
-        UserActivity, {"user_id": user_id}, ["user_id", "item__id", "activity_type"]
+# Function to get the most popular items of the last days, from the daily rollups
+def get_popular_items(n=TOP_N, days=30):
+    return list(
+        ItemActivityRollup.objects.filter(
+            day__gte=timezone.localdate() - timedelta(days=days)
+        )
+        .order_by()
+        .values("item_id")
+        .annotate(score=Sum(F("count") * get_activity_weight()))
+        .filter(score__gt=0)
+        .order_by("-score", "item_id")
+        .values_list("item_id", flat=True)[:n]
+    )
+
+
+# Function to build the sparse user-item matrix of all the users
+def build_interaction_matrix(interactions):
+    user_ids = sorted({user_id for user_id, _ in interactions})
+    item_ids = sorted({item_id for _, item_id in interactions})
+    user_index = {user_id: index for index, user_id in enumerate(user_ids)}
+    item_index = {item_id: index for index, item_id in enumerate(item_ids)}
+
+    rows = [user_index[user_id] for user_id, _ in interactions]
+    columns = [item_index[item_id] for _, item_id in interactions]
+    # dampen the heavy users and items
+    values = np.log1p(np.fromiter(interactions.values(), dtype=np.float32))
+
+    matrix = sparse.csr_matrix(
+        (values, (rows, columns)),
+        shape=(len(user_ids), len(item_ids)),
+        dtype=np.float32,
     )
-    user_activity_df["stars"] = user_activity_df["activity_type"].map(activity_weight)
+    return matrix, np.array(user_ids), np.array(item_ids)
+
+
+# Function to get the top n items of each row of scores
+def get_top_n(scores, item_ids, n):
+    n = min(n, scores.shape[1])
+    top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return item_ids[np.take_along_axis(top, order, axis=1)]
+
+
+# Function to train the recommender, run it from the train_recommender command
+def train_recommender(n_components=32, n=TOP_N, chunk_size=1000):
+    """
+    Factorize the implicit feedback of all the users with TruncatedSVD,
+    then store the item factors (for `fold_in_users`) and the top n items of each user.
+    Returns the number of users that got recommendations
+    """
+    trained_at = timezone.now()
+    interactions = load_interactions()
+    if not interactions:
+        return 0
 
-    # Get explicit ratings from ratings table
-    ratings_df = load_data(
-        Rating, {"user_id": user_id}, ["user_id", "item__id", "stars"]
+    matrix, user_ids, item_ids = build_interaction_matrix(interactions)
+    # TruncatedSVD needs less components than items
+    n_components = max(1, min(n_components, matrix.shape[1] - 1))
+    if matrix.shape[1] > 1:
+        svd = TruncatedSVD(n_components=n_components, random_state=42)
+        user_factors = svd.fit_transform(matrix).astype(np.float32)
+        item_factors = svd.components_.T.astype(np.float32)
+    else:
+        user_factors = matrix.toarray()
+        item_factors = np.ones((1, 1), dtype=np.float32)
+
+    # the most popular items for the users without recommendations
+    popular_items = get_popular_items(n)
+    if not popular_items:
+        popularity = np.asarray(matrix.sum(axis=0)).ravel()
+        popular_items = item_ids[np.argsort(-popularity)[:n]].tolist()
+    recommendations = {None: [int(item_id) for item_id in popular_items]}
+
+    for start in range(0, len(user_ids), chunk_size):
+        scores = user_factors[start : start + chunk_size] @ item_factors.T
+        top_items = get_top_n(scores, item_ids, n)
+        for user_id, items in zip(user_ids[start : start + chunk_size], top_items):
+            recommendations[int(user_id)] = items.tolist()
+
+    save_recommendations(recommendations, replace_all=True)
+    # the activity since the training started is folded in by the next fold in
+    save_item_factors(item_ids, item_factors, trained_at)
+    return len(user_ids)
+
+
+# Function to update the recommendations of some users with the trained item factors
+def fold_in_users(user_ids, n=TOP_N):
+    """
+    Project the interactions of `user_ids` on the stored item factors and
+    store their new top n, without training again. Items that are newer than
+    the last training are ignored until the next one.
+    Returns the number of users that got recommendations
+    """
+    model = load_item_factors()
+    if model is None or not user_ids:
+        return 0
+
+    _, item_ids, item_factors = model
+    item_index = {item_id: index for index, item_id in enumerate(item_ids.tolist())}
+
+    interactions = {
+        (user_id, item_id): weight
+        for (user_id, item_id), weight in load_interactions(user_ids).items()
+        if item_id in item_index
+    }
+    if not interactions:
+        return 0
+
+    folded_user_ids = sorted({user_id for user_id, _ in interactions})
+    user_index = {user_id: index for index, user_id in enumerate(folded_user_ids)}
+    matrix = sparse.csr_matrix(
+        (
+            np.log1p(np.fromiter(interactions.values(), dtype=np.float32)),
+            (
+                [user_index[user_id] for user_id, _ in interactions],
+                [item_index[item_id] for _, item_id in interactions],
+            ),
+        ),
+        shape=(len(folded_user_ids), len(item_ids)),
+        dtype=np.float32,
     )
-    
-    # Check if ratings_df has more than one unique user
-    if ratings_df.empty or ratings_df["user_id"].nunique() <= 1:
-        return
-
-    # Combine both ratings and user activity dataframes
-    ratings_df = (
-        pd.concat([ratings_df, user_activity_df])
-        .groupby(["user_id", "item__id"])
-        .sum()
-        .reset_index()
+
+    # same projection as TruncatedSVD.transform
+    scores = (matrix @ item_factors) @ item_factors.T
+    top_items = get_top_n(np.asarray(scores), item_ids, n)
+    save_recommendations(
+        {
+            user_id: items.tolist()
+            for user_id, items in zip(folded_user_ids, top_items)
+        }
     )
+    return len(folded_user_ids)
+
+
+# Function to fold in the users with new activity since the last training or fold in
+def fold_in_new_activity(n=TOP_N):
+    model = RecommenderModel.objects.order_by("-trained_at").first()
+    if model is None:
+        return 0
 
-    # Perform Collaborative filtering and update cache.
-    item_ids = (
-        ratings_df.index.get_level_values("item__id")
-        if len(ratings_df) <= 1
-        else perform_collaborative_filtering(ratings_df, n)
+    since, now = model.folded_in_at, timezone.now()
+    user_ids = set(
+        UserActivity.objects.filter(timestamp__gt=since).values_list(
+            "user_id", flat=True
+        )
     )
-    update_cache("global", perform_collaborative_filtering(ratings_df, n))
+    user_ids.update(
+        Rating.objects.filter(updated_at__gt=since).values_list("user_id", flat=True)
+    )
+    folded = fold_in_users(list(user_ids), n=n)
+    RecommenderModel.objects.filter(id=model.id).update(folded_in_at=now)
+    return folded
 
-    # Fetch the recommended items
-    recommended_items = Item.get_items().filter(id__in=item_ids)
 
-    # Get popularity of items
-    item_popularity = {
-        item["item__id"]: item["avg_rating"]
-        for item in Rating.objects.values("item__id").annotate(avg_rating=Avg("stars"))
-    }
-    # Sort the recommended items by popularity
-    recommended_items = sorted(
-        recommended_items,
-        key=lambda item: item_popularity.get(item.id, 0),
-        reverse=True,
-    )[:n]
-    # check if recommended items are greater than 0
-    if len(recommended_items) == 0:
+# Function to read the stored recommendations of a user, through the cache
+def get_recommended_item_ids(user_id):
+    cache_key = RECOMMENDATIONS_CACHE_KEY.format(user_id)
+    item_ids = cache.get(cache_key)
+    if item_ids is None:
+        rows = dict(
+            Recommendation.objects.filter(
+                Q(user_id=user_id) | Q(user__isnull=True)
+            ).values_list("user_id", "item_ids")
+        )
+        # the most popular items when the user has no recommendations
+        item_ids = rows.get(user_id) or rows.get(None) or []
+        cache.set(cache_key, item_ids, RECOMMENDATIONS_CACHE_TIMEOUT)
+    return item_ids
+
+
+# Function to recommend items for a given user
+def recommend_items(user_id, n=10):
+    """
+    Read the precomputed recommendations of a user (or the most popular items)
+    and keep the ones that are still available
+    """
+    item_ids = get_recommended_item_ids(user_id)
+    if not item_ids:
         return []
+
+    # Fetch the available recommended items in the order they were ranked
+    items = {
+        item.id: item
+        for item in Item.get_items().filter(id__in=item_ids, product_status="active")
+    }
+    recommended_items = [items[item_id] for item_id in item_ids if item_id in items]
     # Return the top n recommended items
-    return recommended_items
+    return recommended_items[:n]
@@ -0,0 +1,257 @@
+import threading
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, F, FloatField, IntegerField, Model, Value, When
+
+
+class LocalCounterStore:
+    """
+    In-process stand-in for the cache, the counts of each process are flushed
+    by that process. Used when COUNTER_BUFFER_BACKEND is "local".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(int)
+
+    def incr(self, key, count):
+        with self._lock:
+            self._counts[key] += count
+
+    def get_many(self, keys):
+        with self._lock:
+            return {key: self._counts[key] for key in keys if key in self._counts}
+
+    def take(self, key):
+        with self._lock:
+            return self._counts.pop(key, 0)
+
+
+class CacheCounterStore:
+    """
+    Counts kept in the django cache, `cache.incr` is atomic on redis and memcached
+    so every process adds to the same counts. Taking a count is atomic on redis
+    (GETSET) and on the per-process locmem cache, use redis to share the counts.
+    """
+
+    def __init__(self):
+        # get + decr of the locmem cache, it is only shared by the threads of the process
+        self._take_lock = threading.Lock()
+
+    def incr(self, key, count):
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            # the key does not exist yet, add it unless another process just did
+            if not cache.add(key, count, timeout=None):
+                cache.incr(key, count)
+
+    def get_many(self, keys):
+        return cache.get_many(keys)
+
+    def get_redis_client(self):
+        try:
+            from django_redis.cache import RedisCache
+        except ImportError:
+            return None
+        if isinstance(cache, RedisCache):
+            return cache.client.get_client(write=True)
+        return None
+
+    def take(self, key):
+        client = self.get_redis_client()
+        if client is not None:
+            # reset to 0 in the same command, the increments made meanwhile are kept
+            count = client.getset(cache.make_key(key), 0)
+            return int(count) if count else 0
+
+        with self._take_lock:
+            count = cache.get(key) or 0
+            if count:
+                # decrement instead of deleting to keep the increments made meanwhile
+                cache.decr(key, count)
+            return count
+
+
+class Counter:
+    """
+    A model field that is incremented through the counter buffer,
+    each increment is `step` added to the field once the buffer is flushed.
+    ```python
+    ITEM_VIEWS_COUNTER.incr(item.id)
+    views = ITEM_VIEWS_COUNTER.get_value(item)  # saved views + pending views
+    ```
+    """
+
+    def __init__(self, model_label, field, step=1):
+        self.model_label = model_label
+        self.field = field
+        self.step = step
+        self.name = f"{model_label}.{field}"
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def get_key(self, pk):
+        return f"counter:{self.name}:{pk}"
+
+    def incr(self, pk, count=1):
+        from trayapp.loaders import PendingCountLoader
+
+        get_counter_buffer().incr(self, pk, count)
+        PendingCountLoader.get_loader().forget((self.name, pk))
+
+    def get_pending(self, pks):
+        """
+        Return the amount not flushed yet of each pk, as {pk: amount}
+        """
+        counts = get_counter_buffer().store.get_many([self.get_key(pk) for pk in pks])
+        return {pk: counts.get(self.get_key(pk), 0) * self.step for pk in pks}
+
+    def get_value(self, instance):
+        """
+        The saved value with the pending amount, so the numbers look live.
+        The pending amounts of a page primed by `prime_counters` are read at once
+        """
+        from trayapp.loaders import PendingCountLoader
+
+        value = getattr(instance, self.field) or 0
+        return value + PendingCountLoader.get_loader().load((self.name, instance.pk))
+
+
+ITEM_VIEWS_COUNTER = Counter("product.Item", "product_views")
+ITEM_CLICKS_COUNTER = Counter("product.Item", "product_clicks")
+STORE_RANK_COUNTER = Counter("users.Store", "store_rank", step=0.5)
+
+COUNTERS = {
+    counter.name: counter
+    for counter in (ITEM_VIEWS_COUNTER, ITEM_CLICKS_COUNTER, STORE_RANK_COUNTER)
+}
+# model label -> its counters
+MODEL_COUNTERS = defaultdict(list)
+for counter in COUNTERS.values():
+    MODEL_COUNTERS[counter.model_label].append(counter)
+
+
+def prime_counters(instances):
+    """
+    Register the pending amounts of the counters of a page of items or stores,
+    the first `Counter.get_value` of the request reads all of them with one cache call
+    eg: prime_counters(items)
+    """
+    from trayapp.loaders import PendingCountLoader
+
+    keys = [
+        (counter.name, instance.pk)
+        for instance in instances
+        if isinstance(instance, Model)
+        for counter in MODEL_COUNTERS.get(instance._meta.label, ())
+    ]
+    if keys:
+        PendingCountLoader.get_loader().prime(keys)
+
+
+class CounterBuffer:
+    """
+    Write-behind buffer of the counters, increments only touch the store
+    and `flush()` adds them to the database with one UPDATE per counter
+    (see users.threads.BufferFlusherThread)
+    """
+
+    FLUSH_INTERVAL = 10  # seconds between two flushes of the flusher thread
+    FLUSH_BATCH_SIZE = 500
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        # (counter name, pk) incremented since the last flush
+        self._dirty = set()
+
+    def incr(self, counter: Counter, pk, count=1):
+        self.store.incr(counter.get_key(pk), count)
+        with self._lock:
+            self._dirty.add((counter.name, pk))
+
+        if getattr(settings, "WRITE_BUFFER_AUTO_FLUSH", False):
+            from users.threads import BufferFlusherThread
+
+            BufferFlusherThread.start_once()
+
+    def flush(self):
+        """
+        Add the pending counts to the database, returns the number of updated rows.
+        The counts are taken and written one batch at a time, when a batch fails
+        its counts are given back and the batches not written yet stay pending
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+
+        pks_by_counter = defaultdict(list)
+        for name, pk in dirty:
+            pks_by_counter[name].append(pk)
+        batches = [
+            (COUNTERS[name], pks[start : start + self.FLUSH_BATCH_SIZE])
+            for name, pks in pks_by_counter.items()
+            for start in range(0, len(pks), self.FLUSH_BATCH_SIZE)
+        ]
+
+        updated = 0
+        for index, (counter, batch) in enumerate(batches):
+            pk_counts = {}
+            for pk in batch:
+                count = self.store.take(counter.get_key(pk))
+                if count:
+                    pk_counts[pk] = count
+            if not pk_counts:
+                continue
+            try:
+                updated += self.update_counter(counter, list(pk_counts), pk_counts)
+            except Exception:
+                # give the counts back, the next flush will try again
+                for pk, count in pk_counts.items():
+                    self.store.incr(counter.get_key(pk), count)
+                with self._lock:
+                    self._dirty.update((counter.name, pk) for pk in batch)
+                    for pending_counter, pending_batch in batches[index + 1 :]:
+                        self._dirty.update(
+                            (pending_counter.name, pk) for pk in pending_batch
+                        )
+                raise
+        return updated
+
+    def update_counter(self, counter: Counter, pks, pk_counts):
+        output_field = FloatField() if isinstance(counter.step, float) else IntegerField()
+        delta = Case(
+            *[
+                When(pk=pk, then=Value(pk_counts[pk] * counter.step))
+                for pk in pks
+            ],
+            default=Value(0),
+            output_field=output_field,
+        )
+        return counter.model.objects.filter(pk__in=pks).update(
+            **{counter.field: F(counter.field) + delta}
+        )
+
+
+_counter_buffer = None
+_counter_buffer_lock = threading.Lock()
+
+
+def get_counter_buffer() -> CounterBuffer:
+    global _counter_buffer
+    if _counter_buffer is None:
+        with _counter_buffer_lock:
+            if _counter_buffer is None:
+                backend = getattr(settings, "COUNTER_BUFFER_BACKEND", "cache")
+                store = LocalCounterStore() if backend == "local" else CacheCounterStore()
+                _counter_buffer = CounterBuffer(store)
+    return _counter_buffer
+
+
+def flush_counters():
+    return get_counter_buffer().flush()
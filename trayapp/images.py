@@ -0,0 +1,197 @@
+import io
+import hashlib
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+# longest side in pixels of each rendition, an image is never upscaled
+RENDITION_SIZES = {"thumb": 160, "card": 480, "full": 1024}
+
+# extension -> (PIL format, save options)
+RENDITION_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+class RenditionSpec:
+    """
+    An image field whose uploads get renditions, they are kept as
+    {"hash": ..., "thumb": {"webp": name, "jpeg": name}, ...} in `renditions_field`,
+    an empty dict means the renditions are not made yet
+    """
+
+    def __init__(
+        self, model_label, image_field, renditions_field, sizes=None, query_cache_tags=()
+    ):
+        self.model_label = model_label
+        self.image_field = image_field
+        self.renditions_field = renditions_field
+        self.sizes = sizes or list(RENDITION_SIZES)
+        # the cached query answers showing the renditions (see trayapp.query_cache)
+        self.query_cache_tags = query_cache_tags
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+
+RENDITION_SPECS = [
+    RenditionSpec(
+        "product.ItemImage",
+        "item_image",
+        "item_image_renditions",
+        query_cache_tags=("items",),
+    ),
+    RenditionSpec(
+        "users.Store",
+        "store_cover_image",
+        "store_cover_image_renditions",
+        query_cache_tags=("stores",),
+    ),
+    RenditionSpec("users.Profile", "image", "image_renditions", ["thumb", "card"]),
+]
+
+
+def get_stored_image_name(instance, image_field):
+    # the name loaded from the database, None for a new or deferred instance
+    if not instance.pk:
+        return None
+    image = instance.__dict__.get(image_field)
+    return getattr(image, "name", image)
+
+
+def image_has_changed(field_file, original_name):
+    # a new upload is not committed to the storage yet
+    return field_file.name != original_name or not getattr(
+        field_file, "_committed", True
+    )
+
+
+def schedule_image_processing():
+    """
+    Make the pending renditions once the current transaction commits
+    """
+    if getattr(settings, "IMAGE_RENDITIONS_AUTO_PROCESS", False):
+        from users.threads import ImageRenditionThread
+
+        transaction.on_commit(ImageRenditionThread.wake_up)
+
+
+def get_rendition_name(content_hash, size_name, extension):
+    return f"renditions/{content_hash[:2]}/{content_hash}/{size_name}.{extension}"
+
+
+def render_renditions(field_file, sizes=None):
+    """
+    Make the WebP and JPEG renditions of an image,
+    the files are named after the content hash so the same upload is only rendered once
+    ```python
+    renditions = render_renditions(item_image.item_image)
+    renditions["thumb"]["webp"]  # renditions/ab/ab12.../thumb.webp
+    ```
+    """
+    from PIL import Image, ImageOps
+
+    storage = field_file.storage
+    field_file.open("rb")
+    try:
+        data = field_file.read()
+    finally:
+        field_file.close()
+
+    content_hash = hashlib.sha256(data).hexdigest()
+    renditions = {"hash": content_hash}
+    image = None
+    for size_name in sizes or RENDITION_SIZES:
+        size = RENDITION_SIZES[size_name]
+        renditions[size_name] = {}
+        for extension, (format, options) in RENDITION_FORMATS.items():
+            name = get_rendition_name(content_hash, size_name, extension)
+            # the same content was already rendered
+            if storage.exists(name):
+                renditions[size_name][extension] = name
+                continue
+
+            if image is None:
+                # apply the camera rotation before the exif data is dropped
+                image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            if format == "JPEG" and resized.mode != "RGB":
+                background = Image.new("RGB", resized.size, (255, 255, 255))
+                resized = resized.convert("RGBA")
+                background.paste(resized, mask=resized.getchannel("A"))
+                resized = background
+
+            file = io.BytesIO()
+            resized.save(file, format, **options)
+            renditions[size_name][extension] = storage.save(
+                name, ContentFile(file.getvalue())
+            )
+    return renditions
+
+
+def get_rendition_urls(renditions, storage, request=None):
+    """
+    Return the urls of the renditions, None until they are made
+    """
+    if not renditions or "hash" not in renditions:
+        return None
+
+    def build_url(name):
+        url = storage.url(name)
+        return request.build_absolute_uri(url) if request is not None else url
+
+    return {
+        size_name: {
+            extension: build_url(name) for extension, name in renditions[size_name].items()
+        }
+        for size_name in RENDITION_SIZES
+        if size_name in renditions
+    }
+
+
+def process_pending_images(batch_size=50):
+    """
+    Make the renditions of the images that do not have them yet,
+    returns the number of images processed
+    """
+    from trayapp.query_cache import schedule_query_cache_invalidation
+
+    processed = 0
+    for spec in RENDITION_SPECS:
+        while True:
+            rows = list(
+                spec.model.objects.filter(**{spec.renditions_field: {}})
+                .exclude(**{f"{spec.image_field}__isnull": True})
+                .exclude(**{spec.image_field: ""})
+                .order_by("pk")[:batch_size]
+            )
+            if not rows:
+                break
+
+            for row in rows:
+                field_file = getattr(row, spec.image_field)
+                try:
+                    renditions = render_renditions(field_file, spec.sizes)
+                except Exception as e:
+                    # eg: not an image, it is not tried again until a new upload
+                    logging.exception(
+                        f"Error making the renditions of {spec.model_label} {row.pk}: {e}"
+                    )
+                    renditions = {"error": str(e)}
+
+                # skip the row if another image was uploaded meanwhile
+                spec.model.objects.filter(
+                    pk=row.pk, **{spec.image_field: field_file.name}
+                ).update(**{spec.renditions_field: renditions})
+                processed += 1
+
+            if spec.query_cache_tags:
+                # once per batch, the queryset updates do not send post_save
+                schedule_query_cache_invalidation(*spec.query_cache_tags)
+    return processed
@@ -0,0 +1,115 @@
+from trayapp.request_memo import request_memo
+
+
+class RequestLoader:
+    """
+    DataLoader-style batching for graphene resolvers.
+    One loader of each kind is shared by the whole request (see trayapp.request_memo),
+    `prime()` registers keys that will be needed soon and the next `load()`
+    fetches all of them with a single query.
+
+    ```python
+    loader = SchoolLoader.get_loader()
+    loader.prime(["unilag", "oau"])
+    school = loader.load("unilag")  # one query for both schools
+    ```
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self._pending = set()
+
+    @classmethod
+    def get_loader(cls):
+        return request_memo(("loader", cls.__name__), cls)
+
+    def batch_load(self, keys) -> dict:
+        """
+        Load all `keys` at once and return them as {key: value}
+        """
+        raise NotImplementedError
+
+    def prime(self, keys):
+        self._pending.update(
+            key for key in keys if key is not None and key not in self._cache
+        )
+
+    def load(self, key):
+        if key is None:
+            return None
+        if key not in self._cache:
+            self._pending.add(key)
+            keys = list(self._pending)
+            self._pending.clear()
+            values = self.batch_load(keys)
+            for loaded_key in keys:
+                self._cache[loaded_key] = values.get(loaded_key)
+        return self._cache[key]
+
+    def load_many(self, keys):
+        self.prime(keys)
+        return [self.load(key) for key in keys]
+
+    def forget(self, key):
+        # the value changed, the next `load()` fetches it again
+        self._cache.pop(key, None)
+
+
+class DeliveryPersonProfileLoader(RequestLoader):
+    # delivery person id -> Profile
+    def batch_load(self, keys):
+        from users.models import DeliveryPerson
+
+        delivery_people = DeliveryPerson.objects.select_related("profile__user").filter(
+            id__in=[int(key) for key in keys]
+        )
+        profiles = {
+            delivery_person.id: delivery_person.profile
+            for delivery_person in delivery_people
+        }
+        return {key: profiles.get(int(key)) for key in keys}
+
+
+class SchoolLoader(RequestLoader):
+    # school slug -> School
+    def batch_load(self, keys):
+        from users.models import School
+
+        return {school.slug: school for school in School.objects.filter(slug__in=keys)}
+
+
+class StoreLoader(RequestLoader):
+    # store id -> Store
+    def batch_load(self, keys):
+        from users.models import Store
+
+        stores = {
+            store.id: store
+            for store in Store.objects.filter(id__in=[int(key) for key in keys])
+        }
+        return {key: stores.get(int(key)) for key in keys}
+
+
+class PendingCountLoader(RequestLoader):
+    # (counter name, pk) -> the amount not flushed yet, see trayapp.counters
+    def batch_load(self, keys):
+        from trayapp.counters import COUNTERS, get_counter_buffer
+
+        cache_keys = {key: COUNTERS[key[0]].get_key(key[1]) for key in keys}
+        counts = get_counter_buffer().store.get_many(list(cache_keys.values()))
+        return {
+            key: counts.get(cache_keys[key], 0) * COUNTERS[key[0]].step for key in keys
+        }
+
+
+class ItemLoader(RequestLoader):
+    # item slug -> Item
+    def batch_load(self, keys):
+        from product.models import Item
+
+        return {
+            item.product_slug: item
+            for item in Item.objects.select_related(
+                "product_creator", "product_menu"
+            ).filter(product_slug__in=keys)
+        }
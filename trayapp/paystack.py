@@ -0,0 +1,373 @@
+import time
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+# (connect, read) timeouts in seconds per endpoint, the path without its ids
+ENDPOINT_TIMEOUTS = {
+    "default": (3.05, 10),
+    "balance": (3.05, 5),
+    "bank": (3.05, 10),
+    "bank/resolve": (3.05, 10),
+    "transaction/initialize": (3.05, 15),
+    "transferrecipient": (3.05, 15),
+    "transfer": (3.05, 30),
+    "refund": (3.05, 30),
+}
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+
+# the statuses worth retrying, anything else is the answer
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# the POSTs paystack applies once whatever the number of attempts, eg: a transfer
+# with the reference of an earlier one is not made again. The other POSTs are only
+# retried when the request could not be sent
+IDEMPOTENT_POST_ENDPOINTS = ("transfer",)
+
+
+def is_connect_error(error):
+    """
+    The connection could not be made, the request was not sent
+    """
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(
+        reason, NewConnectionError
+    )
+
+
+class PaystackError(Exception):
+    """
+    Paystack could not be reached or kept failing, the request may not have been applied
+    """
+
+
+class CircuitOpenError(PaystackError):
+    """
+    Paystack failed too often recently, the request was not sent
+    """
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing service for `reset_timeout` seconds after
+    `failure_threshold` consecutive failures, then let one request through to check it
+    ```python
+    breaker = CircuitBreaker()
+    breaker.before_request()  # raises CircuitOpenError while open
+    breaker.record_success()
+    ```
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._get_state()
+
+    def _get_state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_request(self):
+        with self._lock:
+            state = self._get_state()
+            if state == "open" or (state == "half-open" and self._probing):
+                raise CircuitOpenError("Paystack is unavailable, try again later")
+            if state == "half-open":
+                # only one request checks if the service is back
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class LatencyHistogram:
+    """
+    Cumulative latency histogram per endpoint, kept in memory by the process
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def observe(self, endpoint, seconds, failed=False):
+        with self._lock:
+            row = self._endpoints.setdefault(
+                endpoint,
+                {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0, "errors": 0},
+            )
+            for index, upper_bound in enumerate(self.buckets):
+                if seconds <= upper_bound:
+                    row["buckets"][index] += 1
+            row["count"] += 1
+            row["sum"] += seconds
+            if failed:
+                row["errors"] += 1
+
+    def snapshot(self):
+        """
+        eg: {"transfer": {"buckets": {0.05: 0, 0.1: 2, ...}, "count": 2, "sum": 0.15, "errors": 0}}
+        """
+        with self._lock:
+            return {
+                endpoint: {
+                    **row,
+                    "buckets": dict(zip(self.buckets, row["buckets"])),
+                }
+                for endpoint, row in self._endpoints.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+class PaystackClient:
+    """
+    Paystack API client sharing one keep-alive connection pool.
+    GET requests and the POSTs of IDEMPOTENT_POST_ENDPOINTS with an idempotency key
+    are retried on connection errors, timeouts and 5xx / 429 answers,
+    the other POSTs only when the connection could not be made
+    ```python
+    client = get_paystack_client()
+    response = client.post("transfer", json={...}, idempotency_key=reference)
+    response.json()
+    ```
+    """
+
+    def __init__(
+        self,
+        base_url=None,
+        secret_key=None,
+        max_retries=2,
+        backoff=0.25,
+        pool_size=20,
+        circuit_breaker=None,
+        timeouts=None,
+    ):
+        self.base_url = (base_url or settings.PAYSTACK_BASE_URL).rstrip("/")
+        self.secret_key = secret_key or settings.PAYSTACK_SECRET_KEY
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.timeouts = {**ENDPOINT_TIMEOUTS, **(timeouts or {})}
+        self.latency = LatencyHistogram()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {self.secret_key}"})
+
+    def get_timeout(self, endpoint):
+        return self.timeouts.get(endpoint, self.timeouts["default"])
+
+    def request(self, method, endpoint, idempotency_key=None, **kwargs):
+        """
+        Send a request to `endpoint` (eg: "bank/resolve"), returns the requests.Response
+        of the last attempt, raises PaystackError when there was no answer
+        """
+        url = f"{self.base_url}/{endpoint}"
+        headers = kwargs.pop("headers", {})
+        if idempotency_key:
+            headers["Idempotency-Key"] = str(idempotency_key)
+        # a POST that timed out or failed may have been applied, eg: a refund
+        can_retry = method.upper() == "GET" or (
+            bool(idempotency_key) and endpoint in IDEMPOTENT_POST_ENDPOINTS
+        )
+        attempts = 1 + self.max_retries
+
+        for attempt in range(1, attempts + 1):
+            self.circuit_breaker.before_request()
+            start_time = time.monotonic()
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    headers=headers,
+                    timeout=self.get_timeout(endpoint),
+                    **kwargs,
+                )
+            except requests.RequestException as e:
+                self.latency.observe(endpoint, time.monotonic() - start_time, failed=True)
+                self.circuit_breaker.record_failure()
+                logging.warning(
+                    f"Paystack {method} {endpoint} attempt {attempt}/{attempts} failed: {e}"
+                )
+                if attempt == attempts or not (can_retry or is_connect_error(e)):
+                    raise PaystackError(f"Paystack {endpoint} is unavailable: {e}") from e
+            else:
+                failed = response.status_code in RETRY_STATUSES
+                self.latency.observe(endpoint, time.monotonic() - start_time, failed=failed)
+                if not failed:
+                    self.circuit_breaker.record_success()
+                    return response
+                self.circuit_breaker.record_failure()
+                logging.warning(
+                    f"Paystack {method} {endpoint} attempt {attempt}/{attempts} "
+                    f"answered {response.status_code}"
+                )
+                if attempt == attempts or not can_retry:
+                    return response
+            time.sleep(self.backoff * 2 ** (attempt - 1))
+
+    def get(self, endpoint, params=None, **kwargs):
+        return self.request("GET", endpoint, params=params, **kwargs)
+
+    def post(self, endpoint, idempotency_key=None, **kwargs):
+        return self.request("POST", endpoint, idempotency_key=idempotency_key, **kwargs)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_paystack_client():
+    """
+    The client shared by the process, its connections are kept alive between requests
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PaystackClient()
+    return _client
+
+
+class CachedLookup:
+    """
+    Cache of a gateway lookup in the django cache. A value is fresh for `ttl`
+    seconds and kept `stale_ttl` seconds, the stale value is served when the
+    gateway fails or, with `refresh_in_background`, while it is fetched again.
+    ```python
+    BANK_LIST_CACHE.get("NGN", lambda: fetch_banks("NGN"))
+    BANK_LIST_CACHE.stats  # {"hit": 10, "miss": 1, "stale": 0, "error": 0}
+    ```
+    """
+
+    def __init__(self, name, ttl, stale_ttl, refresh_in_background=False):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_in_background = refresh_in_background
+        self._lock = threading.Lock()
+        self.stats = {"hit": 0, "miss": 0, "stale": 0, "error": 0}
+
+    def get_cache_key(self, key):
+        return f"paystack:{self.name}:{key}"
+
+    def count(self, outcome):
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def fetch(self, key, fetch):
+        """
+        Call the gateway and cache its answer, a None answer is a failure
+        """
+        from django.core.cache import cache
+
+        value = fetch()
+        if value is None:
+            raise PaystackError(f"Paystack {self.name} returned no value")
+        cache.set(
+            self.get_cache_key(key),
+            {"value": value, "fetched_at": time.time()},
+            self.stale_ttl,
+        )
+        return value
+
+    def refresh(self, key, fetch):
+        from django.core.cache import cache
+
+        # one refresh per key across the processes
+        if not cache.add(f"{self.get_cache_key(key)}:refreshing", 1, 60):
+            return
+
+        def run():
+            try:
+                self.fetch(key, fetch)
+            except Exception as e:
+                self.count("error")
+                logging.warning(f"Error refreshing the paystack {self.name} cache: {e}")
+            finally:
+                cache.delete(f"{self.get_cache_key(key)}:refreshing")
+
+        threading.Thread(target=run, name=f"refresh-{self.name}", daemon=True).start()
+
+    def get(self, key, fetch):
+        from django.core.cache import cache
+
+        entry = cache.get(self.get_cache_key(key))
+        if entry is not None and time.time() - entry["fetched_at"] < self.ttl:
+            self.count("hit")
+            return entry["value"]
+
+        if entry is not None and self.refresh_in_background:
+            self.count("stale")
+            self.refresh(key, fetch)
+            return entry["value"]
+
+        try:
+            value = self.fetch(key, fetch)
+        except Exception as e:
+            self.count("error")
+            if entry is None:
+                raise
+            # the gateway is down, the last known value is better than none
+            logging.warning(f"Serving the stale paystack {self.name}: {e}")
+            self.count("stale")
+            return entry["value"]
+        self.count("miss")
+        return value
+
+
+# the banks rarely change, they are refreshed in the background once a day
+BANK_LIST_CACHE = CachedLookup(
+    "banks", ttl=24 * 60 * 60, stale_ttl=7 * 24 * 60 * 60, refresh_in_background=True
+)
+# by (bank_code, account_number), while a user types a withdrawal
+ACCOUNT_RESOLUTION_CACHE = CachedLookup(
+    "account-resolution", ttl=10 * 60, stale_ttl=24 * 60 * 60
+)
+# the withdrawals check it, it only has to be roughly right
+BALANCE_CACHE = CachedLookup("balance", ttl=30, stale_ttl=10 * 60)
+
+CACHED_LOOKUPS = [BANK_LIST_CACHE, ACCOUNT_RESOLUTION_CACHE, BALANCE_CACHE]
+
+
+def get_cache_stats():
+    """
+    eg: {"banks": {"hit": 10, "miss": 1, "stale": 0, "error": 0}, ...}
+    """
+    return {lookup.name: dict(lookup.stats) for lookup in CACHED_LOOKUPS}
@@ -0,0 +1,298 @@
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.http.response import HttpResponseBadRequest
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+from graphql import OperationType, execute_sync, get_operation_ast, parse, validate
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult
+
+
+class PersistedQueryError(HttpError):
+    """
+    The persisted query can not be run, answered as an error with its code
+    eg: the client sends the query again on PERSISTED_QUERY_NOT_FOUND
+    """
+
+    def __init__(self, message, code, status=200):
+        super().__init__(HttpResponse(status=status), message)
+        self.code = code
+
+    @property
+    def formatted(self):
+        return {"message": self.message, "extensions": {"code": self.code}}
+
+
+class DocumentCache:
+    """
+    LRU of the parsed and validated documents of the process by the sha256 hash
+    of their query, the documents with errors are not kept
+    ```python
+    document, errors = DOCUMENT_CACHE.get(schema.graphql_schema, query)
+    DOCUMENT_CACHE.stats  # {"hit": 120, "miss": 4}
+    ```
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._documents = OrderedDict()
+        self.stats = {"hit": 0, "miss": 0}
+
+    def get(self, schema, query, query_hash=None):
+        """
+        Returns (document, None) or (None, errors)
+        """
+        from core.models import PersistedQuery
+
+        query_hash = query_hash or PersistedQuery.get_hash(query)
+        with self._lock:
+            document = self._documents.get(query_hash)
+            if document is not None:
+                self._documents.move_to_end(query_hash)
+                self.stats["hit"] += 1
+                return document, None
+            self.stats["miss"] += 1
+
+        try:
+            document = parse(query)
+        except GraphQLError as e:
+            return None, [e]
+        errors = validate(schema, document)
+        if errors:
+            return None, errors
+
+        with self._lock:
+            self._documents[query_hash] = document
+            while len(self._documents) > self.maxsize:
+                self._documents.popitem(last=False)
+        return document, None
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self.stats = {"hit": 0, "miss": 0}
+
+
+DOCUMENT_CACHE = DocumentCache(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+
+class AutomaticPersistedQueries:
+    """
+    The queries the clients registered with their sha256 hash, kept `timeout` seconds
+    in the django cache for every process and the `maxsize` most recently used ones
+    of the process in memory. They are not written to the database,
+    the register_persisted_queries command does that
+    ```python
+    AUTOMATIC_PERSISTED_QUERIES.add(query_hash, query)
+    AUTOMATIC_PERSISTED_QUERIES.get(query_hash)  # "query { ... }"
+    ```
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._queries = OrderedDict()
+
+    @staticmethod
+    def get_cache_key(query_hash):
+        return f"persisted-query:automatic:{query_hash}"
+
+    def _keep(self, query_hash, query):
+        with self._lock:
+            self._queries[query_hash] = query
+            self._queries.move_to_end(query_hash)
+            while len(self._queries) > self.maxsize:
+                self._queries.popitem(last=False)
+
+    def get(self, query_hash):
+        """
+        The query of the hash, None when it is not registered or expired
+        """
+        if not isinstance(query_hash, str) or len(query_hash) != 64:
+            return None
+        with self._lock:
+            query = self._queries.get(query_hash)
+            if query is not None:
+                self._queries.move_to_end(query_hash)
+                return query
+
+        # eg: registered by another process
+        query = cache.get(self.get_cache_key(query_hash))
+        if query is not None:
+            self._keep(query_hash, query)
+        return query
+
+    def add(self, query_hash, query):
+        with self._lock:
+            if query_hash in self._queries:
+                self._queries.move_to_end(query_hash)
+                return
+        cache.set(self.get_cache_key(query_hash), query, self.timeout)
+        self._keep(query_hash, query)
+
+    def clear(self):
+        # the queries of the process, the cached ones expire
+        with self._lock:
+            self._queries.clear()
+
+
+AUTOMATIC_PERSISTED_QUERIES = AutomaticPersistedQueries(
+    settings.AUTOMATIC_PERSISTED_QUERIES_SIZE,
+    settings.AUTOMATIC_PERSISTED_QUERIES_TIMEOUT,
+)
+
+
+def get_extensions(request, data):
+    extensions = request.GET.get("extensions") or data.get("extensions")
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+    return extensions if isinstance(extensions, dict) else {}
+
+
+def resolve_persisted_query(schema, persisted_query, query):
+    """
+    The query of the automatic persisted query `persisted_query`
+    (eg: {"version": 1, "sha256Hash": "..."}), `query` is registered in
+    AUTOMATIC_PERSISTED_QUERIES when it is sent with its hash.
+    Raises PersistedQueryError
+    """
+    from core.models import PersistedQuery
+
+    if not isinstance(persisted_query, dict) or persisted_query.get("version") != 1:
+        raise PersistedQueryError(
+            "Unsupported persisted query version", "PERSISTED_QUERY_NOT_SUPPORTED", 400
+        )
+    query_hash = persisted_query.get("sha256Hash")
+
+    if not query:
+        if not settings.PERSISTED_QUERIES_ALLOWLIST:
+            query = AUTOMATIC_PERSISTED_QUERIES.get(query_hash)
+            if query is not None:
+                return query
+        entry = PersistedQuery.lookup(query_hash)
+        if entry is None:
+            raise PersistedQueryError("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+        if settings.PERSISTED_QUERIES_ALLOWLIST and not entry["allowlisted"]:
+            raise PersistedQueryError(
+                "PersistedQueryNotAllowed", "PERSISTED_QUERY_NOT_ALLOWED", 400
+            )
+        return entry["query"]
+
+    if PersistedQuery.get_hash(query) != query_hash:
+        raise PersistedQueryError(
+            "provided sha does not match query", "PERSISTED_QUERY_HASH_MISMATCH", 400
+        )
+    if settings.PERSISTED_QUERIES_ALLOWLIST:
+        check_allowlisted(query, query_hash)
+    else:
+        document, errors = DOCUMENT_CACHE.get(schema, query, query_hash)
+        # the invalid queries are not registered, their errors are answered
+        if document is not None:
+            AUTOMATIC_PERSISTED_QUERIES.add(query_hash, query)
+    return query
+
+
+def check_allowlisted(query, query_hash=None):
+    from core.models import PersistedQuery
+
+    entry = PersistedQuery.lookup(query_hash or PersistedQuery.get_hash(query))
+    if entry is None or not entry["allowlisted"]:
+        raise PersistedQueryError(
+            "PersistedQueryNotAllowed", "PERSISTED_QUERY_NOT_ALLOWED", 400
+        )
+
+
+class PersistedQueryGraphQLView(FileUploadGraphQLView):
+    """
+    GraphQL view running the automatic persisted queries
+    (the `persistedQuery` extension of the request) and the parsed documents of DOCUMENT_CACHE
+    """
+
+    graphql_params = None
+
+    @staticmethod
+    def format_error(error):
+        if isinstance(error, PersistedQueryError):
+            return error.formatted
+        return FileUploadGraphQLView.format_error(error)
+
+    def get_graphql_params(self, request, data):
+        # the persisted query is looked up once per request
+        if self.graphql_params is None:
+            query, variables, operation_name, id = super().get_graphql_params(request, data)
+            persisted_query = get_extensions(request, data).get("persistedQuery")
+            if persisted_query is not None:
+                query = resolve_persisted_query(
+                    self.schema.graphql_schema, persisted_query, query
+                )
+            elif query and settings.PERSISTED_QUERIES_ALLOWLIST:
+                check_allowlisted(query)
+            self.graphql_params = (query, variables, operation_name, id)
+        return self.graphql_params
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        if not query:
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+
+        document, errors = DOCUMENT_CACHE.get(self.schema.graphql_schema, query)
+        if errors:
+            return ExecutionResult(data=None, errors=errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if (
+            request.method.lower() == "get"
+            and operation_ast
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    f"Can only perform a {operation_ast.operation.value} operation from a POST request.",
+                )
+            )
+
+        try:
+            options = {
+                "root_value": self.get_root_value(request),
+                "context_value": self.get_context(request),
+                "variable_values": variables,
+                "operation_name": operation_name,
+                "middleware": self.get_middleware(request),
+                "execution_context_class": self.execution_context_class,
+            }
+            if (
+                operation_ast
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = execute_sync(self.schema.graphql_schema, document, **options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            return execute_sync(self.schema.graphql_schema, document, **options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
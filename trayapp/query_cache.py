@@ -0,0 +1,220 @@
+import json
+import uuid
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from graphql import FieldNode, OperationType, get_operation_ast, print_ast
+
+from trayapp.persisted_queries import DOCUMENT_CACHE, PersistedQueryGraphQLView
+
+# the root fields answered the same to every user of a scope (see get_scope),
+# with the tags of the models their answer is made of
+CACHEABLE_FIELDS = {
+    "heroData": ("items", "stores", "menus", "store_hours"),
+    "items": ("items", "stores", "menus", "store_hours"),
+    "storeItemsCategories": ("items", "stores", "menus", "store_hours"),
+    "top10StoreItems": ("items", "stores", "menus", "store_hours"),
+    "stores": ("stores", "menus", "store_hours"),
+    "schools": ("schools",),
+    "hostels": ("schools", "hostels"),
+}
+# fields answered per user, the queries selecting them are only shared by the anonymous users
+USER_FIELDS = {
+    "didUserLike",
+    "currentUserReview",
+    "productShareVisibility",
+    "isAvaliableForStore",
+    "hideWalletBalance",
+}
+
+TAG_VERSION_KEY = "query-cache:tag:{}"
+
+
+def get_tag_versions(tags):
+    """
+    The current version of each tag, an entry cached under older versions is never read again
+    """
+    keys = {tag: TAG_VERSION_KEY.format(tag) for tag in sorted(tags)}
+    versions = cache.get_many(list(keys.values()))
+    for key in keys.values():
+        if key not in versions:
+            # first use or evicted, any new version will do
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys.values()]
+
+
+def invalidate_query_cache(*tags):
+    """
+    Drop the cached answers made of the tagged models
+    eg: invalidate_query_cache("items", "menus")
+    """
+    cache.set_many({TAG_VERSION_KEY.format(tag): uuid.uuid4().hex for tag in tags}, None)
+
+
+def schedule_query_cache_invalidation(*tags):
+    # once the change is visible to the queries that will fill the cache again
+    transaction.on_commit(lambda: invalidate_query_cache(*tags))
+
+
+def get_field_names(document):
+    """
+    The names of all the fields selected in the document, fragments included
+    """
+    names = set()
+
+    def walk(selection_set):
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                names.add(selection.name.value)
+            if getattr(selection, "selection_set", None):
+                walk(selection.selection_set)
+
+    for definition in document.definitions:
+        if getattr(definition, "selection_set", None):
+            walk(definition.selection_set)
+    return names
+
+
+def get_request_user(request):
+    """
+    The user of the session or of the JWT of the request, None when anonymous.
+    Raises JSONWebTokenError when the token is not valid
+    """
+    from graphql_jwt.shortcuts import get_user_by_token
+    from graphql_jwt.utils import get_http_authorization
+
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user
+    token = get_http_authorization(request)
+    if token:
+        return get_user_by_token(token, request)
+    return None
+
+
+def get_scope(user):
+    """
+    What the public queries depend on for the user, None when they are answered for them alone
+    eg: "anonymous" or {"gender": 1, "school": 3, "campus": "main"}
+    """
+    from users.models import Student
+
+    if user is None:
+        return "anonymous"
+    if "VENDOR" in user.roles:
+        # the vendors also see the items of their store that are not on sale
+        return None
+    profile = user.profile
+    school_id, campus = (
+        Student.objects.filter(user=profile).values_list("school_id", "campus").first()
+        or (None, None)
+    )
+    return {"gender": profile.gender_id, "school": school_id, "campus": campus}
+
+
+def get_query_cache_key(request, document, variables, operation_name):
+    """
+    The cache key of the answer of the parsed query for the user of the request,
+    None when the answer can not be shared
+    """
+    from graphql_jwt.exceptions import JSONWebTokenError
+
+    operation = get_operation_ast(document, operation_name)
+    if operation is None or operation.operation != OperationType.QUERY:
+        return None
+
+    tags = set()
+    for selection in operation.selection_set.selections:
+        if not isinstance(selection, FieldNode):
+            return None
+        name = selection.name.value
+        if name == "__typename":
+            continue
+        if name not in CACHEABLE_FIELDS:
+            return None
+        tags.update(CACHEABLE_FIELDS[name])
+    if not tags:
+        return None
+
+    try:
+        user = get_request_user(request)
+    except JSONWebTokenError:
+        # the execution reports the token error
+        return None
+    if user is not None and USER_FIELDS & get_field_names(document):
+        return None
+    scope = get_scope(user)
+    if scope is None:
+        return None
+
+    key = json.dumps(
+        {
+            # the whitespace and the commas are not part of the query
+            "query": print_ast(document),
+            "variables": variables or {},
+            "operation_name": operation_name,
+            "scope": scope,
+            # the image urls are absolute
+            "host": f"{request.scheme}://{request.get_host()}",
+            "tags": get_tag_versions(tags),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return f"query-cache:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+class CachedGraphQLView(PersistedQueryGraphQLView):
+    """
+    GraphQL view answering the public queries (see CACHEABLE_FIELDS) from the cache
+    for QUERY_CACHE_TIMEOUT seconds or until their models change.
+    The X-Cache-Status header of the queries is HIT, MISS or BYPASS
+    """
+
+    cache_status = None
+    execution_result = None
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if self.cache_status:
+            response["X-Cache-Status"] = self.cache_status
+        return response
+
+    def execute_graphql_request(self, *args, **kwargs):
+        self.execution_result = super().execute_graphql_request(*args, **kwargs)
+        return self.execution_result
+
+    def get_response(self, request, data, show_graphiql=False):
+        if show_graphiql or self.batch or not settings.QUERY_CACHE_ENABLED:
+            return super().get_response(request, data, show_graphiql)
+
+        query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        cache_key = None
+        if query:
+            try:
+                # the execution reports the errors of the query
+                document, _ = DOCUMENT_CACHE.get(self.schema.graphql_schema, query)
+                if document is not None:
+                    cache_key = get_query_cache_key(
+                        request, document, variables, operation_name
+                    )
+            except Exception as e:
+                logging.exception(f"Error making the query cache key: {e}")
+        if cache_key is None:
+            self.cache_status = "BYPASS"
+            return super().get_response(request, data, show_graphiql)
+
+        result = cache.get(cache_key)
+        if result is not None:
+            self.cache_status = "HIT"
+            return result, 200
+
+        self.cache_status = "MISS"
+        result, status_code = super().get_response(request, data, show_graphiql)
+        if status_code == 200 and self.execution_result and not self.execution_result.errors:
+            cache.set(cache_key, result, settings.QUERY_CACHE_TIMEOUT)
+        return result, status_code
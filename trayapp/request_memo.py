@@ -0,0 +1,43 @@
+from contextvars import ContextVar
+
+# the memo of the request that is currently being handled, None outside a request
+_request_memo = ContextVar("request_memo", default=None)
+
+
+def start_request_memo():
+    """
+    Start a new memo for the current request, returns a token for `end_request_memo`
+    """
+    return _request_memo.set({})
+
+
+def end_request_memo(token):
+    _request_memo.reset(token)
+
+
+def request_memo(key, func):
+    """
+    Return the value memoized under `key` for the current request,
+    `func` is called the first time the key is asked for.
+    Outside a request (shell, management commands, tests) `func` is always called.
+
+    ```python
+    roles = request_memo(("roles", user.id), user.get_roles)
+    ```
+    """
+    memo = _request_memo.get()
+    if memo is None:
+        return func()
+    if key not in memo:
+        memo[key] = func()
+    return memo[key]
+
+
+def clear_request_memo():
+    """
+    Forget everything memoized for the current request,
+    this is called whenever a model the memoized values depend on is saved
+    """
+    memo = _request_memo.get()
+    if memo is not None:
+        memo.clear()
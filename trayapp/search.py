@@ -0,0 +1,410 @@
+import math
+import re
+import time
+import heapq
+import logging
+import threading
+import unicodedata
+
+from django.apps import apps
+from django.db import connection, models, transaction
+from django.db.models import Case, F, FloatField, Lookup, Q, Value, When
+from django.db.models.functions import Cast, Greatest, Ln
+
+# no stemming, the names of the dishes and stores are not english words
+SEARCH_CONFIG = "simple"
+# how much the clicks / rank of a result add to its text relevance
+POPULARITY_WEIGHT = 0.1
+# minimum similarity of a misspelled word, see InProcessSearchIndex
+TYPO_THRESHOLD = 0.3
+# the in-process index is rebuilt after this many seconds, it does not see
+# the documents updated by the other processes
+FALLBACK_INDEX_MAX_AGE = 5 * 60
+# best in-process matches ranked by the database
+FALLBACK_MAX_RESULTS = 100
+
+
+class SearchDocumentField(models.TextField):
+    """
+    The text a row is searched by, adds the `trigram_word_similar` lookup
+    (the pg_trgm `<%` operator) when the pg_trgm extension is installed
+    """
+
+
+@SearchDocumentField.register_lookup
+class TrigramWordSimilar(Lookup):
+    lookup_name = "trigram_word_similar"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{rhs} <%% {lhs}", rhs_params + lhs_params
+
+
+class TrigramWordSimilarity(models.Func):
+    # how well the query matches a part of the document, from 0 to 1
+    function = "WORD_SIMILARITY"
+    output_field = FloatField()
+
+
+def normalize(text):
+    """
+    Lowercase the text and drop its accents and punctuation
+    eg: normalize("Jollof Rice & Chicken!") -> "jollof rice chicken"
+    """
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def get_trigrams(word):
+    word = f"  {word} "
+    return {word[i : i + 3] for i in range(len(word) - 2)}
+
+
+class InProcessSearchIndex:
+    """
+    Search index kept in memory, used when the database has no full text search
+    (SQLite runs). Postgres without pg_trgm does not match misspelled words.
+    ```python
+    index = InProcessSearchIndex()
+    index.add(1, "jollof rice mama put")
+    index.search("jolof")  # {1: 0.71}
+    ```
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}
+        # word -> ids of the documents with that word
+        self._words = {}
+
+    def add(self, pk, document):
+        with self._lock:
+            self._remove(pk)
+            words = set(normalize(document).split())
+            self._documents[pk] = words
+            for word in words:
+                self._words.setdefault(word, set()).add(pk)
+
+    def remove(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def _remove(self, pk):
+        for word in self._documents.pop(pk, ()):
+            self._words[word].discard(pk)
+            if not self._words[word]:
+                del self._words[word]
+
+    def search(self, query):
+        """
+        Return {pk: score} of the documents matching every word of the query,
+        a word matches a document word it starts or that is similar enough
+        """
+        query_words = normalize(query).split()
+        if not query_words:
+            return {}
+
+        with self._lock:
+            scores = None
+            for query_word in query_words:
+                query_trigrams = get_trigrams(query_word)
+                word_scores = {}
+                for word, pks in self._words.items():
+                    if word.startswith(query_word):
+                        score = 1.0
+                    else:
+                        trigrams = get_trigrams(word)
+                        score = len(query_trigrams & trigrams) / len(
+                            query_trigrams | trigrams
+                        )
+                        if score < TYPO_THRESHOLD:
+                            continue
+                    for pk in pks:
+                        word_scores[pk] = max(word_scores.get(pk, 0), score)
+
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {
+                        pk: score + word_scores[pk]
+                        for pk, score in scores.items()
+                        if pk in word_scores
+                    }
+        return {pk: score / len(query_words) for pk, score in scores.items()}
+
+
+class SearchSpec:
+    """
+    How the rows of a model are searched, `name_fields` weigh more than the
+    rest of the document and `popularity_field` breaks the ties
+    """
+
+    def __init__(self, model_label, name_fields, popularity_field):
+        self.model_label = model_label
+        self.name_fields = name_fields
+        self.popularity_field = popularity_field
+        self.fallback_index = None
+        self.fallback_index_built_at = None
+
+    @property
+    def model(self):
+        return apps.get_model(self.model_label)
+
+    def get_search_vector(self):
+        from django.contrib.postgres.search import SearchVector
+
+        vector = SearchVector(*self.name_fields, weight="A", config=SEARCH_CONFIG)
+        return vector + SearchVector(
+            "search_document", weight="B", config=SEARCH_CONFIG
+        )
+
+    def get_fallback_index(self):
+        if (
+            self.fallback_index is None
+            or time.monotonic() - self.fallback_index_built_at > FALLBACK_INDEX_MAX_AGE
+        ):
+            index = InProcessSearchIndex()
+            for pk, document in self.model.objects.values_list(
+                "pk", "search_document"
+            ).iterator():
+                index.add(pk, document)
+            self.fallback_index = index
+            self.fallback_index_built_at = time.monotonic()
+        return self.fallback_index
+
+    def update_documents(self, documents):
+        """
+        Save the {pk: document} of the rows and their search vectors
+        """
+        model = self.model
+        model.objects.bulk_update(
+            [model(pk=pk, search_document=document) for pk, document in documents.items()],
+            ["search_document"],
+        )
+        if connection.vendor == "postgresql":
+            model.objects.filter(pk__in=list(documents)).update(
+                search_vector=self.get_search_vector()
+            )
+        if self.fallback_index is not None:
+            for pk, document in documents.items():
+                self.fallback_index.add(pk, document)
+
+
+ITEM_SEARCH = SearchSpec("product.Item", ["product_name"], "product_clicks")
+STORE_SEARCH = SearchSpec(
+    "users.Store", ["store_name", "store_nickname"], "store_rank"
+)
+
+_has_trigram = None
+
+
+def has_trigram():
+    # the pg_trgm extension is optional, it is checked once per process
+    global _has_trigram
+    if _has_trigram is None:
+        _has_trigram = False
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                _has_trigram = cursor.fetchone() is not None
+    return _has_trigram
+
+
+def update_item_documents(item_ids=None, batch_size=500):
+    """
+    Rebuild the search documents of the items (all of them by default),
+    returns the number of items updated
+    """
+    items = (
+        ITEM_SEARCH.model.objects.select_related(
+            "product_creator__school", "product_menu"
+        )
+        .prefetch_related("product_categories")
+        .order_by("pk")
+    )
+    if item_ids is not None:
+        items = items.filter(pk__in=item_ids)
+
+    updated = 0
+    for start in range(0, items.count(), batch_size):
+        documents = {}
+        for item in items[start : start + batch_size]:
+            store = item.product_creator
+            documents[item.pk] = normalize(
+                " ".join(
+                    [
+                        item.product_name,
+                        item.product_desc or "",
+                        " ".join(
+                            category.name for category in item.product_categories.all()
+                        ),
+                        item.product_menu.name if item.product_menu else "",
+                        store.store_name if store else "",
+                        store.store_nickname if store else "",
+                        (store.campus or "") if store else "",
+                        store.school.name if store and store.school else "",
+                    ]
+                )
+            )
+        ITEM_SEARCH.update_documents(documents)
+        updated += len(documents)
+    return updated
+
+
+def update_store_documents(store_ids=None, batch_size=500):
+    """
+    Rebuild the search documents of the stores (all of them by default),
+    returns the number of stores updated
+    """
+    stores = (
+        STORE_SEARCH.model.objects.select_related("school")
+        .prefetch_related("menu_set")
+        .order_by("pk")
+    )
+    if store_ids is not None:
+        stores = stores.filter(pk__in=store_ids)
+
+    updated = 0
+    for start in range(0, stores.count(), batch_size):
+        documents = {}
+        for store in stores[start : start + batch_size]:
+            documents[store.pk] = normalize(
+                " ".join(
+                    [
+                        store.store_name,
+                        store.store_nickname,
+                        store.store_bio or "",
+                        " ".join(str(category) for category in store.store_categories or []),
+                        " ".join(menu.name for menu in store.menu_set.all()),
+                        store.campus or "",
+                        store.school.name if store.school else "",
+                    ]
+                )
+            )
+        STORE_SEARCH.update_documents(documents)
+        updated += len(documents)
+    return updated
+
+
+# ids waiting for the current transaction to commit, see `schedule_search_update`
+_pending_updates = threading.local()
+
+
+def schedule_search_update(item_ids=(), store_ids=(), with_store_items=False):
+    """
+    Rebuild the search documents once the current transaction commits,
+    the ids scheduled by the same request are updated together.
+    `with_store_items` also rebuilds the items of the stores (their store name,
+    menus or campus changed)
+    """
+    pending = getattr(_pending_updates, "ids", None)
+    if pending is None:
+        pending = _pending_updates.ids = {"items": set(), "stores": set(), "store_items": set()}
+    pending["items"].update(item_ids)
+    pending["stores"].update(store_ids)
+    if with_store_items:
+        pending["store_items"].update(store_ids)
+    transaction.on_commit(run_pending_search_updates)
+
+
+def run_pending_search_updates():
+    pending = getattr(_pending_updates, "ids", None)
+    _pending_updates.ids = None
+    if not pending:
+        return
+
+    try:
+        item_ids = set(pending["items"])
+        if pending["store_items"]:
+            item_ids.update(
+                ITEM_SEARCH.model.objects.filter(
+                    product_creator_id__in=pending["store_items"]
+                ).values_list("pk", flat=True)
+            )
+        if item_ids:
+            update_item_documents(item_ids)
+        if pending["stores"]:
+            update_store_documents(pending["stores"])
+    except Exception as e:
+        # the rebuild_search_index command repairs the documents
+        logging.exception(f"Error updating the search documents: {e}")
+
+
+def search_in_process(queryset, query, spec: SearchSpec):
+    """
+    Rank the rows of `queryset` with the in-process index,
+    returns a queryset of the FALLBACK_MAX_RESULTS best matches ordered by relevance
+    """
+    scores = spec.get_fallback_index().search(query)
+    if not scores:
+        return queryset.none()
+    # one WHEN per row in the ordering
+    scores = dict(
+        heapq.nlargest(FALLBACK_MAX_RESULTS, scores.items(), key=lambda item: item[1])
+    )
+
+    popularity = dict(
+        queryset.filter(pk__in=list(scores)).values_list("pk", spec.popularity_field)
+    )
+    ranked = sorted(
+        popularity,
+        key=lambda pk: -scores[pk]
+        * (1 + POPULARITY_WEIGHT * math.log1p(max(popularity[pk] or 0, 0))),
+    )
+    return (
+        queryset.filter(pk__in=ranked)
+        .annotate(
+            search_rank=Case(
+                *[When(pk=pk, then=Value(-position)) for position, pk in enumerate(ranked)],
+                output_field=FloatField(),
+            )
+        )
+        .order_by("-search_rank")
+    )
+
+
+def search_queryset(queryset, query, spec: SearchSpec):
+    """
+    Filter `queryset` to the rows matching `query` and order them by their text
+    relevance times their popularity
+    ```python
+    items = search_queryset(Item.get_items(), "jolof rice", ITEM_SEARCH)
+    ```
+    """
+    words = normalize(query).split()
+    if not words:
+        return queryset.none()
+    if connection.vendor != "postgresql":
+        return search_in_process(queryset, query, spec)
+
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    # every word, as a prefix: "jol ric" finds "jollof rice"
+    search_query = SearchQuery(
+        " & ".join(f"{word}:*" for word in words),
+        config=SEARCH_CONFIG,
+        search_type="raw",
+    )
+    matches = Q(search_vector=search_query)
+    text_rank = SearchRank(F("search_vector"), search_query)
+    if has_trigram():
+        # misspelled words, only the prefixes are matched without pg_trgm
+        normalized_query = " ".join(words)
+        matches |= Q(search_document__trigram_word_similar=normalized_query)
+        text_rank = text_rank + TrigramWordSimilarity(
+            Value(normalized_query), F("search_document")
+        )
+
+    popularity = Cast(Greatest(F(spec.popularity_field), 0), FloatField())
+    return (
+        queryset.filter(matches)
+        .annotate(
+            search_rank=models.ExpressionWrapper(
+                text_rank * (1 + POPULARITY_WEIGHT * Ln(popularity + 1)),
+                output_field=FloatField(),
+            )
+        )
+        .order_by("-search_rank", "-pk")
+    )
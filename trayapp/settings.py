@@ -65,6 +65,8 @@ PAYSTACK_SECRET_KEY = os.environ.get(
 PAYSTACK_PUBLIC_KEY = os.environ.get(
     "PAYSTACK_PUBLIC_KEY", "pk_test_6babc1ce63e8962d226e26a591af69d2f2067893"
 )
+# see trayapp.paystack, the tests point it to a local stub server
+PAYSTACK_BASE_URL = os.environ.get("PAYSTACK_BASE_URL", "https://api.paystack.co")
 TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", "test")
 TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "test")
 TWILIO_VERIFY_SERVICE_SID = os.environ.get("TWILIO_VERIFY_SERVICE_SID", "test")
@@ -107,6 +109,70 @@ ALLOWED_HOSTS = [
 ]
 SMS_ENABLED = "True" == os.environ.get("SMS_ENABLED", "False")
 
+# where queue messages are sent: "azure", "memory" or "filesystem" (see trayapp.utils)
+QUEUE_BACKEND = os.environ.get("QUEUE_BACKEND", "azure")
+QUEUE_FILESYSTEM_DIR = BASE_DIR / "workspace/queues"
+# send the notification outbox from a background thread once a request commits
+NOTIFICATION_OUTBOX_AUTO_DISPATCH = "True" == os.environ.get(
+    "NOTIFICATION_OUTBOX_AUTO_DISPATCH", "True"
+)
+# make the image renditions from a background thread once an upload is saved
+IMAGE_RENDITIONS_AUTO_PROCESS = "True" == os.environ.get(
+    "IMAGE_RENDITIONS_AUTO_PROCESS", "True"
+)
+# process the stored Paystack webhook events from a pool of background threads
+PAYMENT_EVENTS_AUTO_PROCESS = "True" == os.environ.get(
+    "PAYMENT_EVENTS_AUTO_PROCESS", "True"
+)
+PAYMENT_EVENT_WORKERS = int(os.environ.get("PAYMENT_EVENT_WORKERS", 4))
+# where the view, click and rank counts wait before they are flushed to the database:
+# "cache" (shared by the processes) or "local" (see trayapp.counters)
+COUNTER_BUFFER_BACKEND = os.environ.get("COUNTER_BUFFER_BACKEND", "cache")
+# flush the counter buffer and the user activity buffer from a background thread
+WRITE_BUFFER_AUTO_FLUSH = "True" == os.environ.get(
+    "WRITE_BUFFER_AUTO_FLUSH", "True"
+)
+# cache the answers of the public graphql queries (see trayapp.query_cache)
+QUERY_CACHE_ENABLED = "True" == os.environ.get("QUERY_CACHE_ENABLED", "True")
+QUERY_CACHE_TIMEOUT = int(os.environ.get("QUERY_CACHE_TIMEOUT", 60))
+# parsed and validated graphql documents kept by each process (see trayapp.persisted_queries)
+GRAPHQL_DOCUMENT_CACHE_SIZE = int(os.environ.get("GRAPHQL_DOCUMENT_CACHE_SIZE", 500))
+# the queries the clients register with their hash are kept this many seconds in the cache,
+# and the most recently used ones of each process in memory
+AUTOMATIC_PERSISTED_QUERIES_TIMEOUT = int(
+    os.environ.get("AUTOMATIC_PERSISTED_QUERIES_TIMEOUT", 24 * 60 * 60)
+)
+AUTOMATIC_PERSISTED_QUERIES_SIZE = int(
+    os.environ.get("AUTOMATIC_PERSISTED_QUERIES_SIZE", 1000)
+)
+# only run the allowlisted persisted queries, for production once the operations
+# of the clients are registered (see the register_persisted_queries command)
+PERSISTED_QUERIES_ALLOWLIST = "True" == os.environ.get(
+    "PERSISTED_QUERIES_ALLOWLIST", "False"
+)
+
+# the cache shared by the processes when REDIS_URL is set (eg: redis://localhost:6379/1),
+# the memory of each process otherwise
+REDIS_URL = os.environ.get("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+                # a cache miss rather than an error when redis is down
+                "IGNORE_EXCEPTIONS": True,
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 DATA_UPLOAD_MAX_NUMBER_FIELDS = os.environ.get("DATA_UPLOAD_MAX_NUMBER_FIELDS", 2000)
 CSRF_COOKIE_SECURE = DEBUG == False
 SESSION_COOKIE_SECURE = DEBUG == False
@@ -185,6 +251,8 @@ GRAPHENE = {
     "SCHEMA": "trayapp.schema.schema",
     "MIDDLEWARE": [
         "graphql_jwt.middleware.JSONWebTokenMiddleware",
+        # one cache call for the pending counts of a page, see trayapp.counters
+        "trayapp.middlewares.CounterPrimingMiddleware",
     ],
 }
 
@@ -234,6 +302,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "trayapp.middlewares.RequestMemoMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "django.middleware.http.ConditionalGetMiddleware",
@@ -0,0 +1,261 @@
+import json
+import threading
+import time
+from unittest import mock
+
+from django.db import DatabaseError, connection
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from product.models import Item
+from users.models import UserAccount, Profile, Store
+from trayapp.counters import (
+    CacheCounterStore,
+    CounterBuffer,
+    LocalCounterStore,
+    ITEM_CLICKS_COUNTER,
+    ITEM_VIEWS_COUNTER,
+    STORE_RANK_COUNTER,
+)
+import trayapp.counters
+
+ITEMS_COUNTERS_QUERY = """
+query {
+    items(first: 10) {
+        edges { node { productViews productClicks productCreator { storeRank } } }
+    }
+}
+"""
+
+
+@override_settings(WRITE_BUFFER_AUTO_FLUSH=False)
+class CounterBufferTests(TestCase):
+    THREADS = 8
+    INCREMENTS_PER_THREAD = 500
+
+    def setUp(self):
+        vendor = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        self.store = Store.objects.create(
+            vendor=Profile.objects.get(user=vendor),
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+        )
+        self.items = [
+            Item.objects.create(
+                product_name=f"Item {i}",
+                product_slug=f"item-{i}",
+                product_creator=self.store,
+            )
+            for i in range(5)
+        ]
+
+    def use_buffer(self, store):
+        buffer = CounterBuffer(store)
+        previous = trayapp.counters._counter_buffer
+        trayapp.counters._counter_buffer = buffer
+        self.addCleanup(setattr, trayapp.counters, "_counter_buffer", previous)
+        return buffer
+
+    def increment_concurrently(self, buffer, flush_meanwhile=False):
+        def increment(thread_index):
+            item = self.items[thread_index % len(self.items)]
+            for _ in range(self.INCREMENTS_PER_THREAD):
+                ITEM_CLICKS_COUNTER.incr(item.id)
+                STORE_RANK_COUNTER.incr(self.store.id)
+
+        threads = [
+            threading.Thread(target=increment, args=(i,)) for i in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        # the flusher drains the buffer while the increments keep coming
+        while flush_meanwhile and any(thread.is_alive() for thread in threads):
+            buffer.flush()
+        for thread in threads:
+            thread.join()
+        buffer.flush()
+
+    def assertNoLostUpdates(self):
+        total = self.THREADS * self.INCREMENTS_PER_THREAD
+        clicks = sum(
+            Item.objects.filter(id__in=[item.id for item in self.items]).values_list(
+                "product_clicks", flat=True
+            )
+        )
+        self.store.refresh_from_db()
+        self.assertEqual(clicks, total)
+        self.assertEqual(self.store.store_rank, total * 0.5)
+
+    def test_no_lost_updates_with_local_store(self):
+        buffer = self.use_buffer(LocalCounterStore())
+        self.increment_concurrently(buffer, flush_meanwhile=True)
+        self.assertNoLostUpdates()
+
+    def test_no_lost_updates_with_cache_store(self):
+        buffer = self.use_buffer(CacheCounterStore())
+        self.increment_concurrently(buffer, flush_meanwhile=True)
+        self.assertNoLostUpdates()
+
+    def test_flush_is_one_update_per_counter(self):
+        buffer = self.use_buffer(LocalCounterStore())
+        for item in self.items:
+            ITEM_VIEWS_COUNTER.incr(item.id)
+            ITEM_CLICKS_COUNTER.incr(item.id, 2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            updated = buffer.flush()
+
+        self.assertEqual(updated, 10)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(buffer.flush(), 0)
+        item = Item.objects.get(id=self.items[0].id)
+        self.assertEqual((item.product_views, item.product_clicks), (1, 2))
+
+    def test_reads_merge_pending_counts(self):
+        buffer = self.use_buffer(LocalCounterStore())
+        ITEM_VIEWS_COUNTER.incr(self.items[0].id, 3)
+        STORE_RANK_COUNTER.incr(self.store.id)
+
+        self.assertEqual(ITEM_VIEWS_COUNTER.get_value(self.items[0]), 3)
+        self.assertEqual(STORE_RANK_COUNTER.get_value(self.store), 0.5)
+
+        buffer.flush()
+        item = Item.objects.get(id=self.items[0].id)
+        self.assertEqual(ITEM_VIEWS_COUNTER.get_value(item), 3)
+
+    @override_settings(QUERY_CACHE_ENABLED=False)
+    def test_a_page_reads_its_pending_counts_at_once(self):
+        self.use_buffer(LocalCounterStore())
+        Store.objects.filter(id=self.store.id).update(is_approved=True)
+        for index, item in enumerate(self.items):
+            ITEM_VIEWS_COUNTER.incr(item.id, index)
+        STORE_RANK_COUNTER.incr(self.store.id)
+
+        with mock.patch.object(
+            LocalCounterStore,
+            "get_many",
+            autospec=True,
+            side_effect=LocalCounterStore.get_many,
+        ) as get_many:
+            response = self.client.post(
+                "/graphql/",
+                json.dumps({"query": ITEMS_COUNTERS_QUERY}),
+                content_type="application/json",
+            )
+        nodes = [edge["node"] for edge in response.json()["data"]["items"]["edges"]]
+        self.assertEqual(
+            sorted((node["productViews"], node["productClicks"]) for node in nodes),
+            [(index, 0) for index in range(len(self.items))],
+        )
+        self.assertEqual({node["productCreator"]["storeRank"] for node in nodes}, {0.5})
+        # one call for the page of items, one for the rank of their store
+        self.assertEqual(get_many.call_count, 2)
+
+    def test_failed_flush_keeps_the_pending_counts(self):
+        buffer = self.use_buffer(LocalCounterStore())
+        for item in self.items:
+            ITEM_VIEWS_COUNTER.incr(item.id)
+            ITEM_CLICKS_COUNTER.incr(item.id, 2)
+            STORE_RANK_COUNTER.incr(self.store.id)
+
+        with mock.patch.object(
+            CounterBuffer, "update_counter", side_effect=DatabaseError("down")
+        ):
+            with self.assertRaises(DatabaseError):
+                buffer.flush()
+
+        buffer.flush()
+        item = Item.objects.get(id=self.items[0].id)
+        self.assertEqual((item.product_views, item.product_clicks), (1, 2))
+        self.store.refresh_from_db()
+        self.assertEqual(self.store.store_rank, 2.5)
+
+    def test_increments_from_many_threads(self):
+        self.use_buffer(CacheCounterStore())
+        self.increment_concurrently(trayapp.counters.get_counter_buffer())
+        self.assertNoLostUpdates()
+
+
+@override_settings(WRITE_BUFFER_AUTO_FLUSH=False)
+class ConcurrentFlushTests(TransactionTestCase):
+    """
+    The flushes run in their own threads, the rows have to be committed for them
+    """
+
+    INCREMENTS_PER_THREAD = 500
+
+    def setUp(self):
+        cache.clear()
+        vendor = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        store = Store.objects.create(
+            vendor=Profile.objects.get(user=vendor),
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+        )
+        self.items = [
+            Item.objects.create(
+                product_name=f"Item {i}", product_slug=f"item-{i}", product_creator=store
+            )
+            for i in range(2)
+        ]
+
+    def test_concurrent_flushes_do_not_double_count(self):
+        # two processes sharing the counts of the cache, both see the same dirty keys
+        store = CacheCounterStore()
+        buffers = [CounterBuffer(store), CounterBuffer(store)]
+        items = self.items[:2]
+        taken = []
+        take = store.take
+
+        def record_take(key):
+            count = take(key)
+            taken.append(count)
+            return count
+
+        def increment_and_flush(buffer):
+            try:
+                for _ in range(self.INCREMENTS_PER_THREAD):
+                    for item in items:
+                        buffer.incr(ITEM_CLICKS_COUNTER, item.id)
+                    buffer.flush()
+                buffer.flush()
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=increment_and_flush, args=(buffer,))
+            for buffer in buffers
+        ]
+        # a slow cache widens the window between reading a count and taking it
+        get = LocMemCache.get
+
+        def slow_get(*args, **kwargs):
+            value = get(*args, **kwargs)
+            time.sleep(0.0005)
+            return value
+
+        # the threads have their own cache connection
+        with mock.patch.object(LocMemCache, "get", slow_get), mock.patch.object(
+            store, "take", record_take
+        ):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        clicks = Item.objects.filter(id__in=[item.id for item in items]).values_list(
+            "product_clicks", flat=True
+        )
+        self.assertEqual(sum(clicks), 2 * len(items) * self.INCREMENTS_PER_THREAD)
+        # a count taken twice leaves a negative count behind, taken by the next flush
+        self.assertGreaterEqual(min(taken), 0)
+        pending = ITEM_CLICKS_COUNTER.get_pending([item.id for item in items])
+        self.assertEqual(set(pending.values()), {0})
@@ -0,0 +1,227 @@
+import json
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from trayapp.paystack import (
+    ACCOUNT_RESOLUTION_CACHE,
+    CachedLookup,
+    CircuitBreaker,
+    CircuitOpenError,
+    PaystackClient,
+    PaystackError,
+)
+from trayapp.utils import get_bank_account_details
+
+
+class StubPaystackHandler(BaseHTTPRequestHandler):
+    # keep-alive, the client reuses its connections
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.answer()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.answer()
+
+    def answer(self):
+        server = self.server
+        server.requests.append(
+            {
+                "path": self.path,
+                "port": self.client_address[1],
+                "idempotency_key": self.headers.get("Idempotency-Key"),
+                "authorization": self.headers.get("Authorization"),
+            }
+        )
+        status, delay = server.script.pop(0) if server.script else (200, 0)
+        if delay:
+            server.release.wait(delay)
+        body = json.dumps(
+            {"status": status < 400, "message": "", "data": {"calls": len(server.requests)}}
+        ).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up waiting
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class PaystackClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubPaystackHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        # (status, seconds before answering) of the next requests, then 200
+        self.server.script = []
+        self.server.release = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.client = PaystackClient(
+            base_url=f"http://127.0.0.1:{self.server.server_address[1]}",
+            secret_key="sk_test",
+            backoff=0,
+            circuit_breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60),
+            timeouts={"transfer": (1, 0.2), "refund": (1, 0.2)},
+        )
+
+    def tearDown(self):
+        self.server.release.set()
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_kept_alive(self):
+        for _ in range(3):
+            response = self.client.get("bank", params={"currency": "NGN"})
+            self.assertEqual(response.status_code, 200)
+
+        requests = self.server.requests
+        self.assertEqual(requests[0]["path"], "/bank?currency=NGN")
+        self.assertEqual(requests[0]["authorization"], "Bearer sk_test")
+        self.assertEqual(len({request["port"] for request in requests}), 1)
+
+        latency = self.client.latency.snapshot()["bank"]
+        self.assertEqual((latency["count"], latency["errors"]), (3, 0))
+        self.assertEqual(latency["buckets"][float("inf")], 3)
+
+    def test_retries_keep_the_idempotency_key(self):
+        self.server.script = [(503, 0), (500, 0)]
+        response = self.client.post("transfer", json={}, idempotency_key="ref-1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [request["idempotency_key"] for request in self.server.requests],
+            ["ref-1"] * 3,
+        )
+
+        # a post without an idempotency key is sent once
+        self.server.script = [(503, 0)]
+        response = self.client.post("refund", data={})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_refunds_fail_fast(self):
+        # paystack may have applied a refund that failed or timed out
+        self.server.script = [(503, 0)]
+        response = self.client.post("refund", data={}, idempotency_key="refund-1")
+        self.assertEqual(response.status_code, 503)
+        self.server.script = [(200, 5)]
+        with self.assertRaises(PaystackError):
+            self.client.post("refund", data={}, idempotency_key="refund-1")
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_unsent_requests_are_retried(self):
+        # nothing listens on the port, the request never left
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        client = PaystackClient(
+            base_url=f"http://127.0.0.1:{port}",
+            backoff=0,
+            circuit_breaker=CircuitBreaker(failure_threshold=10),
+        )
+        with self.assertRaises(PaystackError):
+            client.post("refund", data={}, idempotency_key="refund-2")
+        self.assertEqual(client.latency.snapshot()["refund"]["errors"], 3)
+        client.session.close()
+
+    def test_slow_answer_times_out(self):
+        self.server.script = [(200, 5)] * 3
+        with self.assertRaises(PaystackError):
+            self.client.post("transfer", json={}, idempotency_key="ref-2")
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.client.latency.snapshot()["transfer"]["errors"], 3)
+
+    def test_circuit_opens_after_failures(self):
+        self.server.script = [(500, 0)] * 3
+        response = self.client.get("balance")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.client.circuit_breaker.state, "open")
+
+        # the requests are not sent while the circuit is open
+        with self.assertRaises(CircuitOpenError):
+            self.client.get("balance")
+        self.assertEqual(len(self.server.requests), 3)
+
+        # one request checks the service once the reset timeout is over
+        self.client.circuit_breaker.reset_timeout = 0
+        self.assertEqual(self.client.get("balance").status_code, 200)
+        self.assertEqual(self.client.circuit_breaker.state, "closed")
+
+
+class CachedLookupTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def fetch(self, value):
+        def fetch():
+            self.calls.append(value)
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        return fetch
+
+    def test_fresh_then_stale_on_failure(self):
+        lookup = CachedLookup("test", ttl=60, stale_ttl=600)
+        self.assertEqual(lookup.get("key", self.fetch("a")), "a")
+        self.assertEqual(lookup.get("key", self.fetch("b")), "a")
+        self.assertEqual(self.calls, ["a"])
+
+        # expired, the gateway is down: the last value is served
+        lookup.ttl = 0
+        self.assertEqual(lookup.get("key", self.fetch(PaystackError("down"))), "a")
+        self.assertEqual(lookup.stats, {"hit": 1, "miss": 1, "stale": 1, "error": 1})
+
+        # nothing to fall back on
+        with self.assertRaises(PaystackError):
+            lookup.get("other", self.fetch(PaystackError("down")))
+
+    def test_background_refresh_serves_the_old_value(self):
+        lookup = CachedLookup("test", ttl=0, stale_ttl=600, refresh_in_background=True)
+        lookup.get("key", self.fetch("a"))
+        self.assertEqual(lookup.get("key", self.fetch("b")), "a")
+
+        for _ in range(50):
+            if cache.get(lookup.get_cache_key("key"))["value"] == "b":
+                break
+            time.sleep(0.02)
+        self.assertEqual(cache.get(lookup.get_cache_key("key"))["value"], "b")
+
+    def test_account_resolution_is_cached_per_account(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubPaystackHandler)
+        server.daemon_threads = True
+        server.requests, server.script = [], []
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        client = PaystackClient(
+            base_url=f"http://127.0.0.1:{server.server_address[1]}", backoff=0
+        )
+
+        with mock.patch("trayapp.paystack._client", client):
+            account = {"account_number": "0123456789", "bank_code": "044"}
+            first = get_bank_account_details(account)
+            self.assertEqual(get_bank_account_details(account), first)
+            get_bank_account_details({**account, "bank_code": "058"})
+            self.assertEqual(len(server.requests), 2)
+
+            # paystack is failing once the entry is old
+            server.script = [(503, 0)] * 3
+            with mock.patch.object(ACCOUNT_RESOLUTION_CACHE, "ttl", 0):
+                self.assertEqual(get_bank_account_details(account), first)
+        client.session.close()
@@ -0,0 +1,180 @@
+import json
+import time
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from graphql import get_introspection_query, parse, validate
+
+from core.models import PersistedQuery
+from trayapp.persisted_queries import (
+    AUTOMATIC_PERSISTED_QUERIES,
+    DOCUMENT_CACHE,
+    AutomaticPersistedQueries,
+    DocumentCache,
+)
+from trayapp.schema import schema
+from users.models import School
+
+SCHOOLS_QUERY = """
+query Schools {
+    schools(name: "Lagos") { name slug }
+}
+"""
+OTHER_SCHOOLS_QUERY = '{ schools(name: "Lagos") { name } }'
+
+
+class PersistedQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        DOCUMENT_CACHE.clear()
+        AUTOMATIC_PERSISTED_QUERIES.clear()
+        School.objects.create(name="University of Lagos", slug="unilag")
+        self.query_hash = PersistedQuery.get_hash(SCHOOLS_QUERY)
+
+    def post(self, query=None, query_hash=None):
+        body = {}
+        if query is not None:
+            body["query"] = query
+        if query_hash is not None:
+            body["extensions"] = {
+                "persistedQuery": {"version": 1, "sha256Hash": query_hash}
+            }
+        response = self.client.post(
+            "/graphql/", json.dumps(body), content_type="application/json"
+        )
+        return response.status_code, response.json()
+
+    def test_automatic_persisted_query(self):
+        # the client sends the hash first, then the query when it is not registered
+        status, content = self.post(query_hash=self.query_hash)
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            content["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND"
+        )
+
+        # the query is only cached
+        with CaptureQueriesContext(connection) as queries:
+            status, content = self.post(SCHOOLS_QUERY, self.query_hash)
+        self.assertEqual(content["data"]["schools"][0]["slug"], "unilag")
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(PersistedQuery.objects.exists())
+
+        # then the hash is enough, the document is not parsed again
+        misses = DOCUMENT_CACHE.stats["miss"]
+        status, content = self.post(query_hash=self.query_hash)
+        self.assertEqual(content["data"]["schools"][0]["slug"], "unilag")
+        self.assertEqual(DOCUMENT_CACHE.stats["miss"], misses)
+
+        # another process finds it in the django cache
+        AUTOMATIC_PERSISTED_QUERIES.clear()
+        status, content = self.post(query_hash=self.query_hash)
+        self.assertEqual(content["data"]["schools"][0]["slug"], "unilag")
+
+    def test_hash_must_match_the_query(self):
+        status, content = self.post("{ schools { name } }", self.query_hash)
+        self.assertEqual(status, 400)
+        self.assertEqual(
+            content["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_HASH_MISMATCH"
+        )
+        self.assertFalse(PersistedQuery.objects.exists())
+
+    def test_invalid_queries_are_not_registered(self):
+        query = "{ schools { unknownField } }"
+        status, content = self.post(query, PersistedQuery.get_hash(query))
+        self.assertIn("unknownField", content["errors"][0]["message"])
+        self.assertFalse(PersistedQuery.objects.exists())
+
+    def test_allowlist(self):
+        # registered by a client before the allowlist was turned on
+        self.post(SCHOOLS_QUERY, self.query_hash)
+        PersistedQuery.objects.create(
+            sha256_hash=self.query_hash, query=SCHOOLS_QUERY, operation_name="Schools"
+        )
+
+        with override_settings(PERSISTED_QUERIES_ALLOWLIST=True):
+            status, content = self.post(query_hash=self.query_hash)
+            self.assertEqual(
+                content["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_ALLOWED"
+            )
+            status, content = self.post(OTHER_SCHOOLS_QUERY)
+            self.assertEqual(status, 400)
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = Path(directory) / "schools.graphql"
+                path.write_text(OTHER_SCHOOLS_QUERY)
+                manifest = Path(directory) / "manifest.json"
+                manifest.write_text(json.dumps({self.query_hash: SCHOOLS_QUERY}))
+                call_command(
+                    "register_persisted_queries", str(path), str(manifest), stdout=StringIO()
+                )
+
+            status, content = self.post(query_hash=self.query_hash)
+            self.assertEqual(content["data"]["schools"][0]["slug"], "unilag")
+            status, content = self.post(OTHER_SCHOOLS_QUERY)
+            self.assertEqual(content["data"]["schools"][0]["name"], "University of Lagos")
+
+
+class AutomaticPersistedQueriesTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_least_recently_used_queries_are_dropped(self):
+        queries = AutomaticPersistedQueries(maxsize=2, timeout=60)
+        hashes = ["a" * 64, "b" * 64, "c" * 64]
+        for query_hash in hashes:
+            queries.add(query_hash, f"query {query_hash[0]}")
+        self.assertEqual(list(queries._queries), hashes[1:])
+
+        # the dropped ones are still cached for the other processes
+        self.assertEqual(queries.get(hashes[0]), "query a")
+        self.assertEqual(list(queries._queries), [hashes[2], hashes[0]])
+
+        cache.clear()
+        self.assertIsNone(queries.get(hashes[1]))
+        self.assertIsNone(queries.get("not a hash"))
+
+
+class DocumentCacheTests(SimpleTestCase):
+    def test_least_recently_used_documents_are_dropped(self):
+        documents = DocumentCache(maxsize=2)
+        graphql_schema = schema.graphql_schema
+        queries = ["{ schools { name } }", "{ schools { slug } }", "{ schools { country } }"]
+
+        first, errors = documents.get(graphql_schema, queries[0])
+        self.assertIsNone(errors)
+        documents.get(graphql_schema, queries[1])
+        self.assertIs(documents.get(graphql_schema, queries[0])[0], first)
+        documents.get(graphql_schema, queries[2])
+        # queries[1] was the least recently used
+        self.assertIsNot(documents.get(graphql_schema, queries[1])[0], None)
+        self.assertIsNot(documents.get(graphql_schema, queries[0])[0], first)
+        self.assertEqual(documents.stats, {"hit": 1, "miss": 5})
+
+        document, errors = documents.get(graphql_schema, "{ schools { ")
+        self.assertIsNone(document)
+        self.assertEqual(len(errors), 1)
+
+    def test_cached_documents_are_not_parsed_again(self):
+        graphql_schema = schema.graphql_schema
+        query = get_introspection_query()
+        runs = 20
+
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.assertEqual(validate(graphql_schema, parse(query)), [])
+        uncached = (time.perf_counter() - start) / runs
+
+        documents = DocumentCache(maxsize=10)
+        documents.get(graphql_schema, query)
+        start = time.perf_counter()
+        for _ in range(runs):
+            documents.get(graphql_schema, query)
+        cached = (time.perf_counter() - start) / runs
+
+        self.assertLess(cached, uncached)
@@ -0,0 +1,147 @@
+import json
+
+from django.core.cache import cache
+from django.test import TestCase
+from graphql_jwt.shortcuts import get_token
+
+from product.models import Item
+from users.models import Gender, Profile, Store, UserAccount
+
+STORES_QUERY = """
+query {
+    stores { edges { node { storeNickname storeName } } }
+}
+"""
+
+HERO_DATA_QUERY = """
+query {
+    heroData { productSlug currentUserReview { id } }
+}
+"""
+
+
+class QueryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.female = Gender.objects.create(name="female")
+        self.male = Gender.objects.create(name="male")
+        self.mama_put = self.create_store("Mama Put Kitchen", "mamaput")
+        self.ladies = self.create_store("Ladies Lounge", "ladies", self.female)
+
+    def create_store(self, name, nickname, gender_preference=None):
+        user = UserAccount.objects.create_user(
+            username=nickname, email=f"{nickname}@example.com", password="testpass123"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            return Store.objects.create(
+                vendor=Profile.objects.get(user=user),
+                store_name=name,
+                store_nickname=nickname,
+                store_type="restaurant",
+                gender_preference=gender_preference,
+                is_approved=True,
+            )
+
+    def create_customer(self, username, gender):
+        user = UserAccount.objects.create_user(
+            username=username, email=f"{username}@example.com", password="testpass123"
+        )
+        Profile.objects.filter(user=user).update(gender=gender)
+        return user
+
+    def query(self, query, user=None):
+        headers = {}
+        if user is not None:
+            headers["HTTP_X_AUTHORIZATION"] = f"JWT {get_token(user)}"
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": query}),
+            content_type="application/json",
+            **headers,
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        content = response.json()
+        self.assertNotIn("errors", content)
+        return response["X-Cache-Status"], content["data"]
+
+    def test_public_query_is_cached_until_its_models_change(self):
+        status, data = self.query(STORES_QUERY)
+        self.assertEqual(status, "MISS")
+        self.assertEqual(len(data["stores"]["edges"]), 2)
+
+        # the same query written differently
+        self.assertEqual(
+            self.query("{stores{edges{node{storeNickname, storeName}}}}"), ("HIT", data)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mama_put.store_name = "Mama Put"
+            self.mama_put.save()
+        status, data = self.query(STORES_QUERY)
+        self.assertEqual(status, "MISS")
+        self.assertIn("Mama Put", [edge["node"]["storeName"] for edge in data["stores"]["edges"]])
+
+    def test_answers_are_shared_per_gender(self):
+        ada = self.create_customer("ada", self.female)
+        ngozi = self.create_customer("ngozi", self.female)
+        tunde = self.create_customer("tunde", self.male)
+
+        status, data = self.query(STORES_QUERY, ada)
+        self.assertEqual(status, "MISS")
+        self.assertEqual(len(data["stores"]["edges"]), 2)
+        self.assertEqual(self.query(STORES_QUERY, ngozi), ("HIT", data))
+
+        status, data = self.query(STORES_QUERY, tunde)
+        self.assertEqual(status, "MISS")
+        self.assertEqual(
+            [edge["node"]["storeNickname"] for edge in data["stores"]["edges"]],
+            ["mamaput"],
+        )
+
+    def test_item_change_invalidates_the_items_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.create(
+                product_name="Jollof Rice",
+                product_slug="jollof-rice",
+                product_creator=self.mama_put,
+            )
+        self.assertEqual(self.query(HERO_DATA_QUERY)[0], "MISS")
+        self.assertEqual(self.query(HERO_DATA_QUERY)[0], "HIT")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.filter(product_slug="jollof-rice").first().save()
+        self.assertEqual(self.query(HERO_DATA_QUERY)[0], "MISS")
+
+    def test_bulk_item_updates_invalidate_the_items_queries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Item.objects.create(
+                product_name="Jollof Rice",
+                product_slug="jollof-rice",
+                product_creator=self.mama_put,
+                has_qty=True,
+                product_qty=10,
+            )
+        self.assertEqual(self.query(HERO_DATA_QUERY)[0], "MISS")
+
+        # the queryset updates do not send post_save
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.update_stock([(self.mama_put.id, "jollof-rice", 2)], "remove")
+        self.assertEqual(self.query(HERO_DATA_QUERY)[0], "MISS")
+        self.assertEqual(self.query(HERO_DATA_QUERY)[0], "HIT")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.update_ratings_aggregates(item.id, new_stars=5)
+        self.assertEqual(self.query(HERO_DATA_QUERY)[0], "MISS")
+
+    def test_private_answers_are_not_cached(self):
+        ada = self.create_customer("ada", self.female)
+        # currentUserReview is answered per user
+        self.assertEqual(self.query(HERO_DATA_QUERY, ada)[0], "BYPASS")
+        # the vendors see the items of their store that are not on sale
+        vendor = UserAccount.objects.get(username="mamaput")
+        self.assertEqual(self.query(STORES_QUERY, vendor)[0], "BYPASS")
+        # not a public query
+        self.assertEqual(
+            self.query("{ heroData { productSlug } featuredStores { storeNickname } }", ada)[0],
+            "BYPASS",
+        )
@@ -0,0 +1,130 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from trayapp.utils import (
+    QueueBatchError,
+    QueueClientRegistry,
+    QueueTransport,
+    StorageQueueTransport,
+    get_queue_backend,
+    send_message_to_queue,
+    send_messages_batch,
+)
+
+
+class FakeTransport(QueueTransport):
+    """
+    Transport that counts the connections it opens instead of talking to Azure
+    """
+
+    max_batch_size = 4
+
+    def __init__(self):
+        self.connections = 0
+        self.closed = 0
+        self.healthy = True
+        self.fail_next_send = False
+        # the number of messages of the next batch sent before it fails
+        self.fail_next_send_after = None
+        self.batches = []
+
+    def connect(self, queue_name):
+        self.connections += 1
+        return {"queue_name": queue_name, "connection": self.connections}
+
+    def is_healthy(self, client):
+        return self.healthy
+
+    def close(self, client):
+        self.closed += 1
+
+    def send_batch(self, client, messages, ttl=None):
+        if self.fail_next_send:
+            self.fail_next_send = False
+            raise ConnectionError("connection reset")
+        if self.fail_next_send_after is not None:
+            sent, self.fail_next_send_after = self.fail_next_send_after, None
+            self.batches.append((client["queue_name"], list(messages[:sent])))
+            raise QueueBatchError(sent, ConnectionError("connection reset"))
+        self.batches.append((client["queue_name"], list(messages)))
+
+
+class QueueClientRegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.transport = FakeTransport()
+        self.registry = QueueClientRegistry(self.transport)
+
+    def messages(self, count):
+        return [{"message": f"message {i}"} for i in range(count)]
+
+    def test_client_is_reused_for_every_message(self):
+        for message in self.messages(10):
+            self.assertEqual(
+                self.registry.send_messages("new-sms-notification", [message]), 1
+            )
+        self.assertEqual(self.transport.connections, 1)
+        self.assertEqual(len(self.transport.batches), 10)
+
+    def test_one_client_per_queue(self):
+        self.registry.send_messages("new-sms-notification", self.messages(2))
+        self.registry.send_messages("new-push-notification", self.messages(2))
+        self.registry.send_messages("new-sms-notification", self.messages(2))
+        self.assertEqual(self.transport.connections, 2)
+
+    def test_messages_are_packed_up_to_the_batch_limit(self):
+        sent = self.registry.send_messages("new-sms-notification", self.messages(10))
+        self.assertEqual(sent, 10)
+        self.assertEqual(
+            [len(messages) for _, messages in self.transport.batches], [4, 4, 2]
+        )
+        self.assertEqual(self.transport.connections, 1)
+
+    def test_unhealthy_client_is_replaced(self):
+        self.registry.send_messages("new-sms-notification", self.messages(1))
+        self.registry.health_check_interval = 0
+        self.transport.healthy = False
+        self.registry.send_messages("new-sms-notification", self.messages(1))
+        self.assertEqual(self.transport.connections, 2)
+        self.assertEqual(self.transport.closed, 1)
+
+    def test_failed_send_reconnects_on_the_next_send(self):
+        self.transport.fail_next_send = True
+        sent = self.registry.send_messages("new-sms-notification", self.messages(6))
+        # the first batch failed, nothing after it is sent
+        self.assertEqual(sent, 0)
+        self.assertEqual(self.transport.closed, 1)
+
+        sent = self.registry.send_messages("new-sms-notification", self.messages(6))
+        self.assertEqual(sent, 6)
+        self.assertEqual(self.transport.connections, 2)
+
+    def test_messages_sent_before_a_failure_are_counted(self):
+        self.transport.fail_next_send_after = 3
+        sent = self.registry.send_messages("new-sms-notification", self.messages(6))
+        # not the whole batch, the outbox sends the other messages again
+        self.assertEqual(sent, 3)
+        self.assertEqual(self.transport.closed, 1)
+
+    def test_storage_queue_batch_failure_reports_the_sent_messages(self):
+        client = mock.Mock()
+        client.send_message.side_effect = [None, None, ConnectionError("connection reset")]
+        with self.assertRaises(QueueBatchError) as context:
+            StorageQueueTransport().send_batch(client, self.messages(4))
+        self.assertEqual(context.exception.sent, 2)
+        self.assertEqual(client.send_message.call_count, 3)
+
+
+@override_settings(QUEUE_BACKEND="memory")
+class SendMessagesBatchTests(SimpleTestCase):
+    def setUp(self):
+        get_queue_backend().messages.clear()
+
+    def test_send_messages_batch(self):
+        messages = [{"message": f"message {i}"} for i in range(3)]
+        self.assertEqual(send_messages_batch("new-sms-notification", messages), 3)
+        self.assertEqual(get_queue_backend().messages["new-sms-notification"], messages)
+
+    def test_send_message_to_queue(self):
+        self.assertTrue(send_message_to_queue({"message": "hi"}, "new-sms-notification"))
+        self.assertFalse(send_message_to_queue("hi", "new-sms-notification"))
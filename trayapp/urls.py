@@ -2,11 +2,11 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
-from graphene_file_upload.django import FileUploadGraphQLView
 
 # from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 from .views import index_view, admin_ping
+from .query_cache import CachedGraphQLView
 from core.views import order_redirect_share_view
 
 # from users.views import get_bank_list
@@ -20,7 +20,7 @@ urlpatterns = [
     path("users/", include("users.urls"), name="users-api"),
     path(
         "graphql/",
-        csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True)),
+        csrf_exempt(CachedGraphQLView.as_view(graphiql=True)),
         name="graph-api",
     ),
     path("pay/<str:order_id>", order_redirect_share_view, name="share-order"),
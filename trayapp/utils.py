@@ -2,6 +2,8 @@ from decimal import Decimal
 import os
 import requests
 import logging
+import threading
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -15,6 +17,7 @@ from azure.storage.queue import (
     BinaryBase64DecodePolicy,
 )
 from azure.servicebus import ServiceBusClient, ServiceBusMessage
+from azure.servicebus.exceptions import MessageSizeExceededError
 from azure.identity import DefaultAzureCredential
 
 from datetime import timedelta
@@ -98,61 +101,6 @@ def image_exists(image_path):
     return os.path.isfile(full_image_path)
 
 
-IMAGE_TYPES = {
-    "jpg": "JPEG",
-    "jpeg": "JPEG",
-    "png": "PNG",
-    "gif": "GIF",
-    "tif": "TIFF",
-    "tiff": "TIFF",
-}
-
-
-def image_resized(image, w, h, format=None):
-    """
-    Resize an image
-    ```python
-    image = request.FILES["image"]
-    w = 200
-    h = 200
-    image_resized(image, w, h) # returns a tuple of (file, name, content_type, size)
-    ```
-    """
-
-    import io
-    import sys
-    from PIL import Image
-
-    name = image.name
-    _image = Image.open(image)
-
-    # Calculate the aspect ratio of the original image
-    aspect_ratio = _image.width / _image.height
-
-    # Calculate the new width and height while preserving the aspect ratio
-    if _image.width > _image.height:
-        h = int(w / aspect_ratio)
-    else:
-        w = int(h * aspect_ratio)
-
-    # Using BICUBIC interpolation for high-quality resizing
-    imageTemporaryResized = _image.resize((w, h), Image.BICUBIC)
-
-    file = io.BytesIO()
-    if format:
-        # Using BICUBIC interpolation for high-quality resizing in the specified format
-        imageTemporaryResized = imageTemporaryResized.resize((w, h), Image.BICUBIC)
-        content_type = f"image/{format}"
-        imageTemporaryResized.save(file, format, optimize=True, quality=95)
-    else:
-        content_type = Image.MIME[_image.format]
-        imageTemporaryResized.save(file, _image.format, optimize=True, quality=95)
-
-    file.seek(0)
-    size = sys.getsizeof(file)
-    return file, name, content_type, size
-
-
 def delete_dir(empty_dir):
     """path could either be relative or absolute."""
     # check if file or directory exists
@@ -160,6 +108,18 @@ def delete_dir(empty_dir):
     path.rmdir()
 
 
+def get_gateway_json(response):
+    """
+    The json of a paystack answer, raises PaystackError when paystack failed
+    (the answer is not worth caching)
+    """
+    from trayapp.paystack import RETRY_STATUSES, PaystackError
+
+    if response.status_code in RETRY_STATUSES:
+        raise PaystackError(f"Paystack answered {response.status_code}")
+    return response.json()
+
+
 def get_banks_list(data):
     """
     Get List Of Banks
@@ -178,18 +138,20 @@ def get_banks_list(data):
     if "currency" not in data:
         raise Exception("Currency is required")
 
+    from trayapp.paystack import BANK_LIST_CACHE, get_paystack_client
+
+    params = {"currency": data["currency"]}
     if data["use_cursor"]:
-        reqUrl = "https://api.paystack.co/bank?perPage={}&page={}&currency={}".format(
-            data["perPage"], data["page"], data["currency"]
-        )
-    else:
-        reqUrl = "https://api.paystack.co/bank?currency={}".format(data["currency"])
-    r = requests.get(
-        reqUrl, headers={"Authorization": "Bearer {}".format(settings.PAYSTACK_SECRET_KEY)}
-    )
-    # check status code for response received
-    # success code - 200
-    banks = r.json()
+        params.update(perPage=data["perPage"], page=data["page"])
+
+    def fetch():
+        r = get_paystack_client().get("bank", params=params)
+        # check status code for response received
+        # success code - 200
+        return get_gateway_json(r)
+
+    cache_key = ":".join(f"{key}={value}" for key, value in sorted(params.items()))
+    banks = BANK_LIST_CACHE.get(cache_key, fetch)
     return banks
 
 
@@ -211,20 +173,50 @@ def get_bank_account_details(data):
     if "bank_code" not in data:
         raise Exception("Bank code is required")
 
-    reqUrl = (
-        "https://api.paystack.co/bank/resolve?account_number={}&bank_code={}".format(
-            data["account_number"], data["bank_code"]
+    from trayapp.paystack import ACCOUNT_RESOLUTION_CACHE, get_paystack_client
+
+    def fetch():
+        r = get_paystack_client().get(
+            "bank/resolve",
+            params={
+                "account_number": data["account_number"],
+                "bank_code": data["bank_code"],
+            },
         )
+        # check status code for response received
+        # success code - 200
+        return get_gateway_json(r)
+
+    bank_details = ACCOUNT_RESOLUTION_CACHE.get(
+        f"{data['bank_code']}:{data['account_number']}", fetch
     )
-    r = requests.get(
-        reqUrl, headers={"Authorization": "Bearer {}".format(settings.PAYSTACK_SECRET_KEY)}
-    )
-    # check status code for response received
-    # success code - 200
-    bank_details = r.json()
     return bank_details
 
 
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_distances(lat, lng, lats, lngs):
+    """
+    Great-circle distances in kilometers from (lat, lng) to every point of lats/lngs,
+    vectorized with numpy
+    ```python
+    haversine_distances(6.5244, 3.3792, [6.6018, 7.3775], [3.3515, 3.9470]) # array([  9.13, 113.69])
+    ```
+    """
+    import numpy as np
+
+    lat, lng = np.radians(lat), np.radians(lng)
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lngs = np.radians(np.asarray(lngs, dtype=float))
+
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
 def get_dataframe_from_qs(queryset):
     """
     Get a pandas dataframe from a queryset
@@ -335,70 +327,295 @@ def chunked_queryset(queryset, chunk_size=10000):
     yield queryset.filter(pk__gte=start_pk)
 
 
-def send_message_to_queue(message, queue_name):
-    # print("Sending message to queue", message)
+class QueueBatchError(Exception):
+    """
+    A batch failed after its first `sent` messages were sent
     """
-    Sends notification data to a specified Azure Queue Storage queue.
 
-    Args:
-        message (dict): Dictionary containing notification details.
-        queue_name (str): Name of the Azure Queue Storage queue.
+    def __init__(self, sent, error):
+        super().__init__(str(error))
+        self.sent = sent
+
+
+class QueueTransport:
+    """
+    How a QueueClientRegistry talks to a queue service,
+    subclasses create the clients and send a batch of messages with them
+    """
+
+    # most messages that are sent with one call to `send_batch`
+    max_batch_size = 32
+
+    def connect(self, queue_name):
+        raise NotImplementedError
+
+    def is_healthy(self, client) -> bool:
+        return True
+
+    def close(self, client):
+        pass
+
+    def send_batch(self, client, messages, ttl=None):
+        # raises QueueBatchError when only a part of the messages was sent
+        raise NotImplementedError
+
+
+class StorageQueueTransport(QueueTransport):
+    """
+    Azure Queue Storage, it has no batch send so a batch is sent
+    message by message over the connection of the cached client
     """
 
-    success = True
+    account_url = "https://functionscdn.queue.core.windows.net"
 
-    try:
-        # Create Queue Client (using DefaultAzureCredential for authentication)
-        account_url = f"https://functionscdn.queue.core.windows.net"
-        default_credential = DefaultAzureCredential()
+    def __init__(self):
+        self._credential = None
 
+    def connect(self, queue_name):
+        if self._credential is None:
+            self._credential = DefaultAzureCredential()
         queue_client = QueueClient(
-            account_url=account_url,
+            account_url=self.account_url,
             queue_name=queue_name,
-            credential=default_credential,
+            credential=self._credential,
         )
-
-        if not isinstance(message, dict):
-            raise ValueError("message must be a dictionary.")
-
         # Setup Base64 encoding and decoding functions
         queue_client.message_encode_policy = BinaryBase64EncodePolicy()
         queue_client.message_decode_policy = BinaryBase64DecodePolicy()
+        return queue_client
 
-        # Encode and send message to queue
-        message_string = json.dumps(message)
-        message_bytes = message_string.encode("utf-8")
-        queue_client.send_message(
-            queue_client.message_encode_policy.encode(content=message_bytes)
+    def is_healthy(self, client):
+        try:
+            client.get_queue_properties()
+            return True
+        except Exception:
+            return False
+
+    def close(self, client):
+        client.close()
+
+    def send_batch(self, client, messages, ttl=None):
+        for sent, message in enumerate(messages):
+            message_bytes = json.dumps(message).encode("utf-8")
+            try:
+                client.send_message(
+                    client.message_encode_policy.encode(content=message_bytes),
+                    time_to_live=ttl,
+                )
+            except Exception as e:
+                raise QueueBatchError(sent, e) from e
+
+
+class ServiceBusTransport(QueueTransport):
+    """
+    Azure Service Bus, messages are packed in ServiceBusMessageBatch
+    up to the size limit of the service
+    """
+
+    fully_qualified_namespace = "trayfoods.servicebus.windows.net"
+    max_batch_size = 100
+
+    def __init__(self):
+        self._credential = None
+
+    def connect(self, queue_name):
+        if self._credential is None:
+            self._credential = DefaultAzureCredential()
+        service_bus_client = ServiceBusClient(
+            credential=self._credential,
+            fully_qualified_namespace=self.fully_qualified_namespace,
         )
+        return service_bus_client, service_bus_client.get_queue_sender(queue_name)
 
-    except Exception as e:
-        success = False
-        logging.exception(f"Error sending message to queue: {e}")
+    def close(self, client):
+        service_bus_client, sender = client
+        sender.close()
+        service_bus_client.close()
+
+    def send_batch(self, client, messages, ttl=None):
+        _, sender = client
+        sent = batch_count = 0
+        try:
+            batch = sender.create_message_batch()
+            for message in messages:
+                message_obj = ServiceBusMessage(json.dumps(message))
+                if ttl:
+                    message_obj.time_to_live = timedelta(seconds=ttl)
+                try:
+                    batch.add_message(message_obj)
+                except MessageSizeExceededError:
+                    # the batch is full, send it and start a new one
+                    sender.send_messages(batch)
+                    sent += batch_count
+                    batch = sender.create_message_batch()
+                    batch.add_message(message_obj)
+                    batch_count = 0
+                batch_count += 1
+            sender.send_messages(batch)
+        except Exception as e:
+            raise QueueBatchError(sent, e) from e
+
+
+class QueueClientRegistry:
+    """
+    Process wide cache of queue clients, one long-lived client per queue name.
+    A cached client is health checked at most every `health_check_interval` seconds
+    and is replaced when the check or a send fails.
+    ```python
+    registry = QueueClientRegistry(StorageQueueTransport())
+    sent = registry.send_messages("new-sms-notification", [message_1, message_2])
+    ```
+    """
+
+    health_check_interval = 60
+
+    def __init__(self, transport: QueueTransport):
+        self.transport = transport
+        self._clients = {}  # queue name -> [client, last health check]
+        self._lock = threading.Lock()
+
+    def get_client(self, queue_name):
+        with self._lock:
+            now = time.monotonic()
+            entry = self._clients.get(queue_name)
+            if entry and now - entry[1] >= self.health_check_interval:
+                if self.transport.is_healthy(entry[0]):
+                    entry[1] = now
+                else:
+                    self._close(queue_name)
+                    entry = None
+            if entry is None:
+                entry = [self.transport.connect(queue_name), now]
+                self._clients[queue_name] = entry
+            return entry[0]
+
+    def _close(self, queue_name):
+        entry = self._clients.pop(queue_name, None)
+        if entry:
+            try:
+                self.transport.close(entry[0])
+            except Exception as e:
+                logging.exception(f"Error closing queue client: {e}")
+
+    def discard(self, queue_name):
+        """
+        Forget the client of a queue, the next send creates a new one
+        """
+        with self._lock:
+            self._close(queue_name)
+
+    def send_messages(self, queue_name, messages, ttl=None):
+        """
+        Send `messages` in batches of `transport.max_batch_size`, in order.
+        Stops at the first failed message and returns the number of messages that were sent
+        """
+        sent = 0
+        batch_size = self.transport.max_batch_size
+        for i in range(0, len(messages), batch_size):
+            batch = messages[i : i + batch_size]
+            try:
+                self.transport.send_batch(self.get_client(queue_name), batch, ttl=ttl)
+            except Exception as e:
+                logging.exception(f"Error sending message to queue: {e}")
+                # the messages sent before the failure must not be sent again
+                sent += getattr(e, "sent", 0)
+                self.discard(queue_name)
+                break
+            sent += len(batch)
+        return sent
+
+
+class InMemoryQueueBackend:
+    """
+    Keeps the messages in memory, used by the tests
+    ```python
+    backend = get_queue_backend("memory")
+    backend.messages["new-sms-notification"] # [{"phone_number": ..., "message": ...}]
+    ```
+    """
+
+    def __init__(self):
+        self.messages = {}
+
+    def send_messages(self, queue_name, messages, ttl=None):
+        queue = self.messages.setdefault(queue_name, [])
+        # store a copy, like a message that went over the wire
+        queue.extend(json.loads(json.dumps(message)) for message in messages)
+        return len(messages)
+
+
+class FileSystemQueueBackend:
+    """
+    Appends the messages to `<QUEUE_FILESYSTEM_DIR>/<queue_name>.jsonl`,
+    one json message per line, for local development without Azure
+    """
 
-    return success
+    def send_messages(self, queue_name, messages, ttl=None):
+        queue_dir = Path(settings.QUEUE_FILESYSTEM_DIR)
+        queue_dir.mkdir(parents=True, exist_ok=True)
+        with open(queue_dir / f"{queue_name}.jsonl", "a") as queue_file:
+            for message in messages:
+                queue_file.write(json.dumps(message) + "\n")
+        return len(messages)
+
+
+QUEUE_BACKENDS = {
+    "azure": lambda: QueueClientRegistry(StorageQueueTransport()),
+    "service-bus": lambda: QueueClientRegistry(ServiceBusTransport()),
+    "memory": InMemoryQueueBackend,
+    "filesystem": FileSystemQueueBackend,
+}
+_queue_backends = {}
+_queue_backends_lock = threading.Lock()
+
+
+def get_queue_backend(name=None):
+    """
+    Get the process wide queue backend, `settings.QUEUE_BACKEND` by default
+    ```python
+    backend = get_queue_backend()
+    sent = backend.send_messages("new-sms-notification", [message_1, message_2])
+    ```
+    """
+    name = name or settings.QUEUE_BACKEND
+    with _queue_backends_lock:
+        if name not in _queue_backends:
+            _queue_backends[name] = QUEUE_BACKENDS[name]()
+    return _queue_backends[name]
+
+
+def send_messages_batch(queue_name, messages, backend=None, ttl=None):
+    """
+    Send a list of messages to a queue with the cached client of the queue,
+    the messages are packed in as few calls as the service allows
+    ```python
+    sent = send_messages_batch("new-sms-notification", [message_1, message_2])
+    print(sent) # 2
+    ```
+    """
+    return get_queue_backend(backend).send_messages(queue_name, messages, ttl=ttl)
+
+
+def send_message_to_queue(message, queue_name):
+    """
+    Sends notification data to a specified queue,
+    Azure Queue Storage unless `settings.QUEUE_BACKEND` says otherwise.
+
+    Args:
+        message (dict): Dictionary containing notification details.
+        queue_name (str): Name of the queue.
+    """
+
+    if not isinstance(message, dict):
+        logging.error("Error sending message to queue: message must be a dictionary.")
+        return False
+
+    return send_messages_batch(queue_name, [message]) == 1
 
 
 def send_message_to_queue_bus(message_dict, queue_name, ttl=None):
-    try:
-        credential = DefaultAzureCredential()
-        service_bus_client = ServiceBusClient(
-            credential=credential,
-            fully_qualified_namespace="trayfoods.servicebus.windows.net",
-            queue_name=queue_name,
-        )
-        # convert the dictionary to a json string
-        message_json = json.dumps(message_dict)
-        message_obj = ServiceBusMessage(message_json)
-
-        if ttl:
-            message_obj.time_to_live = timedelta(seconds=ttl)
-
-        with service_bus_client:
-            sender = service_bus_client.get_queue_sender(queue_name)
-            sender.send_messages(message_obj)
-    except Exception as e:
-        logging.exception(f"Error sending message to queue: {e}")
+    if not send_messages_batch(queue_name, [message_dict], backend="service-bus", ttl=ttl):
+        logging.error(f"Error sending message to queue bus: {queue_name}")
 
 
 def termii_send_otp(to: str):
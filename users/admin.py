@@ -16,6 +16,8 @@ from users.models import (
     UserDevice,
     HostelField,
     DeliveryNotification,
+    NotificationOutbox,
+    LedgerEntry,
 )
 from .forms import HostelForm, StudentForm, StoreForm
 
@@ -226,6 +228,25 @@ class DeliveryPersonAdmin(admin.ModelAdmin):
     readonly_fields = ("profile",)
 
 
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "queue_name", "status", "attempts", "created_at")
+    list_filter = ("status", "queue_name")
+    readonly_fields = ("payload", "attempts", "last_error", "created_at", "sent_at")
+
+
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "wallet", "movement_id", "transaction", "created_at")
+    list_filter = ("account", "direction")
+    search_fields = ("movement_id", "wallet__user__user__username")
+
+    # the ledger is append-only
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 class StudentAdmin(admin.ModelAdmin):
     list_display = ("__str__", "school", "campus", "hostel")
     search_fields = ("user__user__username", "user__user__email")
@@ -279,3 +300,5 @@ admin.site.register(Wallet, WalletAdmin)
 admin.site.register(School, SchoolAdmin)
 admin.site.register(UserDevice)
 admin.site.register(Transaction, TransactionAdmin)
+admin.site.register(NotificationOutbox, NotificationOutboxAdmin)
+admin.site.register(LedgerEntry, LedgerEntryAdmin)
@@ -1,6 +1,6 @@
 from django_filters import FilterSet, NumberFilter, CharFilter
 from users.models import Transaction, Store
-from django.db.models import Q
+from trayapp.search import search_queryset, STORE_SEARCH
 
 
 class TransactionFilter(FilterSet):
@@ -45,6 +45,5 @@ class StoreFilter(FilterSet):
         }
 
     def filter_by_name_nickname(self, queryset, name, value):
-        return queryset.filter(
-            Q(store_name__icontains=value) | Q(store_nickname__icontains=value)
-        )
+        # ranked, typo tolerant search of the store documents, see trayapp.search
+        return search_queryset(queryset, value, STORE_SEARCH)
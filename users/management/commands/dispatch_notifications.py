@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from users.models import NotificationOutbox
+
+
+class Command(BaseCommand):
+    help = "Send the pending notifications of the outbox, including the ones waiting for a retry"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=NotificationOutbox.BATCH_SIZE,
+            help="Number of notifications sent per batch",
+        )
+
+    def handle(self, *args, **kwargs):
+        processed = NotificationOutbox.dispatch_pending(batch_size=kwargs["batch_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully dispatched {processed} notifications")
+        )
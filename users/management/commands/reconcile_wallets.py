@@ -0,0 +1,49 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from users.models import LedgerEntry, Wallet
+
+
+def reconcile_chunk(wallet_ids):
+    try:
+        return LedgerEntry.reconcile(wallet_ids)
+    finally:
+        # every worker thread has its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Check the wallets balance and unsettled transactions against the ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--workers", type=int, default=4, help="Number of chunks checked in parallel"
+        )
+
+    def handle(self, *args, **kwargs):
+        start_time = time.monotonic()
+        chunk_size = kwargs["chunk_size"]
+        wallet_ids = list(Wallet.objects.order_by("pk").values_list("pk", flat=True))
+        chunks = [
+            wallet_ids[start : start + chunk_size]
+            for start in range(0, len(wallet_ids), chunk_size)
+        ]
+
+        mismatches = []
+        with ThreadPoolExecutor(max_workers=kwargs["workers"]) as executor:
+            for chunk_mismatches in executor.map(reconcile_chunk, chunks):
+                mismatches += chunk_mismatches
+
+        for wallet_id, account, value, ledger_value in mismatches:
+            self.stderr.write(
+                f"Wallet {wallet_id} {account}: {value} in the wallet, {ledger_value} in the ledger"
+            )
+        self.stdout.write(
+            f"Checked {len(wallet_ids)} wallets in {time.monotonic() - start_time:.2f}s"
+        )
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} balances do not match the ledger")
+        self.stdout.write(self.style.SUCCESS("Successfully reconciled the wallets"))
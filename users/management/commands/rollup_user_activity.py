@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from users.models import UserActivity
+
+
+class Command(BaseCommand):
+    help = (
+        "Sum the user activities of the last days into the daily rollups, "
+        "then delete the raw activities older than the retention, run it daily"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=2,
+            help="Number of days to roll up, today included",
+        )
+        parser.add_argument(
+            "--retention-days", type=int, default=UserActivity.RETENTION_DAYS
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=UserActivity.PRUNE_CHUNK_SIZE
+        )
+
+    def handle(self, *args, **kwargs):
+        # save what this process still has buffered
+        UserActivity.flush_buffer()
+
+        today = timezone.localdate()
+        # never roll up a day that is already pruned, it would wipe its rollups
+        days = min(kwargs["days"], kwargs["retention_days"])
+        rows = 0
+        for days_ago in range(days):
+            rows += UserActivity.rollup(today - timedelta(days=days_ago))
+
+        deleted = UserActivity.prune(
+            retention_days=kwargs["retention_days"], chunk_size=kwargs["chunk_size"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully rolled up {days} days into {rows} rows "
+                f"and deleted {deleted} old activities"
+            )
+        )
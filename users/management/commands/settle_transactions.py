@@ -1,50 +1,65 @@
+import time
+import logging
+
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
 from users.models import Transaction, Wallet
-import logging
 
 
 class Command(BaseCommand):
     help = "Settle transactions that are older than 24 hours"
-    logging.info("Settle transactions that are older than 24 hours")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hours",
+            type=int,
+            default=24,
+            help="Only settle the transactions older than this, 0 settles all of them",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=Transaction.SETTLE_CHUNK_SIZE,
+            help="Number of transactions settled per database transaction",
+        )
 
     def handle(self, *args, **kwargs):
+        logging.info(f"Settle transactions that are older than {kwargs['hours']} hours")
+        start_time = time.monotonic()
+
         # Calculate the time for 24 hours ago
-        time_threshold = timezone.now() - timedelta(hours=24)
+        time_threshold = None
+        if kwargs["hours"]:
+            time_threshold = timezone.now() - timedelta(hours=kwargs["hours"])
 
-        # Find all unsettled transactions older than 24 hours
-        unsettled_transactions = Transaction.objects.filter(
-            status="unsettled", 
-            # created_at__lte=time_threshold
+        settled = Transaction.settle_unsettled(
+            created_before=time_threshold, chunk_size=kwargs["chunk_size"]
         )
+        settle_time = time.monotonic() - start_time
 
-        # Update those transactions to 'settled'
-        transactions_grouped_by_wallet = (
-            []
-        )  # {"wallet": transaction.wallet.id, "amount": transaction.amount}
-        for transaction in unsettled_transactions:
-            transaction.settle()
-            # add the wallet if it doesn't exist in the list
-            # then keep adding the amount to the wallet in the list
-            # no duplicate wallet in the list
-            wallet: Wallet = transaction.wallet
-            amount = transaction.amount
-            if not any(
-                transaction["wallet"] == wallet
-                for transaction in transactions_grouped_by_wallet
-            ):
-                transactions_grouped_by_wallet.append(
-                    {"wallet": wallet, "amount": amount}
+        # one alert per wallet for all its transactions settled
+        wallets = Wallet.objects.select_related("user__user").in_bulk(list(settled))
+        for wallet_id, wallet_settled in settled.items():
+            wallet: Wallet = wallets.get(wallet_id)
+            if wallet is None:
+                continue
+            amount, count = wallet_settled["amount"], wallet_settled["count"]
+            try:
+                wallet.user.notify_me(
+                    title="Transactions Settled",
+                    message=f"{count} transaction{'s' if count > 1 else ''} settled, "
+                    f"{amount} {wallet.currency} has been credited to your wallet main balance",
+                    data={"amount": str(amount)},
                 )
-            else:
-                for transaction in transactions_grouped_by_wallet:
-                    if transaction["wallet"] == wallet:
-                        transaction["amount"] += amount
-
-        # notify the user of the transactions settled
-        for transaction in transactions_grouped_by_wallet:
-            wallet: Wallet = transaction["wallet"]
-            wallet.send_wallet_alert(transaction["amount"])
+            except Exception as e:
+                logging.exception(f"Error sending the settlement alert of wallet {wallet_id}: {e}")
 
+        transactions_count = sum(row["count"] for row in settled.values())
+        total_amount = sum(row["amount"] for row in settled.values())
+        self.stdout.write(
+            f"Settled {transactions_count} transactions ({total_amount}) for "
+            f"{len(settled)} wallets in {settle_time:.2f}s, "
+            f"{transactions_count / settle_time if settle_time else 0:.0f} transactions/s"
+        )
         self.stdout.write(self.style.SUCCESS("Successfully settled transactions"))
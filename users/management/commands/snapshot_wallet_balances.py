@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from users.models import WalletBalanceSnapshot
+
+
+class Command(BaseCommand):
+    help = "Snapshot the ledger balances of the wallets that changed since their latest snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **kwargs):
+        taken = WalletBalanceSnapshot.take(chunk_size=kwargs["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Successfully took {taken} snapshots"))
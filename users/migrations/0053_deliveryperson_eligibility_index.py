@@ -0,0 +1,98 @@
+# Generated by Django 3.2.23 on 2026-10-18 06:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_countries.fields
+
+
+def backfill_eligibility_index(apps, schema_editor):
+    DeliveryPerson = apps.get_model("users", "DeliveryPerson")
+    Student = apps.get_model("users", "Student")
+    DeliveryNotification = apps.get_model("users", "DeliveryNotification")
+    OrderStore = apps.get_model("product", "OrderStore")
+
+    for delivery_person in DeliveryPerson.objects.select_related("profile"):
+        profile = delivery_person.profile
+        student = Student.objects.filter(user=profile).first()
+        delivery_person.is_student = student is not None
+        delivery_person.country = profile.country
+        delivery_person.state = profile.state
+        delivery_person.city = profile.city
+        delivery_person.school_id = student.school_id if student else None
+        delivery_person.campus = student.campus if student else None
+        delivery_person.gender_id = profile.gender_id
+        delivery_person.in_flight_notifications_count = (
+            DeliveryNotification.objects.filter(
+                delivery_person=delivery_person, status__in=["pending", "processing"]
+            ).count()
+        )
+        delivery_person.active_orders_count = OrderStore.objects.filter(
+            delivery_person=delivery_person,
+            delivery_person_status__in=["pending", "out-for-delivery", "returned"],
+        ).count()
+        delivery_person.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0052_alter_wallet_passcode'),
+        ('product', '0057_orderstore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='active_orders_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='campus',
+            field=models.CharField(blank=True, editable=False, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='city',
+            field=models.CharField(blank=True, editable=False, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='country',
+            field=django_countries.fields.CountryField(blank=True, editable=False, max_length=2, null=True),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='gender',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='users.gender'),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='in_flight_notifications_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='is_student',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='school',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='users.school'),
+        ),
+        migrations.AddField(
+            model_name='deliveryperson',
+            name='state',
+            field=models.CharField(blank=True, editable=False, max_length=50, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryperson',
+            index=models.Index(fields=['status', 'is_approved', 'country', 'state', 'city'], name='users_deliv_status_ce6384_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryperson',
+            index=models.Index(fields=['status', 'is_approved', 'school', 'campus', 'gender'], name='users_deliv_status_ad5cae_idx'),
+        ),
+        migrations.RunPython(backfill_eligibility_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.23 on 2026-10-18 06:56
+
+import math
+
+from django.db import migrations, models
+
+
+def backfill_geo_cell(apps, schema_editor):
+    # same grid as Store.get_geo_cell, 0.05 degree cells numbered row by row
+    Store = apps.get_model("users", "Store")
+    stores = list(
+        Store.objects.filter(
+            primary_address_lat__isnull=False, primary_address_lng__isnull=False
+        ).only("id", "primary_address_lat", "primary_address_lng")
+    )
+    for store in stores:
+        row = int(math.floor((store.primary_address_lat + 90) / 0.05))
+        row = min(max(row, 0), 3599)
+        column = int(math.floor((store.primary_address_lng + 180) / 0.05)) % 7200
+        store.geo_cell = row * 7200 + column
+    Store.objects.bulk_update(stores, ["geo_cell"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0054_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='geo_cell',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='store',
+            index=models.Index(fields=['geo_cell'], name='users_store_geo_cel_6df555_idx'),
+        ),
+        migrations.RunPython(backfill_geo_cell, migrations.RunPython.noop),
+    ]
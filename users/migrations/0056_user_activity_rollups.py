@@ -0,0 +1,79 @@
+# Generated by Django 3.2.23 on 2026-10-18 07:15
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0058_item_ratings_aggregates'),
+        ('users', '0055_store_geo_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_type', models.CharField(choices=[('view', 'view'), ('added_to_cart', 'added_to_cart'), ('purchased', 'purchased'), ('add_to_items', 'add_to_items'), ('remove_from_order', 'remove_from_order'), ('add_to_order', 'add_to_order'), ('remove_from_items', 'remove_from_items')], max_length=20)),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserActivityRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.PositiveIntegerField()),
+                ('activity_type', models.CharField(choices=[('view', 'view'), ('added_to_cart', 'added_to_cart'), ('purchased', 'purchased'), ('add_to_items', 'add_to_items'), ('remove_from_order', 'remove_from_order'), ('add_to_order', 'add_to_order'), ('remove_from_items', 'remove_from_items')], max_length=20)),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='useractivity',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['user_id', 'timestamp'], name='users_usera_user_id_bd4c6e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=models.Index(fields=['item', 'activity_type', 'timestamp'], name='users_usera_item_id_f208c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivity',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['timestamp'], name='users_useractivity_ts_brin'),
+        ),
+        migrations.AddField(
+            model_name='useractivityrollup',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.item'),
+        ),
+        migrations.AddField(
+            model_name='itemactivityrollup',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='product.item'),
+        ),
+        migrations.AddIndex(
+            model_name='useractivityrollup',
+            index=models.Index(fields=['day'], name='users_usera_day_38444c_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='useractivityrollup',
+            unique_together={('user_id', 'item', 'activity_type', 'day')},
+        ),
+        migrations.AddIndex(
+            model_name='itemactivityrollup',
+            index=models.Index(fields=['day', 'activity_type'], name='users_itema_day_4a76a4_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='itemactivityrollup',
+            unique_together={('item', 'activity_type', 'day')},
+        ),
+    ]
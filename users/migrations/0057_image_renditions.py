@@ -0,0 +1,23 @@
+# Generated by Django 3.2.23 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0056_user_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='store_cover_image_renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 3.2.23 on 2026-10-18 07:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from decimal import Decimal
+
+
+def post_opening_balances(apps, schema_editor):
+    # the ledger starts from the balances the wallets have now
+    Wallet = apps.get_model("users", "Wallet")
+    Transaction = apps.get_model("users", "Transaction")
+    LedgerEntry = apps.get_model("users", "LedgerEntry")
+
+    unsettled = dict(
+        Transaction.objects.filter(status="unsettled")
+        .order_by()
+        .values("wallet_id")
+        .annotate(total=models.Sum("amount"))
+        .values_list("wallet_id", "total")
+    )
+    entries = []
+    for wallet_id, balance in Wallet.objects.values_list("id", "balance").iterator():
+        for account, amount in (
+            ("available", balance or Decimal("0.00")),
+            ("unsettled", unsettled.get(wallet_id) or Decimal("0.00")),
+        ):
+            if not amount:
+                continue
+            movement_id = uuid.uuid4()
+            debit, credit = ("opening", None), (account, wallet_id)
+            if amount < 0:
+                debit, credit, amount = credit, debit, -amount
+            for direction, (entry_account, entry_wallet_id) in (
+                ("debit", debit),
+                ("credit", credit),
+            ):
+                entries.append(
+                    LedgerEntry(
+                        movement_id=movement_id,
+                        wallet_id=entry_wallet_id,
+                        account=entry_account,
+                        direction=direction,
+                        amount=amount,
+                        desc="Opening balance",
+                    )
+                )
+        if len(entries) >= 1000:
+            LedgerEntry.objects.bulk_create(entries)
+            entries = []
+    LedgerEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0058_search_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available', models.DecimalField(decimal_places=2, editable=False, max_digits=12)),
+                ('unsettled', models.DecimalField(decimal_places=2, editable=False, max_digits=12)),
+                ('taken_at', models.DateTimeField(editable=False)),
+                ('wallet', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='users.wallet')),
+            ],
+            options={
+                'ordering': ['-taken_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_id', models.UUIDField(db_index=True, default=uuid.uuid4, editable=False)),
+                ('account', models.CharField(choices=[('available', 'available'), ('unsettled', 'unsettled'), ('clearing', 'clearing'), ('payouts', 'payouts'), ('refunds', 'refunds'), ('holds', 'holds'), ('opening', 'opening')], editable=False, max_length=20)),
+                ('direction', models.CharField(choices=[('debit', 'debit'), ('credit', 'credit')], editable=False, max_length=6)),
+                ('amount', models.DecimalField(decimal_places=2, editable=False, max_digits=12)),
+                ('desc', models.CharField(blank=True, editable=False, max_length=200, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('transaction', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='users.transaction')),
+                ('wallet', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='users.wallet')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='walletbalancesnapshot',
+            index=models.Index(fields=['wallet', '-taken_at'], name='users_walle_wallet__1bac8e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['wallet', 'account', 'created_at'], name='users_ledge_wallet__d2e818_idx'),
+        ),
+        migrations.RunPython(post_opening_balances, migrations.RunPython.noop),
+    ]
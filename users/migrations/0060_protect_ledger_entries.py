@@ -0,0 +1,24 @@
+# Generated by Django 3.2.23 on 2026-10-18 08:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0059_wallet_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='transaction',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='users.transaction'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='wallet',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, to='users.wallet'),
+        ),
+    ]
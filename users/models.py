@@ -4,13 +4,19 @@ from django.core.mail import EmailMultiAlternatives
 from django.template.loader import get_template
 from django.db import transaction as djtransac
 
+import copy
+import math
 import uuid
 import pytz
 import logging
+import threading
 
 from django.utils import timezone
 
 from django.db import models
+from django.contrib.postgres.indexes import BrinIndex, GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from trayapp.search import SearchDocumentField, schedule_search_update
 # from django.contrib.gis.db import models as gis_models
 # from sympy import Point
 
@@ -24,14 +30,19 @@ from django.utils.translation import gettext_lazy as _
 from django.template.defaultfilters import slugify
 from django.db.models.signals import post_save
 from users.signals import balance_updated
-from trayapp.utils import image_resized, image_exists, termii_send_otp
+from trayapp.utils import termii_send_otp
+from trayapp.images import (
+    get_stored_image_name,
+    image_has_changed,
+    schedule_image_processing,
+)
 
-from product.models import Item, Order
+from product.models import Item, Order, OrderStore
 
 from datetime import datetime
 from django.conf import settings
 
-from trayapp.utils import send_message_to_queue
+from trayapp.request_memo import request_memo, clear_request_memo
 from django.contrib.auth.hashers import check_password, make_password
 from django.core.exceptions import ValidationError
 
@@ -78,6 +89,10 @@ class UserAccount(AbstractUser, models.Model):
 
     @property
     def roles(self):
+        # roles are read by most resolvers, so they are worked out once per request
+        return request_memo(("roles", self.id), self.get_roles)
+
+    def get_roles(self):
         # check user's roles
         profile = Profile.objects.filter(user=self).first()
         is_student = profile.is_student if profile else False
@@ -180,6 +195,152 @@ class UserDevice(models.Model):
         return f"{self.user.username}'s {self.device_type}"
 
 
+class NotificationOutbox(models.Model):
+    """
+    Notifications (sms, push, email, delivery requests) waiting to be sent.
+    Rows are written inside the request and sent in batches per queue by
+    `dispatch()`, from the OutboxDispatcherThread or the dispatch_notifications command.
+    """
+
+    EMAIL_QUEUE = "email"
+    STATUS = (
+        ("pending", "pending"),
+        ("sent", "sent"),
+        ("failed", "failed"),
+    )
+    BATCH_SIZE = 100
+    MAX_ATTEMPTS = 5
+    # seconds before the first retry, doubled after every failed attempt
+    RETRY_DELAY = 30
+
+    queue_name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.queue_name} #{self.id} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, queue_name, payload):
+        """
+        Add a message to the outbox, it is sent once the current transaction commits
+        ```python
+        NotificationOutbox.enqueue("new-sms-notification", {"phone_number": ..., "message": ...})
+        ```
+        """
+        outbox = cls.objects.create(queue_name=queue_name, payload=payload)
+        if settings.NOTIFICATION_OUTBOX_AUTO_DISPATCH:
+            from users.threads import OutboxDispatcherThread
+
+            djtransac.on_commit(OutboxDispatcherThread.wake_up)
+        return outbox
+
+    @staticmethod
+    def send_emails(messages):
+        """
+        Send the email payloads over one connection, returns the number of emails sent
+        """
+        from django.core.mail import get_connection
+
+        sent = 0
+        with get_connection() as connection:
+            for message in messages:
+                msg = EmailMultiAlternatives(
+                    message["subject"],
+                    message["text_content"],
+                    message["from_email"],
+                    message["to"],
+                    connection=connection,
+                )
+                if message.get("html_content"):
+                    msg.attach_alternative(message["html_content"], "text/html")
+                try:
+                    msg.send()
+                except Exception as e:
+                    logging.exception(f"Error sending email: {e}")
+                    break
+                sent += 1
+        return sent
+
+    @classmethod
+    def dispatch(cls, batch_size=None):
+        """
+        Send one batch of due messages, grouped by queue,
+        returns the number of rows that were processed
+        """
+        from trayapp.utils import send_messages_batch
+
+        now = timezone.now()
+        with djtransac.atomic():
+            outboxes = list(
+                cls.objects.select_for_update(skip_locked=True).filter(
+                    status="pending", next_attempt_at__lte=now
+                )[: batch_size or cls.BATCH_SIZE]
+            )
+
+            outboxes_by_queue = {}
+            for outbox in outboxes:
+                outboxes_by_queue.setdefault(outbox.queue_name, []).append(outbox)
+
+            sent_ids = []
+            failed_outboxes = []
+            for queue_name, queue_outboxes in outboxes_by_queue.items():
+                messages = [outbox.payload for outbox in queue_outboxes]
+                try:
+                    if queue_name == cls.EMAIL_QUEUE:
+                        sent = cls.send_emails(messages)
+                    else:
+                        sent = send_messages_batch(queue_name, messages)
+                except Exception as e:
+                    logging.exception(f"Error sending to {queue_name}: {e}")
+                    sent = 0
+                sent_ids += [outbox.id for outbox in queue_outboxes[:sent]]
+                failed_outboxes += queue_outboxes[sent:]
+
+            if sent_ids:
+                cls.objects.filter(id__in=sent_ids).update(status="sent", sent_at=now)
+
+            # retry later with an exponential backoff
+            for outbox in failed_outboxes:
+                outbox.attempts += 1
+                outbox.last_error = f"could not send to {outbox.queue_name}"
+                outbox.next_attempt_at = now + timezone.timedelta(
+                    seconds=cls.RETRY_DELAY * 2 ** (outbox.attempts - 1)
+                )
+                if outbox.attempts >= cls.MAX_ATTEMPTS:
+                    outbox.status = "failed"
+            if failed_outboxes:
+                cls.objects.bulk_update(
+                    failed_outboxes,
+                    ["attempts", "last_error", "next_attempt_at", "status"],
+                )
+
+        return len(outboxes)
+
+    @classmethod
+    def dispatch_pending(cls, batch_size=None):
+        """
+        Send every due message, batch after batch, returns the number of rows processed
+        """
+        processed = 0
+        while True:
+            count = cls.dispatch(batch_size)
+            processed += count
+            if count < (batch_size or cls.BATCH_SIZE):
+                return processed
+
+
 class School(models.Model):
     name = models.CharField(max_length=50)
     slug = models.SlugField(max_length=50, null=True, blank=True, unique=True)
@@ -288,30 +449,30 @@ class Profile(models.Model):
     gender = models.ForeignKey(Gender, on_delete=models.SET_NULL, null=True, blank=True)
     phone_number_verified = models.BooleanField(default=False, editable=False)
     has_required_fields = models.BooleanField(default=False, editable=False)
+    # the sized WebP and JPEG copies of the image, see trayapp.images
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the stored image, tells a new upload apart without a query
+        self._original_image_name = get_stored_image_name(self, "image")
 
     def __str__(self) -> str:
         return self.user.username
 
     def save(self, *args, **kwargs):
-        # Resize the image before saving
-        if self.image and (not self.pk or self.image_has_changed()):
-            w, h = 300, 300  # Set the desired width and height for the resized image
-            if image_exists(self.image.name):
-                img_file, _, _, _ = image_resized(self.image, w, h)
-                if img_file:
-                    img_name = self.image.name
-                    self.image.save(img_name, img_file, save=False)
+        # the upload is stored as it is, its renditions are made off the request,
+        # the renditions of a cleared image are dropped
+        if image_has_changed(self.image, self._original_image_name):
+            self.image_renditions = {}
+            if self.image:
+                schedule_image_processing()
 
         if self.phone_number:
             self.clean_phone_number(self.phone_number)
 
         super().save(*args, **kwargs)
-
-    def image_has_changed(self):
-        if not self.pk:
-            return True
-        old_image = Profile.objects.get(pk=self.pk).image
-        return old_image != self.image
+        self._original_image_name = self.image.name if self.image else None
 
     def has_calling_code(self):
         calling_code = self.calling_code
@@ -484,9 +645,8 @@ class Profile(models.Model):
                     "type": "plain",
                     "from": "N-Alert",
                 }
-                return send_message_to_queue(
-                    message=queue_data, queue_name="new-sms-notification"
-                )
+                NotificationOutbox.enqueue("new-sms-notification", queue_data)
+                return True
 
             if not SMS_ENABLED:
                 logging.error("SMS is disabled")
@@ -527,9 +687,8 @@ class Profile(models.Model):
             "message": message,
             "data": data,
         }
-        return send_message_to_queue(
-            message=queue_data, queue_name="new-push-notification"
-        )
+        NotificationOutbox.enqueue("new-push-notification", queue_data)
+        return True
 
     def notify_me(self, title, message, data=None, skip_email=False):
         # if not self.send_push_notification(title, message, data):
@@ -557,7 +716,7 @@ class Profile(models.Model):
     ):
         try:
             subject, from_email, to = subject, from_email, self.user.email
-            msg = EmailMultiAlternatives(subject, text_content, from_email, [to])
+            html_content = None
             if template:
                 html_content = get_template(template).render(
                     {
@@ -567,8 +726,16 @@ class Profile(models.Model):
                     },
                 )
 
-                msg.attach_alternative(html_content, "text/html")
-            msg.send()
+            NotificationOutbox.enqueue(
+                NotificationOutbox.EMAIL_QUEUE,
+                {
+                    "subject": subject,
+                    "from_email": from_email,
+                    "to": [to],
+                    "text_content": text_content,
+                    "html_content": html_content,
+                },
+            )
             return True
         except:
             return False
@@ -629,6 +796,9 @@ class Transaction(models.Model):
     settlement_date = models.DateTimeField(null=True, blank=True, editable=False)
     _type = models.CharField(max_length=20, choices=TYPE_OF_TRANSACTION)
 
+    # number of transactions settled per database transaction
+    SETTLE_CHUNK_SIZE = 500
+
     class Meta:
         ordering = ["-created_at", "-updated_on"]
 
@@ -663,6 +833,13 @@ class Transaction(models.Model):
                 Wallet.objects.filter(pk=transaction_with_related.wallet.pk).update(
                     balance=models.F("balance") + transaction_with_related.amount
                 )
+                LedgerEntry.post(
+                    ("unsettled", transaction_with_related.wallet),
+                    ("available", transaction_with_related.wallet),
+                    transaction_with_related.amount,
+                    transaction=self,
+                    desc="Settlement",
+                )
 
                 # Update transaction status
                 Transaction.objects.filter(pk=self.pk).update(
@@ -680,6 +857,80 @@ class Transaction(models.Model):
             # Log or re-raise a specific error
             raise ValidationError(f"Settlement failed: {str(e)}")
 
+    @classmethod
+    def settle_unsettled(cls, created_before=None, chunk_size=SETTLE_CHUNK_SIZE):
+        """
+        Settle the unsettled transactions chunk by chunk, each chunk credits every
+        wallet with one UPDATE and marks its transactions settled with one UPDATE.
+        Returns {wallet_id: {"amount": ..., "count": ...}} of what was settled
+        ```python
+        Transaction.settle_unsettled(created_before=timezone.now() - timezone.timedelta(hours=24))
+        ```
+        """
+        from django.db.models.functions import Coalesce
+
+        settled = {}
+        last_pk = 0
+        while True:
+            with djtransac.atomic():
+                transactions = cls.objects.filter(status="unsettled", pk__gt=last_pk)
+                if created_before is not None:
+                    transactions = transactions.filter(created_at__lte=created_before)
+                # the rows being settled by another run are skipped
+                rows = list(
+                    transactions.select_for_update(skip_locked=True)
+                    .order_by("pk")
+                    .values_list("pk", "wallet_id", "amount")[:chunk_size]
+                )
+                if not rows:
+                    break
+
+                amounts = {}
+                for pk, wallet_id, amount in rows:
+                    amounts[wallet_id] = amounts.get(wallet_id, Decimal("0.00")) + amount
+
+                # lock the wallets in the same order as the other writers would wait
+                wallets = Wallet.objects.filter(pk__in=amounts)
+                list(wallets.select_for_update().order_by("pk").values_list("pk"))
+                wallets.update(
+                    balance=models.Case(
+                        *[
+                            models.When(
+                                pk=wallet_id,
+                                then=Coalesce(models.F("balance"), Decimal("0.00"))
+                                + amount,
+                            )
+                            for wallet_id, amount in amounts.items()
+                        ],
+                        output_field=models.DecimalField(),
+                    )
+                )
+                cls.objects.filter(pk__in=[row[0] for row in rows]).update(
+                    status="settled", settlement_date=timezone.now()
+                )
+                LedgerEntry.objects.bulk_create(
+                    [
+                        entry
+                        for pk, wallet_id, amount in rows
+                        for entry in LedgerEntry.make_movement(
+                            ("unsettled", Wallet(pk=wallet_id)),
+                            ("available", Wallet(pk=wallet_id)),
+                            amount,
+                            transaction=cls(pk=pk),
+                            desc="Settlement",
+                        )
+                    ]
+                )
+
+            for pk, wallet_id, amount in rows:
+                wallet_settled = settled.setdefault(
+                    wallet_id, {"amount": Decimal("0.00"), "count": 0}
+                )
+                wallet_settled["amount"] += amount
+                wallet_settled["count"] += 1
+            last_pk = rows[-1][0]
+        return settled
+
     def settle_x(self):
         if self.status == "unsettled":
             now = timezone.now()
@@ -694,6 +945,13 @@ class Transaction(models.Model):
                     Wallet.objects.filter(pk=self.wallet.pk).update(
                         balance=models.F("balance") + self.amount
                     )
+                    LedgerEntry.post(
+                        ("unsettled", self.wallet),
+                        ("available", self.wallet),
+                        self.amount,
+                        transaction=self,
+                        desc="Settlement",
+                    )
 
 
 @receiver(post_save, sender=Transaction)
@@ -731,6 +989,19 @@ def handle_transaction_settlement(sender, instance: Transaction, created, **kwar
         )
 
 
+@receiver(post_save, sender=Transaction)
+def post_unsettled_transaction(sender, instance, created, **kwargs):
+    # the order payments wait in the unsettled account until they are settled
+    if created and instance.status == "unsettled":
+        LedgerEntry.post(
+            ("clearing", None),
+            ("unsettled", instance.wallet),
+            instance.amount,
+            transaction=instance,
+            desc=instance.title,
+        )
+
+
 @receiver(post_save, sender=Transaction)
 def set_settlement_date(sender, instance, created, **kwargs):
     if created:
@@ -776,10 +1047,18 @@ class Wallet(models.Model):
         super().save(*args, **kwargs)
 
     def get_unsettled_balance(self):
-        # Use aggregation instead of looping through transactions
-        return Transaction.objects.filter(wallet=self, status="unsettled").aggregate(
-            total=models.Sum("amount")
-        )["total"] or Decimal("0.00")
+        # read from the ledger instead of summing all the unsettled transactions
+        return self.get_ledger_balance("unsettled")
+
+    def get_ledger_balance(self, account="available", at=None):
+        """
+        Balance of the wallet account from the ledger, at `at` or now
+        e.g
+        ```
+        wallet.get_ledger_balance(at=timezone.now() - timezone.timedelta(days=30))
+        ```
+        """
+        return LedgerEntry.get_balances([self.pk], at=at)[(self.pk, account)]
 
     # set passcode for wallet
     def set_passcode(self, passcode):
@@ -863,6 +1142,15 @@ class Wallet(models.Model):
                 order=order,
                 _type="credit",
             )
+            # the unsettled order payments are posted by post_unsettled_transaction
+            if not order:
+                LedgerEntry.post(
+                    ("clearing", None),
+                    ("available", self),
+                    amount,
+                    transaction=new_transaction,
+                    desc=title,
+                )
 
             # Notify user
             self.user.notify_me(
@@ -918,6 +1206,14 @@ class Wallet(models.Model):
                     )
                     self.refresh_from_db()
 
+                    LedgerEntry.post(
+                        ("available", self),
+                        ("refunds", None),
+                        total_amount,
+                        transaction=order_transaction,
+                        desc=title,
+                    )
+
                     # Update the order transaction
                     Transaction.objects.filter(pk=order_transaction.pk).update(
                         amount=total_amount, status="success", _type=_type
@@ -941,6 +1237,13 @@ class Wallet(models.Model):
                 transaction_result = Transaction.objects.select_for_update().get(
                     wallet=self, transaction_id=transaction_id, _type="debit"
                 )
+                LedgerEntry.post(
+                    ("available", self),
+                    ("payouts", None),
+                    total_amount,
+                    transaction=transaction_result,
+                    desc=title,
+                )
 
                 Transaction.objects.filter(pk=transaction_result.pk).update(
                     title=title, order=order, desc=desc, status=status
@@ -990,6 +1293,13 @@ class Wallet(models.Model):
                         balance=models.F("balance") + amount
                     )
                     wallet.refresh_from_db()
+                    LedgerEntry.post(
+                        ("payouts", None),
+                        ("available", self),
+                        amount,
+                        transaction=transaction_obj,
+                        desc=title,
+                    )
 
             # Create or update transaction
             if transaction_id and not transaction_obj:
@@ -1049,6 +1359,22 @@ class Wallet(models.Model):
                     balance=models.F("balance") - transaction_obj.amount
                 )
                 wallet.refresh_from_db()
+                LedgerEntry.post(
+                    ("available", self),
+                    ("holds", None),
+                    transaction_obj.amount,
+                    transaction=transaction_obj,
+                    desc="On hold",
+                )
+            elif transaction_obj.status == "unsettled":
+                # the payment will not be settled
+                LedgerEntry.post(
+                    ("unsettled", self),
+                    ("holds", None),
+                    transaction_obj.amount,
+                    transaction=transaction_obj,
+                    desc="On hold",
+                )
 
             # Update transaction status
             Transaction.objects.filter(pk=transaction_obj.pk).update(
@@ -1082,6 +1408,272 @@ class Wallet(models.Model):
         self.user.send_sms(message)
 
 
+class LedgerEntry(models.Model):
+    """
+    Append-only double-entry ledger of the wallet movements, every movement is
+    a debit leg and a credit leg of the same amount sharing a `movement_id`.
+    The "available" and "unsettled" accounts belong to a wallet, the others are
+    the platform side of the movements.
+    The balance of an account is its credits minus its debits, see `get_balances`.
+    ```python
+    LedgerEntry.post(("clearing", None), ("available", wallet), Decimal(100))
+    ```
+    """
+
+    WALLET_ACCOUNTS = ("available", "unsettled")
+    ACCOUNTS = (
+        # the wallet balance
+        ("available", "available"),
+        # the order payments waiting for settlement
+        ("unsettled", "unsettled"),
+        # the money paid in, eg: the order payments
+        ("clearing", "clearing"),
+        ("payouts", "payouts"),
+        ("refunds", "refunds"),
+        ("holds", "holds"),
+        # the balances the wallets had when the ledger started
+        ("opening", "opening"),
+    )
+    DIRECTIONS = (
+        ("debit", "debit"),
+        ("credit", "credit"),
+    )
+
+    movement_id = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
+    # the entries are never removed by a delete of their wallet or transaction
+    wallet = models.ForeignKey(
+        "Wallet", on_delete=models.PROTECT, null=True, blank=True, editable=False
+    )
+    account = models.CharField(max_length=20, choices=ACCOUNTS, editable=False)
+    direction = models.CharField(max_length=6, choices=DIRECTIONS, editable=False)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, editable=False)
+    transaction = models.ForeignKey(
+        Transaction, on_delete=models.PROTECT, null=True, blank=True, editable=False
+    )
+    desc = models.CharField(max_length=200, null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        ordering = ["created_at", "id"]
+        indexes = [
+            models.Index(fields=["wallet", "account", "created_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.direction} {self.account} {self.amount}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError("Ledger entries cannot be changed, post a new movement")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Ledger entries cannot be deleted, post a new movement")
+
+    @classmethod
+    def make_movement(cls, debit, credit, amount, transaction=None, desc=None):
+        """
+        The two legs of a movement, `debit` and `credit` are (account, wallet)
+        """
+        amount = Decimal(amount)
+        if amount < 0:
+            debit, credit, amount = credit, debit, -amount
+        movement_id = uuid.uuid4()
+        now = timezone.now()
+        return [
+            cls(
+                movement_id=movement_id,
+                account=account,
+                wallet=wallet,
+                direction=direction,
+                amount=amount,
+                transaction=transaction,
+                desc=desc,
+                created_at=now,
+            )
+            for direction, (account, wallet) in (("debit", debit), ("credit", credit))
+        ]
+
+    @classmethod
+    def post(cls, debit, credit, amount, transaction=None, desc=None):
+        """
+        Record a movement, call it in the database transaction that changes the balance
+        """
+        if not amount:
+            return []
+        return cls.objects.bulk_create(
+            cls.make_movement(debit, credit, amount, transaction, desc)
+        )
+
+    @staticmethod
+    def get_signed_amount():
+        return models.Sum(
+            models.Case(
+                models.When(direction="credit", then=models.F("amount")),
+                default=-models.F("amount"),
+                output_field=models.DecimalField(),
+            )
+        )
+
+    @classmethod
+    def get_balances(cls, wallet_ids, at=None):
+        """
+        Return {(wallet_id, account): balance} of the wallet accounts at `at` (now by
+        default), read from the latest snapshot plus the entries posted after it
+        """
+        wallet_ids = list(wallet_ids)
+        balances = {
+            (wallet_id, account): Decimal("0.00")
+            for wallet_id in wallet_ids
+            for account in cls.WALLET_ACCOUNTS
+        }
+        snapshots = WalletBalanceSnapshot.get_latest(wallet_ids, at=at)
+
+        # one query per snapshot time, the snapshots of a run share their time
+        wallets_by_snapshot_time = {}
+        for wallet_id in wallet_ids:
+            snapshot = snapshots.get(wallet_id)
+            taken_at = snapshot.taken_at if snapshot else None
+            wallets_by_snapshot_time.setdefault(taken_at, []).append(wallet_id)
+            if snapshot:
+                balances[(wallet_id, "available")] = snapshot.available
+                balances[(wallet_id, "unsettled")] = snapshot.unsettled
+
+        for taken_at, snapshot_wallet_ids in wallets_by_snapshot_time.items():
+            entries = cls.objects.filter(
+                wallet_id__in=snapshot_wallet_ids, account__in=cls.WALLET_ACCOUNTS
+            )
+            if taken_at is not None:
+                entries = entries.filter(created_at__gt=taken_at)
+            if at is not None:
+                entries = entries.filter(created_at__lte=at)
+            for row in (
+                entries.order_by()
+                .values("wallet_id", "account")
+                .annotate(total=cls.get_signed_amount())
+            ):
+                balances[(row["wallet_id"], row["account"])] += row["total"]
+        return balances
+
+    @classmethod
+    def reconcile(cls, wallet_ids):
+        """
+        Compare the wallets balance and unsettled transactions with the ledger,
+        returns the mismatches as [(wallet_id, account, wallet value, ledger value)]
+        """
+        from django.db import connection
+
+        outermost = not connection.in_atomic_block
+        with djtransac.atomic():
+            if connection.vendor == "postgresql" and outermost:
+                # the wallets and the ledger are read from the same snapshot
+                with connection.cursor() as cursor:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            expected = {}
+            for wallet_id, balance in Wallet.objects.filter(pk__in=wallet_ids).values_list(
+                "pk", "balance"
+            ):
+                expected[(wallet_id, "available")] = balance or Decimal("0.00")
+                expected[(wallet_id, "unsettled")] = Decimal("0.00")
+            for wallet_id, total in (
+                Transaction.objects.filter(wallet_id__in=wallet_ids, status="unsettled")
+                .order_by()
+                .values("wallet_id")
+                .annotate(total=models.Sum("amount"))
+                .values_list("wallet_id", "total")
+            ):
+                expected[(wallet_id, "unsettled")] = total
+            balances = cls.get_balances({wallet_id for wallet_id, _ in expected})
+
+        return [
+            (wallet_id, account, value, balances[(wallet_id, account)])
+            for (wallet_id, account), value in sorted(expected.items())
+            if value != balances[(wallet_id, account)]
+        ]
+
+
+class WalletBalanceSnapshot(models.Model):
+    """
+    Balances of a wallet accounts made of the ledger entries created up to `taken_at`,
+    they are taken by the snapshot_wallet_balances command so a balance is read
+    from its latest snapshot plus a short tail of entries
+    """
+
+    # the entries of the last minute are left out, an entry of a database
+    # transaction that is still running gets its created_at before it commits
+    SNAPSHOT_LAG = 60
+
+    wallet = models.ForeignKey("Wallet", on_delete=models.CASCADE, editable=False)
+    available = models.DecimalField(max_digits=12, decimal_places=2, editable=False)
+    unsettled = models.DecimalField(max_digits=12, decimal_places=2, editable=False)
+    taken_at = models.DateTimeField(editable=False)
+
+    class Meta:
+        ordering = ["-taken_at"]
+        indexes = [
+            models.Index(fields=["wallet", "-taken_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.wallet_id} at {self.taken_at}"
+
+    @classmethod
+    def get_latest(cls, wallet_ids, at=None):
+        # {wallet_id: latest snapshot taken before `at`}
+        latest = cls.objects.filter(wallet_id=models.OuterRef("wallet_id"))
+        if at is not None:
+            latest = latest.filter(taken_at__lte=at)
+        snapshots = cls.objects.filter(
+            wallet_id__in=wallet_ids,
+            id=models.Subquery(latest.order_by("-taken_at", "-id").values("id")[:1]),
+        )
+        return {snapshot.wallet_id: snapshot for snapshot in snapshots}
+
+    @classmethod
+    def take(cls, chunk_size=500):
+        """
+        Snapshot the wallets with entries since their latest snapshot,
+        returns the number of snapshots taken
+        """
+        taken_at = timezone.now() - timezone.timedelta(seconds=cls.SNAPSHOT_LAG)
+        wallet_ids = list(Wallet.objects.order_by("pk").values_list("pk", flat=True))
+
+        taken = 0
+        for start in range(0, len(wallet_ids), chunk_size):
+            chunk = wallet_ids[start : start + chunk_size]
+            latest = cls.get_latest(chunk)
+            last_entries = (
+                LedgerEntry.objects.filter(wallet_id__in=chunk, created_at__lte=taken_at)
+                .order_by()
+                .values("wallet_id")
+                .annotate(last_created_at=models.Max("created_at"))
+            )
+            # only the wallets with entries after their latest snapshot
+            changed = [
+                row["wallet_id"]
+                for row in last_entries
+                if row["wallet_id"] not in latest
+                or row["last_created_at"] > latest[row["wallet_id"]].taken_at
+            ]
+            if not changed:
+                continue
+
+            balances = LedgerEntry.get_balances(changed, at=taken_at)
+            cls.objects.bulk_create(
+                [
+                    cls(
+                        wallet_id=wallet_id,
+                        available=balances[(wallet_id, "available")],
+                        unsettled=balances[(wallet_id, "unsettled")],
+                        taken_at=taken_at,
+                    )
+                    for wallet_id in changed
+                ]
+            )
+            taken += len(changed)
+        return taken
+
+
 class StoreOpenHours(models.Model):
     store = models.ForeignKey("Store", on_delete=models.CASCADE)
     day = models.CharField(
@@ -1123,6 +1715,196 @@ class StoreOpenHours(models.Model):
             return utc_time
         return None
 
+    MINUTES_PER_DAY = 24 * 60
+    MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+    # a few hours so a daylight saving change of the store's timezone is picked up
+    SCHEDULE_CACHE_TIMEOUT = 60 * 60 * 6
+
+    @staticmethod
+    def get_schedule_cache_key(store_id):
+        return f"store_open_hours_schedule_{store_id}"
+
+    @classmethod
+    def clear_schedule_cache(cls, store_id):
+        from django.core.cache import cache
+
+        cache.delete(cls.get_schedule_cache_key(store_id))
+
+    @classmethod
+    def compile_schedule(cls, open_hours, store_timezone=None):
+        """
+        Compile the open hours of a store into its weekly schedule,
+        the open and close times are UTC minutes of the week (Monday 00:00 UTC is 0)
+        and offset is the store's timezone offset from UTC in minutes.
+        Returns None when the store's timezone is invalid
+
+        eg: {"offset": 60, "days": [[480, 1140], None, None, None, None, None, None]}
+        is open on Monday from 9:00 AM to 8:00 PM in Africa/Lagos
+        """
+        offset = 0
+        if store_timezone:
+            try:
+                local_now = timezone.now().astimezone(pytz.timezone(store_timezone))
+            except pytz.UnknownTimeZoneError:
+                logging.exception(
+                    f"Error: Invalid timezone '{store_timezone}'. Check and update if necessary."
+                )
+                return None
+            offset = int(local_now.utcoffset().total_seconds() // 60)
+
+        # the first open hours of the day, or the default open hours, apply
+        open_hours = sorted(open_hours, key=lambda hours: hours.id)
+        days = []
+        for index, (day, _) in enumerate(settings.DAYS_OF_WEEK):
+            day_open_hours = next(
+                (hours for hours in open_hours if hours.day in (day, None, "")), None
+            )
+            if not day_open_hours:
+                days.append(None)
+                continue
+            open_time = day_open_hours.open_time
+            close_time = day_open_hours.close_time
+            open_minute = (
+                index * cls.MINUTES_PER_DAY
+                + open_time.hour * 60
+                + open_time.minute
+                - offset
+            ) % cls.MINUTES_PER_WEEK
+            duration = (close_time.hour * 60 + close_time.minute) - (
+                open_time.hour * 60 + open_time.minute
+            )
+            days.append([open_minute, open_minute + duration])
+
+        return {"offset": offset, "days": days}
+
+    @classmethod
+    def get_schedules(cls, stores):
+        """
+        Get the weekly schedule of each store, from the cache or compiled from
+        their open hours with a single query (prefetched open hours are reused).
+        Returns {store_id: schedule}
+        """
+        from django.core.cache import cache
+
+        stores = {store.id: store for store in stores}
+        cache_keys = {cls.get_schedule_cache_key(store_id): store_id for store_id in stores}
+        schedules = {
+            cache_keys[cache_key]: schedule
+            for cache_key, schedule in cache.get_many(list(cache_keys)).items()
+        }
+
+        missing_store_ids = [store_id for store_id in stores if store_id not in schedules]
+        if not missing_store_ids:
+            return schedules
+
+        open_hours_by_store = {}
+        store_ids_to_query = []
+        for store_id in missing_store_ids:
+            prefetched = getattr(stores[store_id], "_prefetched_objects_cache", {})
+            if "storeopenhours_set" in prefetched:
+                open_hours_by_store[store_id] = list(prefetched["storeopenhours_set"])
+            else:
+                open_hours_by_store[store_id] = []
+                store_ids_to_query.append(store_id)
+        if store_ids_to_query:
+            for open_hours in cls.objects.filter(store_id__in=store_ids_to_query):
+                open_hours_by_store[open_hours.store_id].append(open_hours)
+
+        compiled_schedules = {
+            store_id: cls.compile_schedule(
+                open_hours_by_store[store_id], stores[store_id].timezone
+            )
+            for store_id in missing_store_ids
+        }
+        cache.set_many(
+            {
+                cls.get_schedule_cache_key(store_id): schedule
+                for store_id, schedule in compiled_schedules.items()
+            },
+            cls.SCHEDULE_CACHE_TIMEOUT,
+        )
+        schedules.update(compiled_schedules)
+        return schedules
+
+    @classmethod
+    def get_schedule_is_open_data(cls, schedule, now):
+        """
+        Evaluate a weekly schedule at `now` (an aware datetime),
+        returns the same data as Store.get_is_open_data
+        """
+        is_open_data = {
+            "is_open": False,
+            "open_soon": False,
+            "close_soon": False,
+            "open_next_day": False,
+            "message": "We are closed for today, please come back tomorrow.",
+        }
+        if not schedule:
+            return is_open_data
+
+        seconds_per_week = cls.MINUTES_PER_WEEK * 60
+        now = now.astimezone(pytz.utc)
+        now_seconds = (
+            now.weekday() * cls.MINUTES_PER_DAY * 60
+            + now.hour * 3600
+            + now.minute * 60
+            + now.second
+            + now.microsecond / 1_000_000
+        )
+        offset = schedule["offset"]
+
+        # the open hours of the current day in the store's timezone
+        local_minute = (int(now_seconds // 60) + offset) % cls.MINUTES_PER_WEEK
+        day_schedule = schedule["days"][local_minute // cls.MINUTES_PER_DAY]
+        if not day_schedule:
+            return is_open_data
+
+        open_minute, close_minute = day_schedule
+        # seconds since the store opened today, negative before it opens
+        elapsed = (now_seconds - open_minute * 60 + seconds_per_week / 2) % (
+            seconds_per_week
+        ) - seconds_per_week / 2
+        duration = (close_minute - open_minute) * 60
+
+        def format_minute(minute):
+            minute = (minute + offset) % cls.MINUTES_PER_DAY
+            return datetime.min.replace(hour=minute // 60, minute=minute % 60).strftime(
+                "%I:%M %p"
+            )
+
+        # Check if store is open
+        if 0 <= elapsed < duration:
+            is_open_data["is_open"] = True
+            is_open_data["message"] = None
+
+            # Check if store will close soon
+            time_to_close = duration - elapsed
+            if 0 < time_to_close <= 1800:  # 30 minutes
+                is_open_data["close_soon"] = True
+                is_open_data["message"] = f"Closes today by {format_minute(close_minute)}"
+
+        # Check if store will open next day
+        if elapsed >= duration:
+            is_open_data["open_next_day"] = True
+            is_open_data["message"] = (
+                "We are closed for today, please come back tomorrow."
+            )
+        # Check if store will open soon
+        if elapsed < 0:
+            time_to_open = -elapsed
+            if 0 < time_to_open <= 1800:  # 30 minutes or less
+                is_open_data["open_soon"] = True
+                # message should be like "Opening soon by 10:00 AM in about 30 minutes"
+                is_open_data["message"] = (
+                    f"Opening soon by {format_minute(open_minute)} in about {time_to_open // 60} minutes"
+                )
+            else:
+                is_open_data["message"] = (
+                    f"Opens today by {format_minute(open_minute)}"
+                )
+
+        return is_open_data
+
     # get store's open hours
     def get_store_open_hours(store_id):
         return StoreOpenHours.objects.filter(store__id=store_id)
@@ -1185,6 +1967,13 @@ class Store(models.Model):
     store_cover_image = models.ImageField(
         upload_to=store_cover_image_directory_path, null=True, blank=True
     )
+    # the sized WebP and JPEG copies of the cover image, see trayapp.images
+    store_cover_image_renditions = models.JSONField(
+        default=dict, blank=True, editable=False
+    )
+    # name, bio, categories, menus and school of the store, see trayapp.search
+    search_document = SearchDocumentField(blank=True, default="", editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
     store_bio = models.CharField(null=True, blank=True, max_length=150)
     store_average_preparation_time = models.JSONField(default=dict, blank=True)
 
@@ -1197,6 +1986,8 @@ class Store(models.Model):
     primary_address_lat = models.FloatField(null=True, blank=True)
     primary_address_lng = models.FloatField(null=True, blank=True)
     # location = gis_models.PointField(null=True, blank=True, srid=4326)
+    # grid cell of primary_address_lat/lng, see Store.get_geo_cell
+    geo_cell = models.BigIntegerField(null=True, blank=True, editable=False)
     school = models.ForeignKey(School, on_delete=models.SET_NULL, null=True, blank=True)
     campus = models.CharField(max_length=50, null=True, blank=True)
     timezone = models.CharField(max_length=50, null=True, blank=True)
@@ -1253,108 +2044,68 @@ class Store(models.Model):
 
     # check if store is open
     # e.g 10:00 AM - 8:00 PM is 10:00:00 - 20:00:00
-    def get_is_open_data(self):
-        is_open_data = {
-            "is_open": False,
-            "open_soon": False,
-            "close_soon": False,
-            "open_next_day": False,
-            "message": "We are closed for today, please come back tomorrow.",
-        }
-
-        # Get the current time in the store's time zone
-        current_datetime = timezone.now()
-
-        if self.timezone:
-            try:
-                current_datetime = current_datetime.astimezone(
-                    pytz.timezone(self.timezone)
-                )
-            except pytz.UnknownTimeZoneError:
-                logging.exception(
-                    f"Error: Invalid timezone '{self.timezone}'. Check and update if necessary."
-                )
-                return is_open_data
-
-        # Get the abbreviated day of the week (e.g., "Mon", "Tue", etc.)
-        current_day_abbrev = current_datetime.strftime("%a")
-
-        # Get the store's open hours for the current day or the default open hours
-        try:
-            store_open_hours = self.storeopenhours_set.filter(
-                models.Q(day=current_day_abbrev)
-                | models.Q(day__isnull=True)
-                | models.Q(day__exact="")
-            ).first()
-        except (AttributeError, ValueError):
-            return is_open_data
-
-        if not store_open_hours:
-            return is_open_data
-
-        # Convert the open and close time to the store's timezone (handle potential errors)
-        try:
-            open_time = store_open_hours.open_time
-            close_time = store_open_hours.close_time
-        except (AttributeError, ValueError):
-            return is_open_data
+    def get_is_open_data(self, now=None):
+        return Store.get_stores_is_open_data([self], now=now)[self.id]
 
-        if self.timezone:
-            try:
-                open_datetime = datetime.combine(current_datetime.date(), open_time)
-                close_datetime = datetime.combine(current_datetime.date(), close_time)
-                open_datetime = pytz.timezone(self.timezone).localize(open_datetime)
-                close_datetime = pytz.timezone(self.timezone).localize(close_datetime)
-            except (pytz.UnknownTimeZoneError, ValueError):
-                return is_open_data
-        else:
-            open_datetime = timezone.make_aware(
-                datetime.combine(current_datetime.date(), open_time),
-                current_datetime.tzinfo,
-            )
-            close_datetime = timezone.make_aware(
-                datetime.combine(current_datetime.date(), close_time),
-                current_datetime.tzinfo,
-            )
+    @staticmethod
+    def get_stores_is_open_data(stores, now=None):
+        """
+        Check if many stores are open at the same instant, with their cached
+        weekly schedules instead of a query per store. Returns {store_id: is_open_data}
+        ```python
+        is_open_data = Store.get_stores_is_open_data(stores)
+        is_open_data[store.id] # {"is_open": True, "open_soon": False, ...}
+        ```
+        """
+        now = now or timezone.now()
+        schedules = StoreOpenHours.get_schedules(stores)
+        return {
+            store_id: StoreOpenHours.get_schedule_is_open_data(schedule, now)
+            for store_id, schedule in schedules.items()
+        }
 
-        # Check if store is open
-        if open_datetime <= current_datetime < close_datetime:
-            is_open_data["is_open"] = True
-            is_open_data["message"] = None
+    class Meta:
+        ordering = ["-store_rank"]
+        indexes = [
+            models.Index(fields=["geo_cell"]),
+            # the trigram index of search_document is made by the migration
+            # when pg_trgm is available
+            GinIndex(fields=["search_vector"]),
+        ]
 
-        # Check if store will close soon
-        if open_datetime <= current_datetime < close_datetime:
-            time_to_close = (close_datetime - current_datetime).total_seconds()
-            if 0 < time_to_close <= 1800:  # 30 minutes
-                is_open_data["close_soon"] = True
-                is_open_data["message"] = (
-                    f"Closes today by {close_datetime.strftime('%I:%M %p')}"
-                )
+    # the fields of the search document of the store (see trayapp.search),
+    # the first ones are in the documents of its items too
+    ITEM_SEARCH_DOCUMENT_FIELDS = ("store_name", "store_nickname", "campus", "school_id")
+    SEARCH_DOCUMENT_FIELDS = ITEM_SEARCH_DOCUMENT_FIELDS + ("store_bio", "store_categories")
 
-        # Check if store will open next day
-        if current_datetime >= close_datetime:
-            is_open_data["open_next_day"] = True
-            is_open_data["message"] = (
-                "We are closed for today, please come back tomorrow."
-            )
-        # Check if store will open soon
-        if current_datetime < open_datetime:
-            time_to_open = (open_datetime - current_datetime).total_seconds()
-            if 0 < time_to_open <= 1800:  # 30 minutes or less
-                is_open_data["open_soon"] = True
-                # message should be like "Opening soon by 10:00 AM in about 30 minutes"
-                is_open_data["message"] = (
-                    f"Opening soon by {open_datetime.strftime('%I:%M %p')} in about {time_to_open // 60} minutes"
-                )
-            else:
-                is_open_data["message"] = (
-                    f"Opens today by {open_datetime.strftime('%I:%M %p')}"
-                )
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the stored cover image, tells a new upload apart without a query
+        self._original_store_cover_image_name = get_stored_image_name(
+            self, "store_cover_image"
+        )
+        self._original_search_values = self.get_search_values()
 
-        return is_open_data
+    def get_search_values(self):
+        # the loaded values, a deferred field or a new store is always a change
+        if not self.pk:
+            return {}
+        return {
+            field: copy.deepcopy(self.__dict__[field])
+            for field in self.SEARCH_DOCUMENT_FIELDS
+            if field in self.__dict__
+        }
 
-    class Meta:
-        ordering = ["-store_rank"]
+    def get_changed_search_fields(self):
+        """
+        The SEARCH_DOCUMENT_FIELDS changed since the store was loaded or saved
+        """
+        return {
+            field
+            for field in self.SEARCH_DOCUMENT_FIELDS
+            if field not in self._original_search_values
+            or self._original_search_values[field] != self.__dict__.get(field)
+        }
 
     def save(self, *args, **kwargs):
         # Update location field if lat/lng are provided
@@ -1365,25 +2116,24 @@ class Store(models.Model):
         #     self.location = Point(
         #         self.primary_address_lng, self.primary_address_lat, srid=4326
         #     )
+        self.geo_cell = Store.get_geo_cell(
+            self.primary_address_lat, self.primary_address_lng
+        )
 
-        # Resize the image before saving
-        if self.store_cover_image:
-            if self.image_has_changed():
-                image_resized(self.store_cover_image, 800, 800)
+        # the upload is stored as it is, its renditions are made off the request,
+        # the renditions of a cleared image are dropped
+        if image_has_changed(
+            self.store_cover_image, self._original_store_cover_image_name
+        ):
+            self.store_cover_image_renditions = {}
+            if self.store_cover_image:
+                schedule_image_processing()
 
         super().save(*args, **kwargs)
-
-    # check if image has changed
-    def image_has_changed(self):
-        try:
-            obj = Store.objects.get(pk=self.pk)
-        except Store.DoesNotExist:
-            return True
-
-        if obj.store_cover_image != self.store_cover_image:
-            return True
-
-        return False
+        self._original_store_cover_image_name = (
+            self.store_cover_image.name if self.store_cover_image else None
+        )
+        self._original_search_values = self.get_search_values()
 
     # store's wallet
     @property
@@ -1408,20 +2158,9 @@ class Store(models.Model):
         return Item.get_items_by_store(store=self)
 
     def update_product_qty(self, product_slug, product_cart_qty, action):
-        product_qs = self.get_store_products().filter(product_slug=product_slug)
-        if not product_qs.exists():
-            return False
-        product = product_qs.first()
-        if action == "add":
-            product.product_qty += product_cart_qty
-            product.save()
-        elif action == "remove":
-            product.product_qty -= product_cart_qty
-            product.save()
-        else:
-            raise Exception("Invalid action")
-
-        return True
+        stock = Item.update_stock([(self.id, product_slug, product_cart_qty)], action)
+        Item.notify_low_stock(stock["almost_out_of_stock"])
+        return len(stock["updated"]) > 0
 
     def validate_store_average_preparation_time(self):
         store_average_preparation_time = self.store_average_preparation_time
@@ -1449,6 +2188,137 @@ class Store(models.Model):
     def store_menu(self):
         return [menu.name.strip() for menu in self.menus()]
 
+    # the world is split in a grid of GEO_CELL_SIZE degrees cells,
+    # about 5.5km at the equator, numbered row by row from the south west corner
+    GEO_CELL_SIZE = 0.05
+    GEO_CELL_ROWS = int(180 / GEO_CELL_SIZE)
+    GEO_CELL_COLUMNS = int(360 / GEO_CELL_SIZE)
+    # above this number of rows one range over the rows is used instead of a range per row
+    MAX_GEO_CELL_FILTER_ROWS = 64
+    KM_PER_DEGREE = 111.32
+
+    @classmethod
+    def get_geo_cell_row(cls, latitude):
+        row = int(math.floor((latitude + 90) / cls.GEO_CELL_SIZE))
+        return min(max(row, 0), cls.GEO_CELL_ROWS - 1)
+
+    @classmethod
+    def get_geo_cell_column(cls, longitude):
+        return int(math.floor((longitude + 180) / cls.GEO_CELL_SIZE)) % (
+            cls.GEO_CELL_COLUMNS
+        )
+
+    @classmethod
+    def get_geo_cell(cls, latitude, longitude):
+        """
+        eg: Store.get_geo_cell(6.5244, 3.3792) -> 13899667
+        """
+        if latitude is None or longitude is None:
+            return None
+        return cls.get_geo_cell_row(latitude) * cls.GEO_CELL_COLUMNS + (
+            cls.get_geo_cell_column(longitude)
+        )
+
+    @classmethod
+    def get_geo_cell_filter(cls, latitude, longitude, radius):
+        """
+        Filter of the stores in the bounding box of the circle of `radius` km around
+        (latitude, longitude), as ranges of geo_cell that use its B-tree index
+        """
+        lat_delta = radius / cls.KM_PER_DEGREE
+        min_lat, max_lat = max(latitude - lat_delta, -90), min(latitude + lat_delta, 90)
+        bbox_filter = Q(primary_address_lat__range=(min_lat, max_lat))
+
+        cos_lat = math.cos(math.radians(latitude))
+        lng_delta = radius / (cls.KM_PER_DEGREE * cos_lat) if cos_lat > 1e-6 else 360
+        if lng_delta >= 180:
+            columns_ranges = [(0, cls.GEO_CELL_COLUMNS - 1)]
+        else:
+            min_lng, max_lng = longitude - lng_delta, longitude + lng_delta
+            min_column = cls.get_geo_cell_column(min_lng)
+            max_column = cls.get_geo_cell_column(max_lng)
+            if min_column <= max_column:
+                columns_ranges = [(min_column, max_column)]
+                bbox_filter &= Q(primary_address_lng__range=(min_lng, max_lng))
+            else:
+                # the box crosses the antimeridian
+                columns_ranges = [
+                    (min_column, cls.GEO_CELL_COLUMNS - 1),
+                    (0, max_column),
+                ]
+
+        min_row, max_row = cls.get_geo_cell_row(min_lat), cls.get_geo_cell_row(max_lat)
+        if max_row - min_row >= cls.MAX_GEO_CELL_FILTER_ROWS:
+            return bbox_filter & Q(
+                geo_cell__range=(
+                    min_row * cls.GEO_CELL_COLUMNS,
+                    (max_row + 1) * cls.GEO_CELL_COLUMNS - 1,
+                )
+            )
+
+        cells_filter = Q()
+        for row in range(min_row, max_row + 1):
+            for min_column, max_column in columns_ranges:
+                cells_filter |= Q(
+                    geo_cell__range=(
+                        row * cls.GEO_CELL_COLUMNS + min_column,
+                        row * cls.GEO_CELL_COLUMNS + max_column,
+                    )
+                )
+        return bbox_filter & cells_filter
+
+    @classmethod
+    def get_nearby_stores(
+        cls, latitude, longitude, radius, limit=None, offset=0, queryset=None
+    ):
+        """
+        Stores within `radius` km of (latitude, longitude), sorted by distance
+        and store rank. The grid cells and the bounding box select the candidates,
+        their exact distances are computed with numpy, only the stores of the
+        requested page are loaded. Each store gets a `distance` in km.
+        ```python
+        stores = Store.get_nearby_stores(6.5244, 3.3792, radius=5, limit=10)
+        stores[0].distance # 0.42
+        ```
+        """
+        import numpy as np
+        from trayapp.utils import haversine_distances
+
+        if queryset is None:
+            queryset = cls.objects.all()
+
+        candidates = list(
+            queryset.filter(cls.get_geo_cell_filter(latitude, longitude, radius))
+            .order_by()
+            .values_list(
+                "id", "primary_address_lat", "primary_address_lng", "store_rank"
+            )
+        )
+        if not candidates:
+            return []
+
+        ids, lats, lngs, ranks = (np.array(column) for column in zip(*candidates))
+        distances = haversine_distances(latitude, longitude, lats, lngs)
+        within_radius = distances <= radius
+        ids, distances = ids[within_radius], distances[within_radius]
+        ranks = ranks[within_radius].astype(float)
+
+        # sort by distance, then by store rank, highest first
+        order = np.lexsort((-ranks, distances))
+        offset = offset or 0
+        page = order[offset:] if limit is None else order[offset : offset + limit]
+
+        stores = {
+            store.id: store
+            for store in queryset.filter(id__in=ids[page].tolist()).order_by()
+        }
+        nearby_stores = []
+        for store_id, distance in zip(ids[page].tolist(), distances[page].tolist()):
+            store = stores[store_id]
+            store.distance = distance
+            nearby_stores.append(store)
+        return nearby_stores
+
     # check if store can accept orders
     def can_accept_orders(self):
         return (
@@ -1603,6 +2473,32 @@ class DeliveryPerson(models.Model):
     )
     is_approved = models.BooleanField(default=False)
 
+    # eligibility index, a copy of the profile location kept in sync by refresh_eligibility
+    is_student = models.BooleanField(default=False, editable=False)
+    country = CountryField(null=True, blank=True, editable=False)
+    state = models.CharField(max_length=50, null=True, blank=True, editable=False)
+    city = models.CharField(max_length=50, null=True, blank=True, editable=False)
+    school = models.ForeignKey(
+        School,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+    )
+    campus = models.CharField(max_length=50, null=True, blank=True, editable=False)
+    gender = models.ForeignKey(
+        Gender,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+    )
+    # counters kept up to date by DeliveryNotification.save and Order.sync_order_stores
+    in_flight_notifications_count = models.IntegerField(default=0, editable=False)
+    active_orders_count = models.IntegerField(default=0, editable=False)
+
     def __str__(self) -> str:
         sent_delivery_notifications_count = self.get_notifications().count()
         return f"{self.profile.user.username} - {sent_delivery_notifications_count} notifications sent"
@@ -1614,6 +2510,24 @@ class DeliveryPerson(models.Model):
     class Meta:
         ordering = ["-is_approved", "-status"]
         verbose_name_plural = "Delivery People"
+        indexes = [
+            models.Index(fields=["status", "is_approved", "country", "state", "city"]),
+            models.Index(fields=["status", "is_approved", "school", "campus", "gender"]),
+        ]
+
+    # copy the profile location into the eligibility index
+    @staticmethod
+    def refresh_eligibility(profile: Profile):
+        student = Student.objects.filter(user=profile).first()
+        DeliveryPerson.objects.filter(profile=profile).update(
+            is_student=student is not None,
+            country=profile.country,
+            state=profile.state,
+            city=profile.city,
+            school=student.school if student else None,
+            campus=student.campus if student else None,
+            gender=profile.gender,
+        )
 
     @property
     def orders(self):
@@ -1630,7 +2544,13 @@ class DeliveryPerson(models.Model):
         return self.get_active_orders_count() > 4
 
     def get_active_orders_count(self):
-        return Order.get_active_orders_count_by_delivery_person(delivery_person=self)
+        # read the counter from the db, the instance may be older than the last order update
+        return (
+            DeliveryPerson.objects.filter(id=self.id)
+            .values_list("active_orders_count", flat=True)
+            .first()
+            or 0
+        )
 
     # method to check if a order is able to be delivered by a delivery person
     def can_deliver(self, order: Order):
@@ -1692,48 +2612,85 @@ class DeliveryPerson(models.Model):
     # method to get delivery people that can deliver a order
     @staticmethod
     def get_delivery_people_that_can_deliver(order: Order):
+        """
+        Select the delivery people that can deliver an order with one query
+        on the eligibility index, ranked by their number of active orders.
+        It applies the same rules as can_deliver
+        """
+        customer: Profile = order.user
+        customer_student = Student.objects.filter(user=customer).first()
+        customer_store = customer.store
+
+        # non students deliver within the customer's city
+        location_filter = Q(is_student=False, state=customer.state, city=customer.city)
+
+        # students deliver within their school and campus
+        student_filter = Q(is_student=True)
+        if customer_store:
+            student_filter &= Q(
+                school=customer_store.school, campus=customer_store.campus
+            )
+        if customer_student:
+            student_filter &= Q(
+                gender=customer.gender,
+                school=customer_student.school,
+                campus=customer_student.campus,
+            )
+
+        already_delivering_ids = [
+            delivery_person["id"] for delivery_person in order.delivery_people
+        ]
+        linked_vendor_ids = order.linked_stores.values_list("vendor_id", flat=True)
+
         delivery_people = (
-            DeliveryPerson.objects.filter(
+            DeliveryPerson.objects.filter(location_filter | student_filter)
+            .filter(
                 status="online",
                 is_approved=True,
-                profile__country=order.user.country,
+                country=customer.country,
+                profile__user__is_active=True,
+                in_flight_notifications_count=0,
+                active_orders_count__lte=4,
+            )
+            .exclude(profile=customer)
+            .exclude(profile__in=linked_vendor_ids)
+            .exclude(id__in=already_delivering_ids)
+            .exclude(
+                id__in=DeliveryNotification.objects.filter(order=order).values(
+                    "delivery_person_id"
+                )
             )
             .select_related("profile")
-            .iterator()
         )
 
-        return [dp for dp in delivery_people if dp.can_deliver(order)]
+        return sorted(
+            delivery_people,
+            key=lambda delivery_person: (
+                delivery_person.active_orders_count,
+                delivery_person.id,
+            ),
+        )
 
     # send delivery request to delivery person
     @staticmethod
     def send_delivery(order: Order, store: Store):
-        delivery_people = (
-            DeliveryPerson.objects.filter(
-                status="online",
-                is_approved=True,
-                profile__country=order.user.country,
-                profile__user__is_active=True,
-            )
-            .select_related("profile")
-            .iterator()
-        )
+        delivery_people = DeliveryPerson.get_delivery_people_that_can_deliver(order)
 
-        for delivery_person in delivery_people:
-            if delivery_person.can_deliver(order):
-                DeliveryNotification.objects.create(
-                    order=order,
-                    store=store,
-                    delivery_person=delivery_person,
-                    status="pending",
-                )
-                queue_data = {
-                    "order_id": order.order_track_id,
-                    "delivery_person_id": delivery_person.id,
-                }
-                send_message_to_queue(
-                    message=queue_data, queue_name="new-delivery-request"
-                )
-                return True
+        # send the request to the best ranked delivery person
+        if delivery_people:
+            delivery_person = delivery_people[0]
+            DeliveryNotification.objects.create(
+                order=order,
+                store=store,
+                delivery_person=delivery_person,
+                status="pending",
+            )
+            queue_data = {
+                "order_id": order.order_track_id,
+                "delivery_person_id": delivery_person.id,
+            }
+            NotificationOutbox.enqueue("new-delivery-request", queue_data)
+            return True
 
         order.update_store_status(store_id=store.id, status="no-delivery-person")
         order.notify_store(
@@ -1766,6 +2723,31 @@ class DeliveryNotification(models.Model):
     class Meta:
         unique_together = ("order", "delivery_person")
 
+    # notifications that are still waiting for the delivery person
+    IN_FLIGHT_STATUSES = ["pending", "processing"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._original_status = self.status
+
+    def save(self, *args, **kwargs):
+        was_in_flight = (
+            not self._state.adding and self._original_status in self.IN_FLIGHT_STATUSES
+        )
+        super().save(*args, **kwargs)
+
+        # keep the delivery person in flight notifications counter up to date
+        is_in_flight = self.status in self.IN_FLIGHT_STATUSES
+        if was_in_flight != is_in_flight:
+            DeliveryPerson.objects.filter(id=self.delivery_person_id).update(
+                in_flight_notifications_count=models.F("in_flight_notifications_count")
+                + (1 if is_in_flight else -1)
+            )
+        self._original_status = self.status
+
+        # new delivery requests change the delivery person's status counts
+        OrderStore.clear_status_counts_cache([self.delivery_person.profile_id])
+
     # has_expired: this will check if the status is sent and the updated_at and the current time is greater than 1 minute
     @property
     def has_expired(self):
@@ -1780,6 +2762,13 @@ class DeliveryNotification(models.Model):
 
 
 class UserActivity(models.Model):
+    """
+    Append-only log of what the users do with the items.
+    Activities are recorded through `record()` and saved in batches,
+    `rollup()` sums each day into ItemActivityRollup and UserActivityRollup
+    and `prune()` deletes the raw activities once they are rolled up.
+    """
+
     ACTIVITY_TYPES = (
         ("view", "view"),
         ("added_to_cart", "added_to_cart"),
@@ -1792,7 +2781,17 @@ class UserActivity(models.Model):
     user_id = models.PositiveIntegerField()
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     activity_type = models.CharField(max_length=20, choices=ACTIVITY_TYPES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # set when the activity is recorded, not when its batch is saved
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    # activities waiting to be saved, see `record()`
+    BUFFER_SIZE = 500
+    _buffer = []
+    _buffer_lock = threading.Lock()
+
+    # the raw activities are kept this long, the rollups are kept forever
+    RETENTION_DAYS = 90
+    PRUNE_CHUNK_SIZE = 5000
 
     def __str__(self):
         return f"{self.user_id} - {self.item.product_slug} - {self.timestamp}"
@@ -1800,11 +2799,188 @@ class UserActivity(models.Model):
     class Meta:
         ordering = ["-timestamp"]
         verbose_name_plural = "User Activities"
+        indexes = [
+            models.Index(fields=["user_id", "timestamp"]),
+            models.Index(fields=["item", "activity_type", "timestamp"]),
+            # cheap index for the time ranges of the rollups and the retention job
+            BrinIndex(fields=["timestamp"], name="users_useractivity_ts_brin"),
+        ]
 
     @property
     def item_idx(self):
         return self.item.id
 
+    @classmethod
+    def record(cls, user_id, item_id, activity_type):
+        """
+        Buffer an activity, it is saved with the next batch
+        (when the buffer is full or by the BufferFlusherThread)
+        eg: UserActivity.record(user.id, item.id, "view")
+        """
+        activity = cls(
+            user_id=user_id,
+            item_id=item_id,
+            activity_type=activity_type,
+            timestamp=timezone.now(),
+        )
+        with cls._buffer_lock:
+            cls._buffer.append(activity)
+            is_full = len(cls._buffer) >= cls.BUFFER_SIZE
+
+        if is_full:
+            cls.flush_buffer()
+        elif getattr(settings, "WRITE_BUFFER_AUTO_FLUSH", False):
+            from users.threads import BufferFlusherThread
+
+            BufferFlusherThread.start_once()
+
+    @classmethod
+    def flush_buffer(cls):
+        """
+        Save the buffered activities with bulk_create, returns the number saved.
+        When the insert fails the activities go back to the front of the buffer
+        """
+        with cls._buffer_lock:
+            activities, cls._buffer = cls._buffer, []
+        if not activities:
+            return 0
+
+        try:
+            # drop the activities of the items deleted meanwhile, the foreign key
+            # is only checked at commit and would fail the whole batch
+            item_ids = set(
+                Item.objects.filter(
+                    id__in={activity.item_id for activity in activities}
+                ).values_list("id", flat=True)
+            )
+            activities = [
+                activity for activity in activities if activity.item_id in item_ids
+            ]
+            # all or nothing, the saved activities are not buffered again
+            with djtransac.atomic():
+                cls.objects.bulk_create(activities, batch_size=cls.BUFFER_SIZE)
+        except Exception:
+            # the next flush will try again
+            with cls._buffer_lock:
+                cls._buffer[:0] = activities
+            raise
+        return len(activities)
+
+    @classmethod
+    def rollup(cls, day):
+        """
+        Sum the activities of `day` (a date in the current timezone) into the
+        daily rollups, the rows of that day are replaced so it can run again
+        """
+        from datetime import time, timedelta
+        from django.db.models import Count
+
+        start = timezone.make_aware(datetime.combine(day, time.min))
+        end = start + timedelta(days=1)
+        activities = (
+            cls.objects.filter(timestamp__gte=start, timestamp__lt=end)
+            .order_by()
+            .values("user_id", "item_id", "activity_type")
+            .annotate(count=Count("id"))
+        )
+
+        user_rollups = [
+            UserActivityRollup(
+                user_id=row["user_id"],
+                item_id=row["item_id"],
+                activity_type=row["activity_type"],
+                day=day,
+                count=row["count"],
+            )
+            for row in activities
+        ]
+        item_counts = {}
+        for rollup in user_rollups:
+            key = (rollup.item_id, rollup.activity_type)
+            item_counts[key] = item_counts.get(key, 0) + rollup.count
+
+        with djtransac.atomic():
+            UserActivityRollup.objects.filter(day=day).delete()
+            ItemActivityRollup.objects.filter(day=day).delete()
+            UserActivityRollup.objects.bulk_create(user_rollups, batch_size=1000)
+            ItemActivityRollup.objects.bulk_create(
+                [
+                    ItemActivityRollup(
+                        item_id=item_id,
+                        activity_type=activity_type,
+                        day=day,
+                        count=count,
+                    )
+                    for (item_id, activity_type), count in item_counts.items()
+                ],
+                batch_size=1000,
+            )
+        return len(user_rollups)
+
+    @classmethod
+    def prune(cls, retention_days=None, chunk_size=None):
+        """
+        Delete the activities older than `retention_days` in chunks,
+        so the table is never locked for long, returns the number deleted
+        """
+        from datetime import timedelta
+
+        retention_days = retention_days or cls.RETENTION_DAYS
+        chunk_size = chunk_size or cls.PRUNE_CHUNK_SIZE
+        cutoff = timezone.now() - timedelta(days=retention_days)
+
+        deleted = 0
+        while True:
+            ids = list(
+                cls.objects.filter(timestamp__lt=cutoff)
+                .order_by()
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if not ids:
+                return deleted
+            deleted += cls.objects.filter(id__in=ids).delete()[0]
+
+
+class ItemActivityRollup(models.Model):
+    """
+    Number of activities of each type per item and day, see UserActivity.rollup
+    """
+
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    activity_type = models.CharField(
+        max_length=20, choices=UserActivity.ACTIVITY_TYPES
+    )
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("item", "activity_type", "day")
+        indexes = [models.Index(fields=["day", "activity_type"])]
+
+    def __str__(self):
+        return f"{self.item_id} - {self.activity_type} - {self.day}: {self.count}"
+
+
+class UserActivityRollup(models.Model):
+    """
+    Number of activities of each type per user, item and day, see UserActivity.rollup
+    """
+
+    user_id = models.PositiveIntegerField()
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    activity_type = models.CharField(
+        max_length=20, choices=UserActivity.ACTIVITY_TYPES
+    )
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("user_id", "item", "activity_type", "day")
+        indexes = [models.Index(fields=["day"])]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.item_id} - {self.activity_type} - {self.day}"
+
 
 # Signals
 @receiver(post_save, sender=UserAccount)
@@ -1899,3 +3075,97 @@ def add_others_as_default_menu(sender, instance, created, **kwargs):
         menu = Menu.objects.create(name="Others", store=instance)
         menu.save()
         instance.save()
+
+
+# roles and Order.view_as are memoized per request, forget them when what they depend on changes
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=Store)
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=DeliveryPerson)
+@receiver(post_save, sender=DeliveryNotification)
+def clear_request_memo_signal(sender, instance, **kwargs):
+    clear_request_memo()
+
+
+# the weekly schedule of a store is compiled from its open hours and timezone
+@receiver(post_save, sender=StoreOpenHours)
+@receiver(models.signals.post_delete, sender=StoreOpenHours)
+def clear_store_schedule_cache_signal(sender, instance, **kwargs):
+    StoreOpenHours.clear_schedule_cache(instance.store_id)
+
+
+@receiver(post_save, sender=Store)
+def clear_store_timezone_schedule_cache_signal(sender, instance, **kwargs):
+    StoreOpenHours.clear_schedule_cache(instance.id)
+
+
+# the search documents of a store and its items have its name, menus and campus
+@receiver(post_save, sender=Store)
+def update_store_search_document_signal(sender, instance, **kwargs):
+    changed_fields = instance.get_changed_search_fields()
+    if changed_fields:
+        schedule_search_update(
+            store_ids=[instance.id],
+            with_store_items=bool(
+                changed_fields & set(Store.ITEM_SEARCH_DOCUMENT_FIELDS)
+            ),
+        )
+
+
+@receiver(post_save, sender=Menu)
+@receiver(models.signals.post_delete, sender=Menu)
+def update_menu_search_document_signal(sender, instance, **kwargs):
+    schedule_search_update(store_ids=[instance.store_id], with_store_items=True)
+
+
+@receiver(models.signals.post_delete, sender=DeliveryNotification)
+def update_in_flight_notifications_count(sender, instance, **kwargs):
+    if instance._original_status in DeliveryNotification.IN_FLIGHT_STATUSES:
+        DeliveryPerson.objects.filter(id=instance.delivery_person_id).update(
+            in_flight_notifications_count=models.F("in_flight_notifications_count") - 1
+        )
+
+
+# keep the delivery people eligibility index in sync with their profile
+@receiver(post_save, sender=Profile)
+def update_delivery_person_eligibility_signal(sender, instance, created, **kwargs):
+    if not created:
+        DeliveryPerson.refresh_eligibility(instance)
+
+
+@receiver(post_save, sender=Student)
+def update_student_delivery_person_eligibility_signal(sender, instance, **kwargs):
+    DeliveryPerson.refresh_eligibility(instance.user)
+
+
+@receiver(post_save, sender=DeliveryPerson)
+def set_delivery_person_eligibility_signal(sender, instance, created, **kwargs):
+    if created:
+        DeliveryPerson.refresh_eligibility(instance.profile)
+
+
+# the cached answers of the public queries are made of the stores, menus, open hours and schools
+@receiver(post_save, sender=Store)
+@receiver(models.signals.post_delete, sender=Store)
+@receiver(post_save, sender=Menu)
+@receiver(models.signals.post_delete, sender=Menu)
+@receiver(post_save, sender=StoreOpenHours)
+@receiver(models.signals.post_delete, sender=StoreOpenHours)
+@receiver(post_save, sender=School)
+@receiver(models.signals.post_delete, sender=School)
+@receiver(post_save, sender=HostelField)
+@receiver(models.signals.post_delete, sender=HostelField)
+@receiver(post_save, sender=Hostel)
+@receiver(models.signals.post_delete, sender=Hostel)
+def invalidate_query_cache_signal(sender, instance, **kwargs):
+    from trayapp.query_cache import schedule_query_cache_invalidation
+
+    tags = {
+        Store: "stores",
+        Menu: "menus",
+        StoreOpenHours: "store_hours",
+        School: "schools",
+        HostelField: "schools",
+        Hostel: "hostels",
+    }
+    schedule_query_cache_invalidation(tags[sender])
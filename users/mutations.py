@@ -1,5 +1,3 @@
-import requests
-import json
 import logging
 import graphene
 from graphql import GraphQLError
@@ -31,10 +29,10 @@ from .inputs import StudentHostelFieldInput
 from product.models import Order, ItemAttribute
 from django.conf import settings
 from core.utils import get_paystack_balance
+from trayapp.paystack import PaystackError, get_paystack_client
 import uuid
 
 User = UserAccount
-PAYSTACK_SECRET_KEY = settings.PAYSTACK_SECRET_KEY
 
 # get email_async_task from the graphql_auth settings
 
@@ -798,11 +796,6 @@ class CreateTransferRecipient(Output, graphene.Mutation):
         error = None
         user = info.context.user
         if user.profile.wallet:
-            url = "https://api.paystack.co/transferrecipient"
-            headers = {
-                "Authorization": "Bearer " + PAYSTACK_SECRET_KEY,
-                "Content-Type": "application/json",
-            }
             data = {
                 "type": "nuban",
                 "name": account_name,
@@ -811,7 +804,15 @@ class CreateTransferRecipient(Output, graphene.Mutation):
                 "currency": "NGN",
             }
 
-            response = requests.post(url, data=json.dumps(data), headers=headers)
+            try:
+                # paystack returns the same recipient for the same account
+                response = get_paystack_client().post(
+                    "transferrecipient",
+                    json=data,
+                    idempotency_key=f"recipient-{bank_code}-{account_number}",
+                )
+            except PaystackError as e:
+                return CreateTransferRecipient(success=False, error=str(e))
             if response.status_code == 201:
                 response = response.json()
                 if response["status"] == True:
@@ -894,11 +895,6 @@ class WithdrawFromWalletMutation(Output, graphene.Mutation):
                 f"You can only transfer a maximum of {str(amount_able_to_tranfer)} {wallet.currency} at the moment"
             )
 
-        url = "https://api.paystack.co/transfer"
-        headers = {
-            "Authorization": "Bearer " + PAYSTACK_SECRET_KEY,
-            "Content-Type": "application/json",
-        }
         reference = str(uuid.uuid4())
         lower_amount = float(amount) * 100
         post_data = {
@@ -924,8 +920,9 @@ class WithdrawFromWalletMutation(Output, graphene.Mutation):
 
         if not transaction is None:
             try:
-                response = requests.post(
-                    url, data=json.dumps(post_data), headers=headers
+                # the transfer reference makes the retries safe
+                response = get_paystack_client().post(
+                    "transfer", json=post_data, idempotency_key=reference
                 )
                 response_json = response.json()
                 if response.status_code == 200:
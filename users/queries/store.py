@@ -5,6 +5,7 @@ from product.models import Order
 from users.types import StoreType, StoreNode, StoreItmMenuType, MenuType
 from product.types import ItemNode, CategoryType, ItemAttribute
 from trayapp.permissions import permission_checker, IsAuthenticated
+from trayapp.counters import STORE_RANK_COUNTER
 from graphql import GraphQLError
 
 from django.utils import timezone
@@ -70,10 +71,9 @@ class StoreQueries(graphene.ObjectType):
         featured_stores = list(set(regional_stores) | linked_stores)
 
         # Filter out closed stores
+        is_open_data = Store.get_stores_is_open_data(featured_stores)
         featured_stores = [
-            store
-            for store in featured_stores
-            if store.get_is_open_data().get("is_open")
+            store for store in featured_stores if is_open_data[store.id]["is_open"]
         ]
 
         # Sort by store rank in descending order and get top 5
@@ -189,6 +189,5 @@ class StoreQueries(graphene.ObjectType):
             return None
 
         if store:
-            store.store_rank += 0.5
-            store.save()
+            STORE_RANK_COUNTER.incr(store.id)
         return store
@@ -0,0 +1,147 @@
+import math
+from datetime import timedelta
+from unittest import mock
+
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from product.models import Item
+from product.utils import get_popular_items, load_interactions
+from users.models import (
+    UserAccount,
+    Profile,
+    Store,
+    UserActivity,
+    ItemActivityRollup,
+    UserActivityRollup,
+)
+
+
+@override_settings(WRITE_BUFFER_AUTO_FLUSH=False)
+class UserActivityTests(TestCase):
+    def setUp(self):
+        vendor = UserAccount.objects.create_user(
+            username="vendor", email="vendor@example.com", password="testpass123"
+        )
+        store = Store.objects.create(
+            vendor=Profile.objects.get(user=vendor),
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+        )
+        self.rice = Item.objects.create(
+            product_name="Rice", product_slug="rice", product_creator=store
+        )
+        self.beans = Item.objects.create(
+            product_name="Beans", product_slug="beans", product_creator=store
+        )
+        UserActivity.flush_buffer()
+        self.addCleanup(UserActivity._buffer.clear)
+
+    def test_activities_are_saved_in_batches(self):
+        for user_id in range(UserActivity.BUFFER_SIZE - 1):
+            UserActivity.record(user_id, self.rice.id, "view")
+        self.assertEqual(UserActivity.objects.count(), 0)
+
+        # the buffer is full, its activities are saved with bulk inserts
+        with CaptureQueriesContext(connection) as ctx:
+            UserActivity.record(1, self.beans.id, "added_to_cart")
+        inserts = [q for q in ctx.captured_queries if q["sql"].startswith("INSERT")]
+        # one unless the database limits the query parameters (eg: sqlite)
+        fields = [
+            field for field in UserActivity._meta.concrete_fields if not field.primary_key
+        ]
+        batch_size = min(
+            UserActivity.BUFFER_SIZE,
+            connection.ops.bulk_batch_size(fields, [None] * UserActivity.BUFFER_SIZE),
+        )
+        self.assertEqual(len(inserts), math.ceil(UserActivity.BUFFER_SIZE / batch_size))
+        self.assertEqual(UserActivity.objects.count(), UserActivity.BUFFER_SIZE)
+
+        UserActivity.record(2, self.beans.id, "view")
+        self.assertEqual(UserActivity.flush_buffer(), 1)
+
+    def test_failed_flush_keeps_the_activities(self):
+        UserActivity.record(1, self.rice.id, "view")
+        UserActivity.record(2, self.beans.id, "view")
+        with mock.patch.object(
+            UserActivity.objects, "bulk_create", side_effect=DatabaseError("down")
+        ):
+            with self.assertRaises(DatabaseError):
+                UserActivity.flush_buffer()
+        UserActivity.record(3, self.rice.id, "view")
+
+        self.assertEqual(UserActivity.flush_buffer(), 3)
+        self.assertEqual(
+            list(UserActivity.objects.order_by("timestamp").values_list("user_id", flat=True)),
+            [1, 2, 3],
+        )
+
+    def test_activities_of_deleted_items_are_dropped(self):
+        UserActivity.record(1, self.rice.id, "view")
+        UserActivity.record(1, self.beans.id, "view")
+        Item.objects.filter(id=self.beans.id).delete()
+
+        self.assertEqual(UserActivity.flush_buffer(), 1)
+        self.assertEqual(UserActivity.objects.get().item_id, self.rice.id)
+
+    def test_rollup_feeds_recommendations(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        UserActivity.objects.bulk_create(
+            [
+                UserActivity(
+                    user_id=1, item=self.rice, activity_type="view", timestamp=yesterday
+                ),
+                UserActivity(
+                    user_id=1, item=self.rice, activity_type="view", timestamp=yesterday
+                ),
+                UserActivity(
+                    user_id=2,
+                    item=self.beans,
+                    activity_type="purchased",
+                    timestamp=yesterday,
+                ),
+                # today is read from the raw activities
+                UserActivity(user_id=1, item=self.beans, activity_type="added_to_cart"),
+            ]
+        )
+
+        day = timezone.localdate(yesterday)
+        self.assertEqual(UserActivity.rollup(day), 2)
+        # rolling up the same day again replaces its rows
+        self.assertEqual(UserActivity.rollup(day), 2)
+        self.assertEqual(
+            UserActivityRollup.objects.get(user_id=1, item=self.rice).count, 2
+        )
+        self.assertEqual(
+            ItemActivityRollup.objects.get(item=self.beans, activity_type="purchased").count,
+            1,
+        )
+
+        self.assertEqual(
+            load_interactions(),
+            {(1, self.rice.id): 2, (2, self.beans.id): 5, (1, self.beans.id): 3},
+        )
+        self.assertEqual(get_popular_items(), [self.beans.id, self.rice.id])
+
+    def test_prune_deletes_old_activities_in_chunks(self):
+        old = timezone.now() - timedelta(days=UserActivity.RETENTION_DAYS + 1)
+        UserActivity.objects.bulk_create(
+            [
+                UserActivity(
+                    user_id=i, item=self.rice, activity_type="view", timestamp=old
+                )
+                for i in range(25)
+            ]
+            + [UserActivity(user_id=1, item=self.rice, activity_type="view")]
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            deleted = UserActivity.prune(chunk_size=10)
+
+        deletes = [q for q in ctx.captured_queries if q["sql"].startswith("DELETE")]
+        self.assertEqual(deleted, 25)
+        self.assertEqual(len(deletes), 3)
+        self.assertEqual(UserActivity.objects.count(), 1)
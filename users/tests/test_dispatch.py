@@ -0,0 +1,116 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from product.models import Order
+from users.models import (
+    UserAccount,
+    Profile,
+    Store,
+    DeliveryPerson,
+    DeliveryNotification,
+)
+
+
+class DeliveryPersonEligibilityTests(TestCase):
+    """
+    Candidate selection for dispatch reads the eligibility index on DeliveryPerson,
+    the in-flight notification and active order counters are kept up to date incrementally
+    """
+
+    def create_profile(self, username, **fields):
+        user = UserAccount.objects.create_user(
+            username=username, email=f"{username}@example.com", password="testpass123"
+        )
+        profile = Profile.objects.get(user=user)
+        for field, value in fields.items():
+            setattr(profile, field, value)
+        profile.save()
+        return profile
+
+    def setUp(self):
+        vendor = self.create_profile("vendor", state="lagos", city="ikeja")
+        self.store = Store.objects.create(
+            vendor=vendor,
+            store_name="Test Store",
+            store_nickname="teststore",
+            store_type="restaurant",
+            is_approved=True,
+        )
+        customer = self.create_profile("customer", state="lagos", city="ikeja")
+        self.delivery_people = [
+            DeliveryPerson.objects.create(
+                profile=self.create_profile(
+                    f"rider{i}", state="lagos", city="ikeja" if i < 5 else "yaba"
+                ),
+                is_approved=True,
+            )
+            for i in range(6)
+        ]
+        self.order = Order.objects.create(
+            user=customer,
+            order_payment_status="success",
+            stores_status=[{"storeId": self.store.id, "status": "pending"}],
+        )
+        self.order.linked_stores.add(self.store)
+        self.order.save()
+
+    def get_candidate_ids(self):
+        return [
+            delivery_person.id
+            for delivery_person in DeliveryPerson.get_delivery_people_that_can_deliver(
+                self.order
+            )
+        ]
+
+    def test_candidate_selection_is_one_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            candidate_ids = self.get_candidate_ids()
+        # the rider in another city is not eligible
+        self.assertEqual(candidate_ids, [dp.id for dp in self.delivery_people[:5]])
+        # the customer's student and store lookups aside, riders are read once
+        delivery_person_queries = [
+            query
+            for query in ctx.captured_queries
+            if 'FROM "users_deliveryperson"' in query["sql"]
+        ]
+        self.assertEqual(len(delivery_person_queries), 1)
+
+    def test_in_flight_notifications_count(self):
+        rider = self.delivery_people[0]
+        notification = DeliveryNotification.objects.create(
+            order=self.order, store=self.store, delivery_person=rider, status="pending"
+        )
+        rider.refresh_from_db()
+        self.assertEqual(rider.in_flight_notifications_count, 1)
+        self.assertNotIn(rider.id, self.get_candidate_ids())
+
+        notification.status = "sent"
+        notification.save()
+        rider.refresh_from_db()
+        self.assertEqual(rider.in_flight_notifications_count, 0)
+
+        DeliveryNotification.objects.create(
+            order=self.order,
+            store=self.store,
+            delivery_person=self.delivery_people[1],
+            status="processing",
+        )
+        self.order.clear_delivery_notifications()
+        self.delivery_people[1].refresh_from_db()
+        self.assertEqual(self.delivery_people[1].in_flight_notifications_count, 0)
+
+    def test_active_orders_count(self):
+        rider = self.delivery_people[0]
+        self.order.linked_delivery_people.add(rider)
+        self.order.delivery_people = [
+            {"id": rider.id, "status": "pending", "storeId": self.store.id}
+        ]
+        self.order.save()
+        rider.refresh_from_db()
+        self.assertEqual(rider.active_orders_count, 1)
+        self.assertEqual(rider.get_active_orders_count(), 1)
+
+        self.order.update_delivery_person_status("delivered", delivery_person_id=rider.id)
+        rider.refresh_from_db()
+        self.assertEqual(rider.active_orders_count, 0)
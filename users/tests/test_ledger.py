@@ -0,0 +1,134 @@
+import io
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db.models import ProtectedError, Sum
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from users.models import (
+    UserAccount,
+    Profile,
+    Wallet,
+    Transaction,
+    LedgerEntry,
+    WalletBalanceSnapshot,
+)
+
+
+def create_wallet(username):
+    user = UserAccount.objects.create_user(
+        username=username, email=f"{username}@example.com", password="testpass123"
+    )
+    return Wallet.objects.create(user=Profile.objects.get(user=user))
+
+
+def create_unsettled(wallet, amount):
+    return Transaction.objects.create(
+        wallet=wallet,
+        title="Order Payment",
+        amount=Decimal(amount),
+        _type="credit",
+        status="unsettled",
+    )
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.wallet = create_wallet("vendor")
+
+    def test_movements_are_balanced_and_match_the_wallet(self):
+        self.wallet.add_balance(Decimal("500.00"))
+        create_unsettled(self.wallet, "300.00")
+        create_unsettled(self.wallet, "80.00")
+        Transaction.settle_unsettled()
+        on_hold = create_unsettled(self.wallet, "20.00")
+        self.wallet.put_transaction_on_hold(transaction_id=on_hold.transaction_id)
+
+        transfer = Transaction.objects.create(
+            wallet=self.wallet, title="Transfer", amount=Decimal("100.00"), _type="debit"
+        )
+        self.wallet.deduct_balance(
+            amount=Decimal("100.00"),
+            transfer_fee=Decimal("10.00"),
+            transaction_id=transfer.transaction_id,
+        )
+
+        self.wallet.refresh_from_db()
+        self.assertEqual(self.wallet.balance, Decimal("770.00"))
+        self.assertEqual(self.wallet.get_ledger_balance(), Decimal("770.00"))
+        self.assertEqual(self.wallet.get_unsettled_balance(), Decimal("0.00"))
+
+        # every movement has a debit and a credit of the same amount
+        for movement_id in LedgerEntry.objects.values_list("movement_id", flat=True):
+            legs = LedgerEntry.objects.filter(movement_id=movement_id)
+            self.assertEqual(
+                legs.filter(direction="debit").aggregate(total=Sum("amount")),
+                legs.filter(direction="credit").aggregate(total=Sum("amount")),
+            )
+        self.assertEqual(LedgerEntry.reconcile([self.wallet.pk]), [])
+
+    def test_entries_are_immutable(self):
+        self.wallet.add_balance(Decimal("50.00"))
+        entry = LedgerEntry.objects.first()
+        entry.amount = Decimal("5000.00")
+        with self.assertRaises(ValidationError):
+            entry.save()
+        with self.assertRaises(ValidationError):
+            entry.delete()
+
+        # nor removed with their wallet or transaction
+        transaction = self.wallet.add_balance(Decimal("10.00"))
+        with self.assertRaises(ProtectedError):
+            transaction.delete()
+        with self.assertRaises(ProtectedError):
+            self.wallet.delete()
+        self.assertEqual(LedgerEntry.objects.count(), 4)
+
+    def test_balance_at_time_reads_the_latest_snapshot(self):
+        now = timezone.now()
+        for days, amount in ((10, "100.00"), (5, "40.00"), (1, "-30.00")):
+            entries = LedgerEntry.make_movement(
+                ("clearing", None), ("available", self.wallet), Decimal(amount)
+            )
+            for entry in entries:
+                entry.created_at = now - timezone.timedelta(days=days)
+            LedgerEntry.objects.bulk_create(entries)
+
+        self.assertEqual(WalletBalanceSnapshot.take(), 1)
+        # nothing changed since the snapshot
+        self.assertEqual(WalletBalanceSnapshot.take(), 0)
+        self.assertEqual(WalletBalanceSnapshot.objects.get().available, Decimal("110.00"))
+
+        LedgerEntry.post(("clearing", None), ("available", self.wallet), Decimal("5.00"))
+        with self.assertNumQueries(2):
+            self.assertEqual(self.wallet.get_ledger_balance(), Decimal("115.00"))
+        self.assertEqual(
+            self.wallet.get_ledger_balance(at=now - timezone.timedelta(days=3)),
+            Decimal("140.00"),
+        )
+
+
+class ReconcileWalletsTests(TransactionTestCase):
+    def test_mismatches_are_reported(self):
+        wallets = [create_wallet(f"vendor{i}") for i in range(5)]
+        for wallet in wallets:
+            wallet.add_balance(Decimal("25.00"))
+            create_unsettled(wallet, "10.00")
+
+        stdout = io.StringIO()
+        call_command("reconcile_wallets", "--chunk-size", "2", stdout=stdout)
+        self.assertIn("Checked 5 wallets", stdout.getvalue())
+
+        Wallet.objects.filter(pk=wallets[3].pk).update(balance=Decimal("99.00"))
+        stderr = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command(
+                "reconcile_wallets", "--chunk-size", "2", stdout=io.StringIO(), stderr=stderr
+            )
+        self.assertIn(
+            f"Wallet {wallets[3].pk} available: 99.00 in the wallet, 25.00 in the ledger",
+            stderr.getvalue(),
+        )
@@ -0,0 +1,90 @@
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from users.models import UserAccount, Profile, NotificationOutbox
+from trayapp.utils import get_queue_backend, InMemoryQueueBackend
+
+
+@override_settings(
+    QUEUE_BACKEND="memory",
+    NOTIFICATION_OUTBOX_AUTO_DISPATCH=False,
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+)
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.user = UserAccount.objects.create_user(
+            username="testuser", email="test@example.com", password="testpass123"
+        )
+        self.profile = Profile.objects.get(user=self.user)
+        get_queue_backend().messages.clear()
+
+    def enqueue_sms(self, count):
+        for i in range(count):
+            NotificationOutbox.enqueue(
+                "new-sms-notification",
+                {"phone_number": "+2348123456789", "message": f"message {i}"},
+            )
+
+    def test_notify_me_is_sent_by_the_dispatcher(self):
+        # sms is disabled, so notify_me falls back to email
+        self.assertTrue(self.profile.notify_me("Title", "Message"))
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(NotificationOutbox.dispatch_pending(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["test@example.com"])
+        self.assertEqual(NotificationOutbox.objects.get().status, "sent")
+
+    def test_messages_are_sent_in_batches_per_queue(self):
+        self.enqueue_sms(5)
+        NotificationOutbox.enqueue("new-delivery-request", {"order_id": "1"})
+
+        with mock.patch.object(
+            InMemoryQueueBackend,
+            "send_messages",
+            autospec=True,
+            side_effect=InMemoryQueueBackend.send_messages,
+        ) as send_messages:
+            self.assertEqual(NotificationOutbox.dispatch_pending(batch_size=10), 6)
+
+        # one call per queue, not one per message
+        self.assertEqual(send_messages.call_count, 2)
+        messages = get_queue_backend().messages
+        self.assertEqual(len(messages["new-sms-notification"]), 5)
+        self.assertEqual(messages["new-sms-notification"][0]["message"], "message 0")
+        self.assertFalse(NotificationOutbox.objects.filter(status="pending").exists())
+
+    def test_failed_messages_are_retried_with_backoff(self):
+        self.enqueue_sms(3)
+
+        # only the first message goes through
+        with mock.patch.object(InMemoryQueueBackend, "send_messages", return_value=1):
+            NotificationOutbox.dispatch_pending()
+
+        self.assertEqual(NotificationOutbox.objects.filter(status="sent").count(), 1)
+        failed = NotificationOutbox.objects.filter(status="pending")
+        self.assertEqual(failed.count(), 2)
+        for outbox in failed:
+            self.assertEqual(outbox.attempts, 1)
+            self.assertGreater(outbox.next_attempt_at, timezone.now())
+
+        # nothing is due until the retry delay has passed
+        self.assertEqual(NotificationOutbox.dispatch_pending(), 0)
+
+        failed.update(next_attempt_at=timezone.now())
+        self.assertEqual(NotificationOutbox.dispatch_pending(), 2)
+        self.assertEqual(NotificationOutbox.objects.filter(status="sent").count(), 3)
+
+    def test_message_fails_after_max_attempts(self):
+        self.enqueue_sms(1)
+        with mock.patch.object(InMemoryQueueBackend, "send_messages", return_value=0):
+            for _ in range(NotificationOutbox.MAX_ATTEMPTS):
+                NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+                NotificationOutbox.dispatch_pending()
+
+        outbox = NotificationOutbox.objects.get()
+        self.assertEqual(outbox.status, "failed")
+        self.assertEqual(outbox.attempts, NotificationOutbox.MAX_ATTEMPTS)
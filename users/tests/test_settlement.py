@@ -0,0 +1,75 @@
+import io
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from users.models import UserAccount, Profile, Wallet, Transaction
+
+
+class SettleTransactionsTests(TestCase):
+    def setUp(self):
+        self.wallets = []
+        for username in ("vendor1", "vendor2"):
+            user = UserAccount.objects.create_user(
+                username=username, email=f"{username}@example.com", password="testpass123"
+            )
+            self.wallets.append(
+                Wallet.objects.create(user=Profile.objects.get(user=user), balance=10)
+            )
+
+        two_days_ago = timezone.now() - timezone.timedelta(days=2)
+        self.old = [
+            self.create_transaction(self.wallets[0], "100.00", two_days_ago),
+            self.create_transaction(self.wallets[0], "250.50", two_days_ago),
+            self.create_transaction(self.wallets[1], "40.00", two_days_ago),
+        ]
+        self.recent = self.create_transaction(self.wallets[0], "5.00")
+
+    def create_transaction(self, wallet, amount, created_at=None):
+        transaction = Transaction.objects.create(
+            wallet=wallet,
+            title="Order Payment",
+            amount=Decimal(amount),
+            _type="credit",
+            status="unsettled",
+        )
+        if created_at:
+            Transaction.objects.filter(pk=transaction.pk).update(created_at=created_at)
+        return transaction
+
+    def settle(self, *args):
+        with mock.patch.object(Profile, "notify_me") as notify_me:
+            call_command("settle_transactions", *args, stdout=io.StringIO())
+        return notify_me
+
+    def test_old_transactions_are_settled_in_chunks(self):
+        notify_me = self.settle("--chunk-size", "2")
+
+        for wallet, balance in zip(self.wallets, ("360.50", "50.00")):
+            wallet.refresh_from_db()
+            self.assertEqual(wallet.balance, Decimal(balance))
+        self.assertEqual(
+            Transaction.objects.filter(status="settled").count(), len(self.old)
+        )
+        self.recent.refresh_from_db()
+        self.assertEqual(self.recent.status, "unsettled")
+
+        # one alert per wallet
+        self.assertEqual(notify_me.call_count, 2)
+        messages = sorted(call.kwargs["message"] for call in notify_me.call_args_list)
+        self.assertTrue(messages[0].startswith("1 transaction settled, 40.00 NGN"))
+        self.assertTrue(messages[1].startswith("2 transactions settled, 350.50 NGN"))
+
+    def test_settle_all_and_run_again(self):
+        self.settle("--hours", "0")
+        self.wallets[0].refresh_from_db()
+        self.assertEqual(self.wallets[0].balance, Decimal("365.50"))
+
+        # nothing left to settle, the balances are not credited twice
+        notify_me = self.settle("--hours", "0")
+        notify_me.assert_not_called()
+        self.wallets[0].refresh_from_db()
+        self.assertEqual(self.wallets[0].balance, Decimal("365.50"))
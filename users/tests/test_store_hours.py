@@ -0,0 +1,100 @@
+from datetime import datetime, time
+
+import pytz
+from django.core.cache import cache
+from django.test import TestCase
+
+from users.models import UserAccount, Profile, Store, StoreOpenHours
+
+
+class StoreScheduleTests(TestCase):
+    """
+    The open hours of a store are compiled into a cached weekly schedule
+    and many stores are checked at the same instant without a query per store
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.stores = []
+        for i in range(5):
+            vendor = UserAccount.objects.create_user(
+                username=f"vendor{i}", email=f"vendor{i}@example.com", password="pass"
+            )
+            store = Store.objects.create(
+                vendor=Profile.objects.get(user=vendor),
+                store_name=f"Store {i}",
+                store_nickname=f"store{i}",
+                store_type="restaurant",
+                timezone="Africa/Lagos",
+            )
+            # 9:00 AM - 8:00 PM in Lagos (UTC+1), closed on Sunday
+            StoreOpenHours.objects.bulk_create(
+                [
+                    StoreOpenHours(
+                        store=store, day=day, open_time=time(9), close_time=time(20)
+                    )
+                    for day in ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+                ]
+            )
+            self.stores.append(store)
+        self.store = self.stores[0]
+
+    def at(self, day, hour, minute=0):
+        # 2024-01-01 is a Monday
+        return pytz.timezone("Africa/Lagos").localize(
+            datetime(2024, 1, day, hour, minute)
+        )
+
+    def test_compile_schedule(self):
+        schedule = StoreOpenHours.get_schedules([self.store])[self.store.id]
+        self.assertEqual(schedule["offset"], 60)
+        # Monday 8:00 AM - 7:00 PM UTC
+        self.assertEqual(schedule["days"][0], [480, 1140])
+        self.assertIsNone(schedule["days"][6])
+
+    def test_is_open_data(self):
+        is_open_data = self.store.get_is_open_data(now=self.at(1, 12))
+        self.assertTrue(is_open_data["is_open"])
+        self.assertIsNone(is_open_data["message"])
+
+        is_open_data = self.store.get_is_open_data(now=self.at(1, 19, 45))
+        self.assertTrue(is_open_data["close_soon"])
+        self.assertEqual(is_open_data["message"], "Closes today by 08:00 PM")
+
+        is_open_data = self.store.get_is_open_data(now=self.at(2, 8, 40))
+        self.assertFalse(is_open_data["is_open"])
+        self.assertTrue(is_open_data["open_soon"])
+        self.assertEqual(
+            is_open_data["message"], "Opening soon by 09:00 AM in about 20.0 minutes"
+        )
+
+        is_open_data = self.store.get_is_open_data(now=self.at(2, 6))
+        self.assertEqual(is_open_data["message"], "Opens today by 09:00 AM")
+
+        is_open_data = self.store.get_is_open_data(now=self.at(3, 21))
+        self.assertTrue(is_open_data["open_next_day"])
+
+        # closed on Sunday
+        is_open_data = self.store.get_is_open_data(now=self.at(7, 12))
+        self.assertFalse(is_open_data["is_open"])
+
+    def test_stores_are_checked_in_one_query(self):
+        now = self.at(1, 12)
+        with self.assertNumQueries(1):
+            is_open_data = Store.get_stores_is_open_data(self.stores, now=now)
+        self.assertTrue(all(data["is_open"] for data in is_open_data.values()))
+
+        # the schedules are cached
+        with self.assertNumQueries(0):
+            Store.get_stores_is_open_data(self.stores, now=now)
+
+    def test_schedule_is_invalidated_when_hours_change(self):
+        self.assertTrue(self.store.get_is_open_data(now=self.at(1, 12))["is_open"])
+
+        self.store.storeopenhours_set.filter(day="Mon").delete()
+        self.assertFalse(self.store.get_is_open_data(now=self.at(1, 12))["is_open"])
+
+    def test_invalid_timezone_is_closed(self):
+        self.store.timezone = "Nowhere/City"
+        self.store.save()
+        self.assertFalse(self.store.get_is_open_data(now=self.at(1, 12))["is_open"])
@@ -1,4 +1,5 @@
 import threading
+import logging
 from typing import Optional
 from firebase_admin import messaging
 
@@ -48,3 +49,181 @@ class FCMThread(threading.Thread):
 
     def run(self):
         self._push_notification()
+
+
+class OutboxDispatcherThread(threading.Thread):
+    """
+    Daemon thread that sends the pending rows of the notification outbox,
+    it is woken up after a commit that added rows and every `RETRY_DELAY`
+    seconds to pick up the rows waiting for a retry.
+    ```python
+    OutboxDispatcherThread.wake_up()
+    ```
+    """
+
+    _thread = None
+    _lock = threading.Lock()
+
+    def __init__(self) -> None:
+        threading.Thread.__init__(self, name="outbox-dispatcher", daemon=True)
+        self.event = threading.Event()
+
+    @classmethod
+    def wake_up(cls):
+        with cls._lock:
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._thread = cls()
+                cls._thread.start()
+        cls._thread.event.set()
+
+    def run(self):
+        from django.db import close_old_connections
+        from users.models import NotificationOutbox
+
+        while True:
+            self.event.wait(timeout=NotificationOutbox.RETRY_DELAY)
+            self.event.clear()
+            try:
+                NotificationOutbox.dispatch_pending()
+            except Exception as e:
+                logging.exception(f"Error dispatching the notification outbox: {e}")
+            finally:
+                close_old_connections()
+
+
+class ImageRenditionThread(threading.Thread):
+    """
+    Daemon thread that makes the renditions of the new uploads
+    (see trayapp.images), it is woken up after a commit that saved an upload.
+    ```python
+    ImageRenditionThread.wake_up()
+    ```
+    """
+
+    _thread = None
+    _lock = threading.Lock()
+
+    def __init__(self) -> None:
+        threading.Thread.__init__(self, name="image-renditions", daemon=True)
+        self.event = threading.Event()
+
+    @classmethod
+    def wake_up(cls):
+        with cls._lock:
+            if cls._thread is None or not cls._thread.is_alive():
+                cls._thread = cls()
+                cls._thread.start()
+        cls._thread.event.set()
+
+    def run(self):
+        from django.db import close_old_connections
+        from trayapp.images import process_pending_images
+
+        while True:
+            self.event.wait()
+            self.event.clear()
+            try:
+                process_pending_images()
+            except Exception as e:
+                logging.exception(f"Error making the image renditions: {e}")
+            finally:
+                close_old_connections()
+
+
+class PaymentEventWorkerThread(threading.Thread):
+    """
+    Pool of daemon threads that process the stored Paystack webhook events
+    (see core.models.PaymentEvent), woken up after a commit that stored an event
+    and every `PaymentEvent.RETRY_DELAY` seconds to pick up the retries.
+    The events of the same order are serialized by `PaymentEvent.lock_reference`.
+    ```python
+    PaymentEventWorkerThread.wake_up()
+    ```
+    """
+
+    _threads = []
+    _lock = threading.Lock()
+
+    def __init__(self, number) -> None:
+        threading.Thread.__init__(self, name=f"payment-events-{number}", daemon=True)
+        self.event = threading.Event()
+
+    @classmethod
+    def wake_up(cls):
+        from django.conf import settings
+
+        with cls._lock:
+            cls._threads = [thread for thread in cls._threads if thread.is_alive()]
+            while len(cls._threads) < settings.PAYMENT_EVENT_WORKERS:
+                thread = cls(len(cls._threads))
+                thread.start()
+                cls._threads.append(thread)
+        for thread in cls._threads:
+            thread.event.set()
+
+    def run(self):
+        from django.db import close_old_connections
+        from core.models import PaymentEvent
+
+        while True:
+            self.event.wait(timeout=PaymentEvent.RETRY_DELAY)
+            self.event.clear()
+            try:
+                PaymentEvent.process_pending()
+            except Exception as e:
+                logging.exception(f"Error processing the payment events: {e}")
+            finally:
+                close_old_connections()
+
+
+class BufferFlusherThread(threading.Thread):
+    """
+    Daemon thread that saves the write-behind buffers (the view, click and rank
+    counts and the user activities) every `CounterBuffer.FLUSH_INTERVAL` seconds,
+    and once more when the process exits.
+    ```python
+    BufferFlusherThread.start_once()
+    ```
+    """
+
+    _thread = None
+    _lock = threading.Lock()
+
+    def __init__(self) -> None:
+        threading.Thread.__init__(self, name="buffer-flusher", daemon=True)
+
+    @classmethod
+    def start_once(cls):
+        if cls._thread is not None and cls._thread.is_alive():
+            return
+        with cls._lock:
+            if cls._thread is None or not cls._thread.is_alive():
+                import atexit
+
+                if cls._thread is None:
+                    atexit.register(cls.flush)
+                cls._thread = cls()
+                cls._thread.start()
+
+    @staticmethod
+    def flush():
+        from trayapp.counters import flush_counters
+        from users.models import UserActivity
+
+        for flush_buffer in (flush_counters, UserActivity.flush_buffer):
+            try:
+                flush_buffer()
+            except Exception as e:
+                logging.exception(f"Error flushing the write-behind buffers: {e}")
+
+    def run(self):
+        import time
+        from django.db import close_old_connections
+        from trayapp.counters import CounterBuffer
+
+        while True:
+            time.sleep(CounterBuffer.FLUSH_INTERVAL)
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
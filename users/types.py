@@ -3,6 +3,8 @@ from graphene_django.types import DjangoObjectType
 from graphql_auth.schema import UserNode
 
 from trayapp.utils import convert_time_to_ago
+from trayapp.counters import STORE_RANK_COUNTER
+from trayapp.images import get_rendition_urls
 
 from users.filters import TransactionFilter, StoreFilter
 from .models import (
@@ -42,11 +44,27 @@ class HostelFieldType(DjangoObjectType):
         return self.get_options()
 
 
+class ImageRenditionType(graphene.ObjectType):
+    webp = graphene.String()
+    jpeg = graphene.String()
+
+
+class ImageRenditionsType(graphene.ObjectType):
+    """
+    Urls of the sized copies of an image, null until they are made
+    """
+
+    thumb = graphene.Field(ImageRenditionType)
+    card = graphene.Field(ImageRenditionType)
+    full = graphene.Field(ImageRenditionType)
+
+
 class ProfileType(DjangoObjectType):
     store = graphene.Field("users.types.StoreType")
     gender = graphene.String()
     required_fields = graphene.List(graphene.String)
     has_required_fields = graphene.Boolean()
+    image_renditions = graphene.Field(ImageRenditionsType)
 
     class Meta:
         model = Profile
@@ -59,6 +77,11 @@ class ProfileType(DjangoObjectType):
             image = None
         return image
 
+    def resolve_image_renditions(self: Profile, info):
+        return get_rendition_urls(
+            self.image_renditions, self.image.storage, info.context
+        )
+
     def resolve_store(self, info, *args, **kwargs):
         # check if the user roles is student
         return self.store
@@ -249,6 +272,8 @@ class StoreType(DjangoObjectType):
     store_categories = graphene.List(graphene.String)
     store_image = graphene.String()
     store_cover_image = graphene.String()
+    store_image_renditions = graphene.Field(ImageRenditionsType)
+    store_cover_image_renditions = graphene.Field(ImageRenditionsType)
     store_items = graphene.List("product.types.ItemType")
     store_menu = graphene.List(graphene.String)
     store_open_hours = graphene.List(StoreOpenHours)
@@ -260,12 +285,16 @@ class StoreType(DjangoObjectType):
 
     can_accept_orders = graphene.Boolean()
     is_open_data = graphene.Field(isStoreOpenData)
+    # distance in km from the searched location, set by nearby stores
+    distance = graphene.Float()
 
     location = None
+    geo_cell = None
 
     class Meta:
         model = Store
-        fields = "__all__"
+        # the search columns are internal, see trayapp.search
+        exclude = ["search_document", "search_vector"]
 
     def resolve_store_id(self, info):
         return self.id
@@ -308,6 +337,21 @@ class StoreType(DjangoObjectType):
             pass
         return cover_image
 
+    def resolve_store_image_renditions(self: Store, info):
+        vendor = self.vendor
+        if vendor is None:
+            return None
+        return get_rendition_urls(
+            vendor.image_renditions, vendor.image.storage, info.context
+        )
+
+    def resolve_store_cover_image_renditions(self: Store, info):
+        return get_rendition_urls(
+            self.store_cover_image_renditions,
+            self.store_cover_image.storage,
+            info.context,
+        )
+
     def resolve_store_open_hours(self, info):
         return self.store_open_hours
 
@@ -326,6 +370,12 @@ class StoreType(DjangoObjectType):
     def resolve_can_accept_orders(self: Store, info):
         return self.can_accept_orders()
 
+    def resolve_store_rank(self: Store, info):
+        return STORE_RANK_COUNTER.get_value(self)
+
+    def resolve_distance(self: Store, info):
+        return getattr(self, "distance", None)
+
     def resolve_is_open_data(self: Store, info):
         is_open_data = self.get_is_open_data()
         return isStoreOpenData(
@@ -336,6 +386,7 @@ class StoreType(DjangoObjectType):
 class StoreNode(StoreType, graphene.ObjectType):
     class Meta:
         model = Store
+        exclude = ["search_document", "search_vector"]
         interfaces = (graphene.relay.Node,)
         filterset_class = StoreFilter
 